@@ -0,0 +1,95 @@
+"""
+Times the conversion stage XWBCreator.export_input runs, pydub's against PCMConverter, with and without --normalize
+------------------------------------------------------------------------------------------------------------------
+python -m benchmarks.bench_pcm
+python -m benchmarks.bench_pcm --seconds 60 --rate 32000 --channels 1
+"""
+import math
+import time
+import argparse
+
+import numpy as np
+
+from pydub import AudioSegment
+
+from config.utils.pcm import PCMConverter
+
+
+def song(seconds: float, rate: int = 44100) -> AudioSegment:
+    # a few tones and some noise swelling in and out, something like music as far as the stages can tell
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    left = sum(0.15 * np.sin(2 * np.pi * f * t) for f in (55, 220, 1000, 5000))
+    right = sum(0.15 * np.sin(2 * np.pi * f * t + 1) for f in (110, 440, 2000, 9000))
+    swell = 0.5 + 0.5 * np.abs(np.sin(t * 0.3))
+    samples = np.stack([left, right], axis=1) * swell[:, None] + rng.normal(0, 0.02, (len(t), 2))
+    data = np.clip(samples * 32767, -32768, 32767).astype("<i2")
+    return AudioSegment(data=data.tobytes(), sample_width=2, frame_rate=rate, channels=2)
+
+
+def tone_error(convert, rate: int, new_rate: int, frequency: float) -> float:
+    """
+    Everything but the tone after converting one, in dB relative to the tone (THD+N)
+    """
+    t = np.arange(rate * 2) / rate
+    data = np.round(0.5 * np.sin(2 * np.pi * frequency * t) * 32767).astype("<i2")
+    segment = AudioSegment(data=data.tobytes(), sample_width=2, frame_rate=rate, channels=1)
+    output = PCMConverter.to_array(convert(segment, new_rate))[:, 0].astype(np.float64)
+    # the edges aren't what's measured, and the tone is fitted whatever delay the filters add
+    output = output[new_rate // 4:-new_rate // 4]
+    t = np.arange(len(output)) / new_rate
+    basis = np.stack([np.sin(2 * np.pi * frequency * t), np.cos(2 * np.pi * frequency * t)], axis=1)
+    tone = basis @ np.linalg.lstsq(basis, output, rcond=None)[0]
+    return 10 * math.log10(np.mean((output - tone) ** 2) / np.mean(tone ** 2))
+
+
+def pydub_convert(segment: AudioSegment, rate: int, channels: int = 1, loudness: float = None) -> AudioSegment:
+    output = segment.set_frame_rate(rate).set_sample_width(2).set_channels(channels)
+    return output if loudness is None else PCMConverter.normalize(output, loudness)
+
+
+def numpy_convert(segment: AudioSegment, rate: int, channels: int = 1, loudness: float = None) -> AudioSegment:
+    return PCMConverter.convert(segment, rate, channels, loudness)
+
+
+def best_of(repeats: int, func, *args) -> float:
+    times = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=240)
+    parser.add_argument("--rate", type=int, default=48000)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    segment = song(args.seconds)
+    samples = PCMConverter.to_array(segment)
+    print(f"{args.seconds:g} s of 44100 Hz stereo to {args.rate} Hz, {args.channels} channel(s), "
+          f"best of {args.repeats}")
+
+    measure = best_of(args.repeats, PCMConverter.loudness, samples, segment.frame_rate)
+    print(f"  {'loudness measurement':<24} {measure:7.3f} s")
+
+    for name, convert in (("pydub", pydub_convert), ("numpy", numpy_convert)):
+        plain = best_of(args.repeats, convert, segment, args.rate, args.channels)
+        normalized = best_of(args.repeats, convert, segment, args.rate, args.channels, -14.0)
+        print(f"  {name:<24} {plain:7.3f} s, {normalized:7.3f} s normalized ({normalized / plain - 1:+.0%})")
+
+    print("error converting a tone from 44100 Hz, lower is better")
+
+    for frequency in (100, 1000, 10000, 18000):
+        errors = [tone_error(convert, 44100, args.rate, frequency) for convert in (pydub_convert, numpy_convert)]
+        print(f"  {frequency:>5} Hz  pydub {errors[0]:6.1f} dB  numpy {errors[1]:6.1f} dB")
+
+
+if __name__ == "__main__":
+    main()
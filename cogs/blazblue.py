@@ -1,36 +1,81 @@
+import io
 import os
+import shutil
+import struct
 import asyncio
+import functools
 import typing
+import urllib.parse
 
 from pathlib import Path
-from io import BytesIO
 
+import aiohttp
 import discord
 
-from config.utils.xwb import XWBCreator, XWBCreatorError, XSBEditor
+from config.utils.xwb import XWBCreator, XWBCreatorError, XSBEditor, XSBEditorError, encode_track, \
+    pack_music, AudioSegment
 from config.utils.ytdl import YTDL, YTDLError
 from config.utils.filebin import FileBin
-from config.utils.convertors import AudioConverter
+from config.utils.convertors import AudioConverter, MusicOptions, parse_timestamp
 from config.utils.pacfile import FileHeader
+from config.utils.scheduler import Job
+from config.utils.bundle import Bundler
+from config.utils.pacpatch import PacPatch, PacPatchError, APPLIER_PATH
+from config.utils.paccompress import PacCompression, HeadDecompressor
+from config.utils.wavebank import WaveBank, WaveBankError
+from config.utils.templates import TemplateFile, TemplateError
+from config.utils.requests import RequestFailed
+from config.utils.admission import Probe
+from config import config
 
 
 from discord.ext import commands
 
 from main import ES
 
+DM_UPLOAD_LIMIT = 8388608
+# regular and compressed .pac files
+PAC_MAGIC_WORDS = ("FPAC", "DFAS")
+
 
 class BlazBlue(commands.Cog):
     """
     Blazblue related commands
     """
+    # bytes fetched at a time while reading a .pac's header, the biggest header inspect reads, how many
+    # .pac files it reads at once and the most bytes one inspect fetches altogether
+    HEADER_CHUNK = 65536
+    MAX_HEADER_SIZE = 16777216
+    INSPECT_CONCURRENCY = 16
+    INSPECT_MAX_BYTES = 67108864
+    # enough of a wave bank to count its entries
+    BANK_HEAD = 4096
+    # the only hosts inspect fetches from, discord's attachment links
+    ATTACHMENT_HOSTS = ("cdn.discordapp.com", "media.discordapp.net")
+    # the longest clip preview sends
+    PREVIEW_SECONDS = 30
 
     def __init__(self, bot):
         self.bot = bot
         self.creator = XWBCreator
+        self.resampler = getattr(config, "__resampler__", "pydub")
+        self.loudness_target = getattr(config, "__loudness_target__", -14.0)
+
+    async def upload_to_filebin(self, ctx: commands.Context, filename: str, file_directory: str, user_id: int) -> None:
+
+        # served by the bot itself instead when __fallback_host__ is "local"
+        if self.bot.artifacts is not None:
+            artifact = self.bot.artifacts.publish(file_directory, filename)
 
-    async def upload_to_filebin(self, ctx: commands.Context, file: discord.File, file_directory: str, user_id: int) -> None:
+            m = f"Here's your modified .pac file (exceeded upload size limits):\n"
+            m += f"Filename: `{artifact.filename}`\n"
+            m += f"Size: `{artifact.size / 1048576:.1f} MB`\n"
+            m += f"Expires: `{artifact.expires_at}`\n"
+            m += f"Download link: <{artifact.download_link}>"
 
-        file = await FileBin.upload_file(ctx, file.filename, file_directory, user_id)
+            return await ctx.send(m)
+
+        file = await FileBin.upload_file(ctx, filename, file_directory, user_id)
 
         m = f"Here's your modified .pac file (uploaded to file.io exceeded upload size limits):\n"
         m += f"Filename: `{file.filename}`\n"
@@ -40,29 +85,179 @@ class BlazBlue(commands.Cog):
 
         await ctx.send(m)
 
-    async def generate_discord_file(self, ctx: commands.Context, audio: typing.Union[discord.Attachment, str],
-                                    pac_file: discord.Attachment, temp_dir: str) -> [tuple[discord.File, str],
-                                                                                     discord.Message]:
-        # catching exceptions so the rest of the coroutines can run without issue if one fails
+    @staticmethod
+    def plan_music_jobs(pac_files: list[discord.Attachment],
+                        audio_files: list[typing.Union[discord.Attachment, str]], bank: bool = False) -> \
+            list[tuple[list[typing.Union[discord.Attachment, str]], list[discord.Attachment]]]:
+        # with --bank every audio file/url goes into one bank that every .pac file gets
+        if bank:
+            return [(audio_files, pac_files)]
+
+        # .pac files are paired with audio by upload order and any extra .pac files reuse the last audio file/url
+        # .pac files sharing the same audio are grouped so its .xwb only gets made once
+        jobs = {}
+
+        for i, pac_file in enumerate(pac_files):
+            audio = audio_files[min(i, len(audio_files) - 1)]
+            key = audio if isinstance(audio, str) else audio.id
+            jobs.setdefault(key, ([audio], []))[1].append(pac_file)
+
+        return list(jobs.values())
+
+    async def replace_in_pac(self, ctx: commands.Context, job_dir: str,
+                             pac_file: discord.Attachment, pac_name: str, options: MusicOptions,
+                             compressed: bool = False) -> [tuple[str, str], discord.Message]:
+        xwb_name = pac_file.filename.replace(".pac", "")
+        xwb_path = job_dir + xwb_name + ".xwb"
+        pac_path = Path(os.path.join(job_dir, pac_name + ".pac"))
+        original_path = os.path.join(job_dir, pac_name + ".original.pac")
+
+        if options.patch:
+            # replacing swaps a new file in, so a hard link keeps the original around without copying it
+            try:
+                os.link(pac_path, original_path)
+            except OSError:
+                shutil.copyfile(pac_path, original_path)
+
         try:
-            aud_format, aud = await self.get_audio_data(ctx.bot, audio)
+            index = pac_file.index if isinstance(pac_file, TemplateFile) else None
+            index = await ctx.bot.offload("pack", pack_music, str(pac_path), xwb_path, xwb_name, options.volume,
+                                          index, executor=None)
 
-            xwb_name = pac_file.filename.replace(".pac", "")
-            pac_name = YTDL.generate_unique_filename()
-            pac_path = Path(os.path.join(temp_dir, pac_name + ".pac"))
+            if options.patch:
+                patch_path = os.path.join(job_dir, pac_name + ".espatch")
+                # built from the header the rewrite left behind instead of parsing the output again
+                await ctx.bot.loop.run_in_executor(None, PacPatch.create, original_path, str(pac_path), patch_path,
+                                                   index)
+
+                return patch_path, xwb_name + ".espatch"
+
+            # sent back the way it came in
+            if compressed:
+                await ctx.bot.loop.run_in_executor(None, PacCompression.compress_in_place, pac_path)
+
+        except XWBCreatorError as e:
+            return await ctx.send(f"{e}")
+
+        except XSBEditorError as e:
+            return await ctx.send(f"{e}")
+
+        except PacPatchError as e:
+            return await ctx.send(f"{e}")
+
+        return str(pac_path), xwb_name + ".pac"
+
+    async def fit_budget(self, ctx: commands.Context, saves: typing.Awaitable, job_dir: str,
+                         pac_files: list[discord.Attachment], pac_names: list[str]) -> int:
+        """
+        The most bytes the new .xwb can take for every .pac it goes into to still fit in one upload
+        """
+        await saves
+        limit = self.upload_limit(ctx)
+        budgets = []
+
+        for pac_file, pac_name in zip(pac_files, pac_names):
+            pac_path = Path(os.path.join(job_dir, pac_name + ".pac"))
+            header = pac_file.header(pac_path) if isinstance(pac_file, TemplateFile) else \
+                await FileHeader.open(pac_path)
+            xwb_file = XWBCreator.find_in_pac(header, pac_file.filename.replace(".pac", "") + ".xwb")
+            # everything but the .xwb stays as it is
+            budgets.append(limit - (header.file_size - xwb_file.file_size))
+
+        return min(budgets)
+
+    async def check_bank_entries(self, saves: typing.Awaitable, job_dir: str, pac_files: list[discord.Attachment],
+                                 pac_names: list[str], count: int):
+        """
+        Several songs only go into a .pac whose wave bank already has that many, its .xsb's cues are left as
+        they are, so a song without a cue of its own could never be played
+        """
+        await saves
+
+        for pac_file, pac_name in zip(pac_files, pac_names):
+            pac_path = Path(os.path.join(job_dir, pac_name + ".pac"))
+            header = pac_file.header(pac_path) if isinstance(pac_file, TemplateFile) else \
+                await FileHeader.open(pac_path)
+            xwb_file = XWBCreator.find_in_pac(header, pac_file.filename.replace(".pac", "") + ".xwb")
+
+            try:
+                entries = WaveBank.entry_count_of(await header.read_async(xwb_file, self.BANK_HEAD))
+            except WaveBankError as e:
+                raise XWBCreatorError(f"{pac_file.filename}: {e}")
+
+            if entries != count:
+                raise XWBCreatorError(f"{pac_file.filename} has {entries} song(s) and {count} were supplied, "
+                                      f"--bank only replaces the songs a .pac already has.")
+
+    async def encode_tracks(self, ctx: commands.Context, audios: list[typing.Union[discord.Attachment, str]],
+                            job_dir: str, job: Job, options: MusicOptions,
+                            budget: typing.Awaitable[int] = None,
+                            downloads: asyncio.Semaphore = None) -> tuple[list[str], list[tuple], list[list[str]]]:
+        """
+        Downloads and encodes every audio file/url into its own adpcm wav inside job_dir, each one is encoded as
+        soon as it's downloaded while the rest are still downloading
+        returns the wavs' filenames, their tracks (see XWBCreator.track) and what was changed to fit the budget
+        in the order of audios
+        :param budget: Resolves to the bytes all the tracks have to fit in together, waited on after downloading
+        :param downloads: Bounds how many files/urls download at once, shared by every bank of a command
+        """
+        downloads = downloads or asyncio.Semaphore(len(audios))
+        wav_names = [f"track{i}.wav" for i in range(len(audios))]
+        loudness = {"loudness": self.loudness_target} if options.normalize else {}
+
+        async def encode(audio, wav_name):
+            async with downloads:
+                aud_format, aud = await self.get_audio_data(ctx.bot, audio, job_dir, job, options)
+
+            # a bank's tracks split its budget evenly, their lengths aren't known until they're decoded
+            fit = {} if budget is None else {"budget": await budget // len(audios)}
+            # urls only come down trimmed already, uploads are trimmed by seeking when they're decoded
+            trim = {} if isinstance(audio, str) else {"start": options.start, "duration": options.duration}
+            # decoding, resampling and encoding are cpu bound, so each track gets its own process
+            return await ctx.bot.offload("encode", encode_track, job_dir, aud, aud_format, wav_name,
+                                         resampler=self.resampler, loop=options.loop, **trim, **fit, **loudness)
+
+        results = await asyncio.gather(*[encode(audio, wav_name) for audio, wav_name in zip(audios, wav_names)])
+        return wav_names, [track for track, _ in results], [changes for _, changes in results]
+
+    async def generate_discord_files(self, ctx: commands.Context,
+                                     audios: list[typing.Union[discord.Attachment, str]],
+                                     pac_files: list[discord.Attachment], job: Job, options: MusicOptions,
+                                     downloads: asyncio.Semaphore = None) -> [list[tuple[str, str]], discord.Message]:
+        # catching exceptions so the rest of the coroutines can run without issue if one fails
+        try:
+            # each bank gets its own directory so the wavs' names can't clash with another's
+            job_dir = os.path.join(job.workspace, YTDL.generate_unique_filename()) + "/"
+            ctx.bot.create_directory(job_dir)
 
-            await pac_file.save(pac_path)
+            pac_names = [YTDL.generate_unique_filename() for _ in pac_files]
+            saves = asyncio.ensure_future(asyncio.gather(
+                *[self.save_pac(pac_file, Path(os.path.join(job_dir, pac_name + ".pac")))
+                  for pac_file, pac_name in zip(pac_files, pac_names)]))
+            # a patch is small whatever the .pac's size, so there's nothing to fit
+            budget = None
 
-            xw = self.creator(xwb_name,
-                              pac_name,
-                              audio_file=aud,
-                              audio_file_format=aud_format,
-                              directory=temp_dir)
-            xw.create_xwb()
-            xw.replace_xwb()
+            if options.fit and not options.patch:
+                budget = asyncio.ensure_future(self.fit_budget(ctx, saves, job_dir, pac_files, pac_names))
 
-            file = discord.File(pac_path)
-            file.filename = xwb_name + ".pac"
+            try:
+                # checked before anything's downloaded, so songs a bank can't take aren't encoded for nothing
+                if len(audios) > 1:
+                    await self.check_bank_entries(saves, job_dir, pac_files, pac_names, len(audios))
+
+                (wav_names, tracks, changes), compressed = await asyncio.gather(
+                    self.encode_tracks(ctx, audios, job_dir, job, options, budget, downloads), saves)
+            finally:
+                # whatever failed, neither is left running for nothing or finishes with an exception nobody reads,
+                # a failed save also fails the budget waiting on it
+                for future in (saves, budget):
+                    if future is None:
+                        continue
+
+                    if not future.done():
+                        future.cancel()
+                    elif not future.cancelled():
+                        future.exception()
 
         except YTDLError as e:
             return await ctx.send(f"{e}")
@@ -70,13 +265,41 @@ class BlazBlue(commands.Cog):
         except XWBCreatorError as e:
             return await ctx.send(f"{e}")
 
-        return file, pac_name
+        if any(changes):
+            lines = [f"{audio if isinstance(audio, str) else audio.filename}: {', '.join(track_changes)}"
+                     for audio, track_changes in zip(audios, changes) if track_changes]
+            await ctx.send("> :information_source: | To fit in one upload:\n" + "\n".join(lines))
+
+        # XWBTool names the bank inside the .xwb after its output file and each stage's .xsb finds its bank
+        # by that name, so the shared encode is packed once per distinct .xwb name
+        xwb_names = list(dict.fromkeys(pac_file.filename.replace(".pac", "") for pac_file in pac_files))
+        results = await asyncio.gather(*[ctx.bot.xwb_tool.convert(job_dir, name + ".xwb", wav_names)
+                                         for name in xwb_names],
+                                       return_exceptions=True)
+        failed = set()
+
+        for name, result in zip(xwb_names, results):
+            if isinstance(result, XWBCreatorError):
+                failed.add(name)
+                await ctx.send(f"{result}")
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                try:
+                    await ctx.bot.loop.run_in_executor(None, XWBCreator.validate_bank, result, tracks)
+                except XWBCreatorError as e:
+                    failed.add(name)
+                    await ctx.send(f"{e}")
+
+        files = await asyncio.gather(*[self.replace_in_pac(ctx, job_dir, pac_file, pac_name, options, was_compressed)
+                                       for pac_file, pac_name, was_compressed in zip(pac_files, pac_names, compressed)
+                                       if pac_file.filename.replace(".pac", "") not in failed])
+
+        return [f for f in files if isinstance(f, tuple)]
 
     async def process_xsb_file(self, header, file_path, file_name, sound_byte):
         editor = XSBEditor(file_path)
-        editor.write_sound(sound_byte)
-        editor.write_track(sound_byte)
-        editor.calculate_checksum()
+        await editor.write_volume_async(sound_byte)
 
         to_replace = None
 
@@ -90,14 +313,14 @@ class BlazBlue(commands.Cog):
         if to_replace is None:
             return f"Replacing the xsb ran into error: The file {file_name} was not found in the .pac."
 
-        header.replace(to_replace, file_path)
+        await header.replace_async(to_replace, file_path)
 
     async def handle_pac_file(self, pac_file, volume, temp_dir):
         pac_name = YTDL.generate_unique_filename()
         pac_path = Path(os.path.join(temp_dir, pac_name + ".pac"))
-        await pac_file.save(pac_path)
-        header = FileHeader(pac_path)
-        header.extract_all_files(temp_dir)
+        compressed = await self.save_pac(pac_file, pac_path)
+        header = pac_file.header(pac_path) if isinstance(pac_file, TemplateFile) else await FileHeader.open(pac_path)
+        await header.extract_all_files_async(temp_dir)
         # [!seq] -> matches any character not in seq
         files = XWBCreator.get_files(f"*.[!pac]*", temp_dir)
 
@@ -107,6 +330,10 @@ class BlazBlue(commands.Cog):
 
             if file_name.endswith(".xsb"):
                 await self.process_xsb_file(header, file_path, file_name, volume)
+
+                if compressed:
+                    await self.bot.loop.run_in_executor(None, PacCompression.compress_in_place, pac_path)
+
                 return header
 
     async def generate_pac_files(self, pac_file, volume, ctx, temp_dir):
@@ -124,81 +351,144 @@ class BlazBlue(commands.Cog):
 
         header = await self.handle_pac_file(pac_file, sound_byte, temp_dir)
 
-        upload_file = discord.File(header.file_path)
-        upload_file.filename = pac_file.filename
-        return upload_file, pac_name
+        return str(header.file_path), pac_file.filename
 
 
-    async def upload_files(self, ctx, files, temp_dir):
-        upload_files_tasks = []
-        for file, name in files:
-            try:
-                await ctx.send("Here's your modified .pac file", file=file)
-            except discord.errors.HTTPException:
-                # file was too big to be sent
-                # upload it to file.io
-                fn = file.filename
-                await ctx.send(f"{fn} is too big to be uploaded to discord and will be shortly uploaded to file.io")
-                task = asyncio.create_task(
-                    self.upload_to_filebin(ctx, file, os.path.join(temp_dir, f"{name}.pac"), ctx.author.id))
-                upload_files_tasks.append(task)
+    @staticmethod
+    def upload_limit(ctx: commands.Context) -> int:
+        limit = getattr(config, "__upload_limit__", 0)
+
+        if limit:
+            return limit
+
+        return ctx.guild.filesize_limit if ctx.guild else DM_UPLOAD_LIMIT
+
+    async def upload_files(self, ctx, files: list[tuple[str, str]], temp_dir: str,
+                           content: str = "Here's your modified .pac file(s)"):
+        """
+        :param files: (path, filename) of every file to send
+        """
+        limit = self.upload_limit(ctx)
+        # several files per message, the ones that don't fit in any are known before anything is uploaded
+        oversized = await ctx.bot.delivery.send(ctx, files, limit, content)
+
+        if not oversized:
+            return
+
+        # compressing them into archives that fit before falling back to file.io
+        bundler = Bundler(limit, temp_dir, getattr(config, "__bundle_format__", "7z"))
+        bundles, leftovers = await ctx.bot.loop.run_in_executor(None, bundler.bundle, oversized)
+        members = {path: bundled for path, _, bundled in bundles}
+
+        for path, _ in await ctx.bot.delivery.send(ctx, [(path, name) for path, name, _ in bundles], limit,
+                                                   f"{content}, compressed to fit the upload size limit"):
+            leftovers.extend(members[path])
+
+        if leftovers:
+            # files too big to be sent are uploaded to file.io, all at once
+            await ctx.send(f"{', '.join(name for _, name in leftovers)} "
+                           f"{'is' if len(leftovers) == 1 else 'are'} too big to be uploaded to discord and will be "
+                           f"shortly uploaded to file.io")
+            await asyncio.gather(*[self.upload_to_filebin(ctx, name, path, ctx.author.id) for path, name in leftovers])
+
+    async def save_pac(self, pac_file: typing.Union[discord.Attachment, TemplateFile], pac_path: Path) -> bool:
+        await pac_file.save(pac_path)
 
-        await asyncio.gather(*upload_files_tasks)
+        # templates are kept decompressed already
+        if isinstance(pac_file, TemplateFile):
+            return pac_file.compressed
 
+        # compressed archives are decompressed up front so everything after only deals with FPAC
+        return await self.bot.loop.run_in_executor(None, PacCompression.decompress_in_place, pac_path,
+                                                   self.bot.admission.decompressed_limit())
 
     async def check_if_pac(self, argument: discord.Attachment) -> bool:
 
+        # checked when it was registered
+        if isinstance(argument, TemplateFile):
+            return True
+
         if not isinstance(argument, discord.Attachment):
             return False
 
-        magic_word = (await argument.read())[:4].decode("ASCII")
+        magic_word = (await argument.read())[:4].decode("ASCII", errors="replace")
 
         # has file extension
         if argument.content_type:
             if "application/x-ns-proxy-autoconfig" not in argument.content_type:
                 return False
 
-            if magic_word != "FPAC":
+            if magic_word not in PAC_MAGIC_WORDS:
                 raise commands.BadArgument(f"The .pac file {argument.filename} has an incorrect structure.")
 
         else:
             # no file extension so only checking the magic word
-            return magic_word == "FPAC"
+            return magic_word in PAC_MAGIC_WORDS
 
         return True
 
     @staticmethod
-    async def get_audio_data(bot: ES, audio: typing.Union[discord.Attachment, str]) -> [str, BytesIO]:
-
-        aud = BytesIO()
-
+    async def get_audio_data(bot: ES, audio: typing.Union[discord.Attachment, str], directory: str,
+                             job: Job, options: MusicOptions) -> [str, str]:
+        # audio is written into the job's directory so the decoder runs on a path that can be found on cancel
         if isinstance(audio, str):
-            audio = await YTDL.create_mp3(bot, audio)
-            aud = audio.audio
+            audio = await YTDL.create_mp3(bot, audio, directory=directory, cancel_event=job.cancel_event,
+                                          start=options.start, end=options.end)
+            path = audio.audio
 
         else:
-            await audio.save(aud)
-            aud.seek(0)
+            path = os.path.join(directory, YTDL.generate_unique_filename())
+            await audio.save(Path(path))
 
         _, extension = os.path.splitext(audio.filename)
 
         extension = extension.replace(".", "")
 
-        return extension, aud
+        return extension, path
 
-    async def categorize_files(self, ctx: commands.Context,
-                               files: list[typing.Union[str, discord.Attachment]]) -> [typing.List, typing.List]:
+    async def categorize_files(self, ctx: commands.Context, files: list[typing.Union[str, discord.Attachment]],
+                               keep_playlist: bool = False) -> [typing.List, typing.List]:
         pac_files = []
         audio_files = []
+        converter = AudioConverter(keep_playlist)
 
         for file in files:
             if await self.check_if_pac(file):
                 pac_files.append(file)
             else:
-                audio_files.append(await AudioConverter().convert(ctx, file))
+                audio_files.append(await converter.convert(ctx, file))
 
         return pac_files, audio_files
 
+    @staticmethod
+    async def expand_playlists(audio_files: list[typing.Union[str, discord.Attachment]],
+                               limit: int) -> tuple[list[typing.Union[str, discord.Attachment]], dict[str, Probe]]:
+        """
+        Replaces every url with the songs of its playlist, each playlist's metadata is read once and at the same
+        time as the others', returns the audio files/urls and the length of every song the metadata had
+        """
+        async def resolve(audio):
+            # uploads are left as they are
+            if isinstance(audio, str):
+                return await YTDL.resolve_playlist(audio, limit)
+
+        resolved = await asyncio.gather(*[resolve(audio) for audio in audio_files])
+        expanded = []
+        known = {}
+
+        for audio, entries in zip(audio_files, resolved):
+            if entries is None:
+                expanded.append(audio)
+                continue
+
+            for entry in entries:
+                expanded.append(entry["url"])
+
+                if entry["duration"] is not None:
+                    known[entry["url"]] = Probe(duration=entry["duration"])
+
+        return expanded, known
+
     @commands.command(invoke_without_command=True, aliases=["mc"])
     async def music(self, ctx: commands.Context, files: commands.Greedy[discord.Attachment], *,
                     urls: typing.Optional[str]):
@@ -206,19 +496,42 @@ class BlazBlue(commands.Cog):
            .pac file(s) are edited by order of their upload and are paired to one audio file/url
            if there are multiple .pac files and one audio file/url all .pac files will get edited
            with said audio and vice versa.
+           options:
+           --patch sends a small patch to apply to your original .pac file(s) instead of the whole file
+           --start 1:30 / --end 2:45 only use that section of the song (only that section is downloaded)
+           --loop 0:12 where the song loops back to once it ends, counted from --start
+           --bank replaces every song of a .pac that has several, e.g. vs themes, with the audio files/urls
+           in order, there has to be one for each of its songs
+           --volume 0-255 also sets the music's volume
+           --fit lowers the quality, and only if that isn't enough cuts the song short, so the .pac fits in one
+           upload instead of being sent as a link
+           --normalize evens out the song's loudness so it's neither drowned out nor blaring in game
+           --playlist uses a playlist url's songs in order, one per .pac file (or every song with --bank)
+           a template's name (see es template list) can be used in place of a .pac file
            -------------------------------------------------------------
            es music pac_file url or audio_file
            es music pac_file pac_file pac_file url audio_file url
            es music pac_file pac_file audio_file
+           es music pac_file url --patch
+           es music pac_file url --start 1:30 --end 2:45 --loop 0:12
+           es music pac_file url url --bank --volume 200
+           es music pac_file url --fit
+           es music pac_file url --normalize
+           es music pac_file pac_file pac_file playlist_url --playlist
+           es music template_name url
            """
 
-        if len(files) == 0:
+        if len(files) == 0 and not urls:
             return await ctx.send(":no_entry: | no file(s) were supplied.")
 
-        if urls:
-            files.extend(urls.split())
+        options = await MusicOptions.convert(ctx, urls)
+        # before categorizing, which downloads every attachment
+        self.bot.admission.check_sizes(ctx, files)
+        templates = [self.bot.templates.get(url) for url in options.urls if url in self.bot.templates]
+        files.extend(url for url in options.urls if url not in self.bot.templates)
 
-        pac_files, audio_files = await self.categorize_files(ctx, files)
+        pac_files, audio_files = await self.categorize_files(ctx, files, options.playlist)
+        pac_files.extend(templates)
 
         if len(pac_files) == 0:
             return await ctx.send(":no_entry: | no .pac file(s) was supplied.")
@@ -226,27 +539,53 @@ class BlazBlue(commands.Cog):
         if len(audio_files) == 0:
             return await ctx.send(":no_entry: | no audio file(s) or url(s) was supplied.")
 
-        check = len(pac_files) - len(audio_files)
-
-        if check > 0:
-            # duplicate the last item in the list until it's the same size as the pac file list
-            audio_files = audio_files + [audio_files[-1]] * check
+        known = {}
 
-        async with ctx.typing():
-            temp_dir = os.path.join(os.getcwd(), f"temp/{ctx.author.id}/")
-            upload_files_tasks = []
+        if options.playlist:
+            # without --bank songs past the last .pac file would go unused, so they aren't even listed
+            limit = getattr(config, "__playlist_limit__", 25) if options.bank else len(pac_files)
 
-            ctx.bot.create_directory(temp_dir)
-            # slighty faster so doing this instead
+            try:
+                audio_files, known = await self.expand_playlists(audio_files, limit)
+            except YTDLError as e:
+                return await ctx.send(f"{e}")
+
+        jobs = self.plan_music_jobs(pac_files, audio_files, options.bank)
+        audio_seconds, unknown = await self.bot.admission.check_audio(ctx, [audio for audios, _ in jobs
+                                                                            for audio in audios],
+                                                                      options.start, options.end, known)
+
+        if unknown:
+            await ctx.send(f"> :warning: | Couldn't find the length of {len(unknown)} audio file(s)/url(s), "
+                           f"they'll be processed without a length limit.")
+
+        # songs whose length is known are costed by it, the rest by their size or as an average song
+        cost = self.bot.scheduler.estimate_cost(
+            attachments=pac_files + [audio for audio in unknown if isinstance(audio, discord.Attachment)],
+            urls=sum(isinstance(audio, str) for audio in unknown),
+            audio_seconds=audio_seconds)
+
+        # every bank's downloads share one bound, the ones already downloaded encode while the rest download
+        downloads = asyncio.Semaphore(getattr(config, "__concurrent_downloads__", 4))
+
+        async with self.bot.scheduler.job(ctx, cost=cost) as job, ctx.typing():
+            # one task per bank, each one fans its .xwb out to its .pac files
             files = [
                 f
-                for f in await asyncio.gather(
-                    *[asyncio.create_task(self.generate_discord_file(ctx, audio_files[i], pac_file, temp_dir))
-                      for i, pac_file in enumerate(pac_files)]
-                ) if isinstance(f, tuple)
+                for result in await asyncio.gather(
+                    *[asyncio.create_task(self.generate_discord_files(ctx, audios, job_pac_files, job, options,
+                                                                      downloads))
+                      for audios, job_pac_files in jobs]
+                ) if isinstance(result, list)
+                for f in result
             ]
 
-            await self.upload_files(ctx, files, temp_dir)
+            await self.upload_files(ctx, files, job.workspace)
+
+            if options.patch and files:
+                await ctx.send("Apply the .espatch file(s) to your original .pac file(s) with "
+                               "`python applypatch.py original.pac patch.espatch modified.pac`",
+                               file=discord.File(APPLIER_PATH))
 
     @commands.command(aliases=["ex"])
     async def extract(self, ctx, pac_file: discord.Attachment):
@@ -256,38 +595,162 @@ class BlazBlue(commands.Cog):
         extract pac_file
         """
 
+        self.bot.admission.check_sizes(ctx, [pac_file])
+
         if not await self.check_if_pac(pac_file):
-            await ctx.send("> A .pac file wasn't supplied.")
+            return await ctx.send("> A .pac file wasn't supplied.")
 
-        async with ctx.typing():
-            temp_dir = os.path.join(os.getcwd(), f"temp/{ctx.author.id}/extract")
+        cost = self.bot.scheduler.estimate_cost(attachments=[pac_file])
 
-            ctx.bot.create_directory(temp_dir)
+        async with self.bot.scheduler.job(ctx, cost=cost, priority=0) as job, ctx.typing():
+            temp_dir = job.workspace
 
             pac_name = pac_file.filename.replace(".pac", "")
             pac_path = Path(os.path.join(temp_dir, pac_name + ".pac"))
-            await pac_file.save(pac_path)
+            await self.save_pac(pac_file, pac_path)
 
-            header = FileHeader(pac_path)
-            header.extract_all_files(temp_dir)
+            header = await FileHeader.open(pac_path)
+            await header.extract_all_files_async(temp_dir)
             # [!seq] -> matches any character not in seq
-            files = XWBCreator.get_files(f"*.[!pac]*", temp_dir)
+            files = list(XWBCreator.get_files(f"*.[!pac]*", temp_dir))
+
+            await self.upload_files(ctx, files, temp_dir, f"Here are the files inside {pac_file.filename}")
+
+    async def read_pac_header(self, url: str, size: int = None,
+                              fetch: typing.Callable[[str, int, int], typing.Awaitable[bytes]] = None) -> \
+            tuple[FileHeader, bool]:
+        """
+        Reads only as much of the .pac at url as its header takes, decompressing just that much of compressed ones
+        :param size: The .pac's size if it's known, the header is checked against it
+        :param fetch: Fetches a range of url, bot.fetch_range by default
+        :return: The header and whether the .pac is compressed
+        """
+        fetch = fetch or self.bot.fetch_range
+        data = bytearray(await fetch(url, 0, self.HEADER_CHUNK))
+        compressed = data[:4] == b"DFAS"
+        # fed only what's new each time, a stream that never gets to the header is read once, not over and over
+        decompressor = HeadDecompressor(self.MAX_HEADER_SIZE) if compressed else None
+        head = decompressor.feed(data) if compressed else data
+
+        while True:
+            # the header runs up to where the first file starts
+            needed = struct.unpack_from("<i", head, 4)[0] if len(head) >= 32 and head[:4] == b"FPAC" else 32
+
+            if not 32 <= needed <= self.MAX_HEADER_SIZE:
+                raise commands.BadArgument("The header is too big.")
+
+            # not a .pac at all, parsing says so
+            if len(head) >= needed or (len(head) >= 4 and head[:4] != b"FPAC"):
+                break
+
+            # compressed headers can't take more than a little over their own size
+            if len(data) > self.MAX_HEADER_SIZE + self.HEADER_CHUNK:
+                raise commands.BadArgument("The header is too big.")
+
+            more = await fetch(url, len(data), max(self.HEADER_CHUNK, needed - len(head)))
+
+            # the file ended first, parsing says it's cut short
+            if not more:
+                break
 
-            for file in files:
-                await ctx.send(file=discord.File(file[0]))
+            data += more
+            head = decompressor.feed(more) if compressed else data
+
+        if compressed and len(data) >= 12:
+            # the size it decompresses to
+            size = struct.unpack_from("<I", data, 8)[0]
+
+        return FileHeader.from_bytes(head[:needed], actual_size=size), compressed
+
+    async def describe_pac(self, name: str, url: str, size: typing.Optional[int],
+                           semaphore: asyncio.Semaphore, fetch: typing.Callable = None) -> str:
+        async with semaphore:
+            try:
+                header, compressed = await self.read_pac_header(url, size, fetch)
+            except (commands.BadArgument, RequestFailed) as e:
+                return f"{name}: {e}"
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                return f"{name}: couldn't be downloaded"
+
+        names = {file.file_name.lower() for file in header.files}
+        # a song's bank and the sound bank that plays it
+        pairs = sorted(os.path.splitext(file_name)[0] for file_name in names
+                       if file_name.endswith(".xwb") and os.path.splitext(file_name)[0] + ".xsb" in names)
+        width = max([len(file.file_name) for file in header.files] + [4])
+        lines = [f"{name}{' (compressed)' if compressed else ''}: {len(header.files)} files, "
+                 f"{header.file_size:,} bytes, xsb+xwb: {', '.join(pairs) or 'none'}",
+                 f"  {'name':<{width}} {'size':>12} {'offset':>10}"]
+        lines.extend(f"  {file.file_name:<{width}} {file.file_size:>12,} {file.offset:>#10x}" for file in header.files)
+        return "\n".join(lines)
+
+    @commands.command(name="inspect", aliases=["ip"])
+    async def inspect_pacs(self, ctx, pac_files: commands.Greedy[discord.Attachment], *urls: str):
+        """
+        Lists what's inside .pac file(s) without changing them, only their headers are downloaded
+        -------------------------------------------------------------
+        inspect pac_file(s)
+        inspect discord_attachment_link(s)
+        """
+        self.bot.admission.check_sizes(ctx, pac_files)
+        sources = [(pac_file.filename, pac_file.url, pac_file.size) for pac_file in pac_files]
+
+        for url in urls:
+            parts = urllib.parse.urlsplit(url.strip("<>"))
+
+            # anything else would have the bot fetch whatever it's pointed at, its own network included
+            if parts.scheme != "https" or parts.hostname not in self.ATTACHMENT_HOSTS:
+                return await ctx.send(f":no_entry: | only discord attachment links can be inspected, "
+                                      f"`{discord.utils.escape_markdown(url)}` isn't one.")
+
+            sources.append((parts.path.rsplit("/", 1)[-1] or url, parts.geturl(), None))
+
+        if not sources:
+            return await ctx.send(":no_entry: | no .pac file(s) were supplied.")
+
+        semaphore = asyncio.Semaphore(self.INSPECT_CONCURRENCY)
+        remaining = self.INSPECT_MAX_BYTES
+
+        async def fetch(url: str, start: int, length: int) -> bytes:
+            nonlocal remaining
+
+            if remaining <= 0:
+                raise commands.BadArgument("skipped, the other .pac files' headers took too much")
+
+            data = await self.bot.fetch_range(url, start, min(length, remaining))
+            remaining -= len(data)
+            return data
+
+        async with ctx.typing():
+            tables = await asyncio.gather(*[self.describe_pac(name, url, size, semaphore, fetch)
+                                            for name, url, size in sources])
+
+        text = "\n\n".join(tables)
+
+        if len(text) + 6 <= 2000:
+            return await ctx.send(f"```{text}```")
+
+        await ctx.send(f"What's inside the {len(sources)} .pac file(s):",
+                       file=discord.File(io.BytesIO(text.encode()), filename="inspect.txt"))
 
     @commands.command(aliases=["vm"])
-    async def volume(self, ctx, pac_files: commands.Greedy[discord.Attachment], volume: int):
+    async def volume(self, ctx, pac_files: commands.Greedy[discord.Attachment], volume: int, *templates: str):
         """
         Change the volume of an uploaded .pac file(s)
         ------------------------------------------
         volume pac_file(s) volume ( 0-255 )
+        volume volume ( 0-255 ) template_name(s)
         """
 
-        async with ctx.typing():
-            temp_dir = os.path.join(os.getcwd(), f"temp/{ctx.author.id}/volume")
+        self.bot.admission.check_sizes(ctx, pac_files)
+        pac_files.extend(self.bot.templates.get(name) for name in templates)
+
+        if not pac_files:
+            return await ctx.send("> No .pac file(s) or template(s) were supplied.")
+
+        cost = self.bot.scheduler.estimate_cost(attachments=pac_files)
 
-            ctx.bot.create_directory(temp_dir)
+        async with self.bot.scheduler.job(ctx, cost=cost, priority=0) as job, ctx.typing():
+            temp_dir = job.workspace
 
             # slighty faster so doing this instead
             files = [
@@ -300,46 +763,170 @@ class BlazBlue(commands.Cog):
 
             await self.upload_files(ctx, files, temp_dir)
 
+    @staticmethod
+    def render_preview(pac_path: Path, start: float, seconds: float, output_path: str) -> str:
+        header = FileHeader(pac_path)
+        banks = [file for file in header.files if file.file_name.lower().endswith(".xwb")]
+
+        if not banks:
+            raise commands.BadArgument("The .pac file doesn't have any music in it.")
+
+        bank = WaveBank(header.read(banks[0]))
+
+        if not bank.entries:
+            raise commands.BadArgument(f"The wave bank {banks[0].file_name} is empty.")
+
+        entry = bank.entries[0]
+
+        if start >= entry.seconds:
+            raise commands.BadArgument(f"The song is only {entry.seconds:.0f} seconds long.")
+
+        samples = bank.decode(entry, start, seconds)
+        clip = AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=entry.sample_rate,
+                            channels=entry.channels)
+        clip.export(output_path, format="ogg", codec="libopus", bitrate="64k")
+        return banks[0].file_name
+
+    @commands.command(aliases=["pv"])
+    async def preview(self, ctx, pac_file: discord.Attachment, start: parse_timestamp = 0.0,
+                      seconds: parse_timestamp = 15.0):
+        """
+        Sends a short clip of the music inside a .pac file
+        -------------------------------------------------------------
+        preview pac_file
+        preview pac_file 1:30 20
+        """
+
+        self.bot.admission.check_sizes(ctx, [pac_file])
+
+        if not await self.check_if_pac(pac_file):
+            return await ctx.send("> A .pac file wasn't supplied.")
+
+        if seconds <= 0:
+            return await ctx.send("> The clip has to be longer than 0 seconds.")
+
+        seconds = min(seconds, self.PREVIEW_SECONDS)
+        cost = self.bot.scheduler.estimate_cost(attachments=[pac_file])
 
+        async with self.bot.scheduler.job(ctx, cost=cost, priority=0) as job, ctx.typing():
+            pac_path = Path(os.path.join(job.workspace, YTDL.generate_unique_filename() + ".pac"))
+            await self.save_pac(pac_file, pac_path)
+            output_path = os.path.join(job.workspace, pac_file.filename.replace(".pac", "") + ".ogg")
+
+            try:
+                bank_name = await self.bot.loop.run_in_executor(None, self.render_preview, pac_path, start, seconds,
+                                                                output_path)
+            except WaveBankError as e:
+                return await ctx.send(f"> :no_entry: | {e}")
+
+            await ctx.send(f"> {bank_name} from {int(start // 60)}:{start % 60:04.1f}",
+                           file=discord.File(output_path))
+
+    @commands.command()
+    async def jobs(self, ctx: commands.Context):
+        """
+        Shows the queued and running jobs for this server
+        -------------------------------------------------------------
+        es jobs
+        """
+
+        jobs = self.bot.scheduler.jobs_for(ctx)
+
+        if not jobs:
+            return await ctx.send("> There are no jobs queued or running here.")
+
+        lines = []
+
+        for job in jobs:
+            if job.state == Job.RUNNING:
+                state = f"running for {job.elapsed:.0f}s"
+            else:
+                state = f"queued at position {self.bot.scheduler.queue_position(job)} for {job.elapsed:.0f}s"
+
+            lines.append(f"#{job.id:<5} {job.command:<8} <@{job.author_id}> {state} (cost {job.cost:.0f})")
+
+        embed = discord.Embed(color=self.bot.embed_colour, title="Jobs", description="\n".join(lines))
+        await ctx.send(embed=embed)
+
+    @commands.command()
+    async def cancel(self, ctx: commands.Context, job_id: int):
+        """
+        Cancels one of your queued or running jobs, stopping any downloads or conversions it started
+        -------------------------------------------------------------
+        es cancel job_id
+        """
+
+        job = self.bot.scheduler.jobs.get(job_id)
+
+        if job is None or job.flow != self.bot.scheduler.flow_of(ctx):
+            return await ctx.send(f"> :no_entry: | No job `#{job_id}` was found here.")
+
+        if job.author_id != ctx.author.id and not await self.bot.is_owner(ctx.author):
+            return await ctx.send(f"> :no_entry: | You can only cancel your own jobs.")
+
+        self.bot.scheduler.cancel(job)
+        await ctx.send(f"> Cancelled job `#{job_id}`.")
+
+    @commands.group(invoke_without_command=True, aliases=["tp"])
+    async def template(self, ctx: commands.Context):
+        """
+        Lists the .pac files kept on the bot that can be used by name instead of uploading them
+        -------------------------------------------------------------
+        es template
+        es template add name pac_file
+        es template remove name
+        """
+        self.bot.templates.refresh()
+        templates = sorted(self.bot.templates.templates.values(), key=lambda template: template.name)
+
+        if not templates:
+            return await ctx.send("> There are no templates yet.")
+
+        lines = [f"`{template.name}` {template.filename} ({template.size / 1048576:.1f} MB, "
+                 f"{len(template.index['files'])} files)" for template in templates]
+
+        embed = discord.Embed(color=self.bot.embed_colour, title="Templates", description="\n".join(lines))
+        await ctx.send(embed=embed)
+
+    @template.command(name="list")
+    async def template_list(self, ctx: commands.Context):
+        """Lists the templates"""
+        await ctx.invoke(self.template)
+
+    @template.command(name="add")
+    @commands.is_owner()
+    async def template_add(self, ctx: commands.Context, name: str, pac_file: discord.Attachment):
+        """Registers an uploaded .pac file under name"""
+
+        if not await self.check_if_pac(pac_file):
+            return await ctx.send("> A .pac file wasn't supplied.")
+
+        async with self.bot.scheduler.job(ctx, cost=self.bot.scheduler.estimate_cost(attachments=[pac_file]),
+                                          priority=0) as job:
+            pac_path = os.path.join(job.workspace, YTDL.generate_unique_filename() + ".pac")
+            await pac_file.save(Path(pac_path))
+
+            try:
+                template = await self.bot.loop.run_in_executor(None, self.bot.templates.add, name, pac_path,
+                                                               pac_file.filename,
+                                                               self.bot.admission.decompressed_limit())
+            except TemplateError as e:
+                return await ctx.send(f"> :no_entry: | {e}")
+
+        await ctx.send(f"> Added the template `{template.name}` ({template.filename}, "
+                       f"{len(template.index['files'])} files).")
+
+    @template.command(name="remove")
+    @commands.is_owner()
+    async def template_remove(self, ctx: commands.Context, name: str):
+        """Removes a template"""
+
+        try:
+            template = self.bot.templates.remove(name)
+        except TemplateError as e:
+            return await ctx.send(f"> :no_entry: | {e}")
 
-    @music.after_invoke
-    # have no idea why these are here but just doing it in case past me knew better
-    @extract.after_invoke
-    @volume.after_invoke
-    async def after_music(self, ctx: commands.Context[commands.Bot]):
-        """This triggers after the command ran."""
-        path = os.path.join(os.getcwd(), f"temp/{ctx.author.id}")
-        self.bot.dead_files.put(path)
-
-    @volume.error
-    async def on_volume_error(self, ctx: commands.Context[commands.Bot], _):
-        """This triggers after the command ran into an unexpected error."""
-        path = os.path.join(os.getcwd(), f"temp/{ctx.author.id}/volume")
-        self.bot.dead_files.put(path)
-
-    @volume.after_invoke
-    async def after_volume(self, ctx: commands.Context[commands.Bot]):
-        """This triggers after the command finished without errors."""
-        path = os.path.join(os.getcwd(), f"temp/{ctx.author.id}/volume")
-        self.bot.dead_files.put(path)
-
-    @music.error
-    async def on_music_error(self, ctx: commands.Context[commands.Bot], _):
-        """This triggers after the command ran into an unexpected error."""
-        path = os.path.join(os.getcwd(), f"temp/{ctx.author.id}")
-        self.bot.dead_files.put(path)
-
-    @extract.error
-    async def on_extract_error(self, ctx: commands.Context[commands.Bot], _):
-        """This triggers after the command ran into an unexpected error."""
-        path = os.path.join(os.getcwd(), f"temp/{ctx.author.id}/extract")
-        self.bot.dead_files.put(path)
-
-    @extract.after_invoke
-    async def after_extract(self, ctx: commands.Context[commands.Bot]):
-        """This triggers after the command finished without errors."""
-        path = os.path.join(os.getcwd(), f"temp/{ctx.author.id}/extract")
-        self.bot.dead_files.put(path)
+        await ctx.send(f"> Removed the template `{template.name}`.")
 
 
 async def setup(bot):
@@ -2,22 +2,64 @@ import traceback
 import sys
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from config.utils.requests import RequestFailed
 from config.utils.ytdl import YTDLError
+from config.utils.scheduler import JobRejected
+from config.utils.errordigest import ErrorDigest
+from config import config
 
 
 class CommandErrorHandler(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.owner: discord.User = None
+        self.digest = ErrorDigest()
+        self.send_digest.change_interval(seconds=getattr(config, "__error_digest_interval__", 300))
+
+    async def cog_load(self):
+        self.send_digest.start()
+
+    async def cog_unload(self):
+        self.send_digest.cancel()
+        # whatever was collected since the last digest still goes out
+        await self.flush_digest()
+
+    async def get_owner(self) -> discord.User:
+        # looked up once, application_info is a request every time
+        if self.owner is None:
+            owner_id = self.bot.owner_id or (await self.bot.application_info()).owner.id
+            self.owner = await self.bot.get_or_fetch_user(owner_id)
+
+        return self.owner
+
+    async def flush_digest(self):
+        messages = self.digest.flush()
+
+        if not messages:
+            return
+
+        try:
+            owner = await self.get_owner()
+
+            for message in messages:
+                await owner.send(message)
+
+        except discord.errors.HTTPException:
+            pass
+
+    @tasks.loop(seconds=300)
+    async def send_digest(self):
+        await self.flush_digest()
+
+    @send_digest.before_loop
+    async def before_send_digest(self):
+        await self.bot.wait_until_ready()
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
-        owner_id = (await self.bot.application_info()).owner.id
-        owner = ctx.bot.get_user(owner_id)
-
         if isinstance(error, commands.errors.CommandInvokeError):
 
             error = error.original
@@ -35,7 +77,7 @@ class CommandErrorHandler(commands.Cog):
 
                          commands.errors.UnexpectedQuoteError, YTDLError,
 
-                         RequestFailed)
+                         RequestFailed, JobRejected)
 
         error = getattr(error, 'original', error)
 
@@ -52,18 +94,15 @@ class CommandErrorHandler(commands.Cog):
 
         accounted_for += (commands.CheckFailure,)
 
-        error_messsage = traceback.format_exception(type(error), error, error.__traceback__)
-        error_messsage = "".join(c for c in error_messsage)
-
         try:
 
             if not isinstance(error, accounted_for):
+                # the owner gets these in the next digest, grouped with every other time it happened
+                self.digest.add(error, ctx.command.qualified_name)
 
                 await ctx.send(f"The command `{ctx.command.name}` has ran into an unexpected error, "
                                f"the bot owner has been notified.", delete_after=8)
 
-                await owner.send("```Python\n" + error_messsage + "```")
-
         except discord.errors.HTTPException:
 
             pass
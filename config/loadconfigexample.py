@@ -1,3 +1,71 @@
 __bot_token__ = "token"
 __prefixes__ = ["pudding ", "es "]
 __apikey__ = "key"
+# job scheduler, job costs are roughly the MB of work a command has to do
+__scheduler_workers__ = 2
+__scheduler_max_job_cost__ = 500
+__scheduler_max_flow_cost__ = 1000
+# guild or user id: weight, a guild with weight 2 gets twice the share of the workers of a guild with weight 1
+__scheduler_weights__ = {}
+# warm XWBTool workers kept under a persistent wineserver, 0 starts a fresh wine for every conversion
+__xwb_tool_workers__ = 2
+# how many conversions a worker runs at once and how long each one may take in seconds
+__xwb_tool_batch_size__ = 4
+__xwb_tool_timeout__ = 60
+# upload limit in bytes, 0 uses the guild's limit
+__upload_limit__ = 0
+# results over the upload limit are compressed into 7z or zip archives before being sent to file.io
+__bundle_format__ = "7z"
+# where results too big for discord go, "filebin" or "local" to serve them from the bot with expiring links
+__fallback_host__ = "filebin"
+# the url the local artifact server is reachable at and where it listens, under launcher.py every cluster
+# listens on the port plus its cluster id and {cluster} and {port} in the url are filled in
+__artifact_url__ = "http://localhost:8080"
+__artifact_host__ = "0.0.0.0"
+__artifact_port__ = 8080
+# signs the links, leave empty for a random one (links then stop working on restart)
+__artifact_secret__ = ""
+# seconds a link stays valid and the most bytes kept before the oldest files are evicted
+__artifact_ttl__ = 86400
+__artifact_max_bytes__ = 10737418240
+# "pydub" or "numpy", numpy resamples with a proper anti aliasing filter and dither but
+# takes longer than pydub's linear interpolation, it's used regardless on pythons without audioop
+__resampler__ = "pydub"
+# integrated loudness in LUFS songs are brought to with --normalize
+__loudness_target__ = -14.0
+# limits checked before anything is downloaded, "attachment_size" in bytes and "audio_seconds" of audio after
+# --start/--end, e.g. {"attachment_size": 52428800}
+__admission_limits__ = {}
+# guild or user id: limits overriding the ones above for that guild or user
+__guild_limits__ = {}
+# how many processes encode tracks at once, None uses one per cpu
+__encode_workers__ = None
+# how many songs one music command downloads at once, and the most songs --playlist takes from a playlist
+__concurrent_downloads__ = 4
+__playlist_limit__ = 25
+# how many result messages can be uploading to one channel at once
+__delivery_per_channel__ = 2
+# path of an sqlite file to queue encoding and packing into for worker.py processes (python worker.py), empty
+# does it in the bot's own process pool. workers have to see the database and the bot's temp directory at the
+# same paths, e.g. on a shared disk
+__job_queue__ = ""
+# how many workers a queued job may stop without finishing (crash or hang) before it's failed
+__job_max_attempts__ = 3
+# cogs loaded in the background once the bot is connecting instead of before, their commands aren't there
+# for the first few seconds. es startup_report shows how long each part of starting took
+__deferred_cogs__ = ["cogs.jishaku"]
+# don't chunk or cache guild members and keep fewer messages, for when most of the memory is discord.py's caches
+__lean_cache__ = False
+# messages kept with the lean cache and how many users fetched by id are kept
+__max_messages__ = 100
+__fetched_users_size__ = 256
+# seconds between the messages to the owner summing up unexpected errors, each kind of error is sent once
+# with its traceback and counted after that
+__error_digest_interval__ = 300
+# threads reading and writing .pac files off the event loop, and how many of them may use one disk at once
+__disk_io_workers__ = 8
+__disk_io_per_device__ = 4
+# python launcher.py runs the bot as this many processes with the shards split between them,
+# 0 shards uses the count discord recommends. __encode_workers__ and the other pools are per process
+__clusters__ = 2
+__shard_count__ = 0
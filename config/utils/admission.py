@@ -0,0 +1,153 @@
+import json
+import typing
+import asyncio
+
+import discord
+
+from discord.ext import commands
+
+from config.utils.scheduler import JobRejected
+from config.utils.lazy import LazyModule
+from config.utils.ytdl import youtube_dl
+
+get_prober_name = LazyModule("pydub.utils", "get_prober_name")
+
+
+class Probe:
+    def __init__(self, duration: float = None, sample_rate: int = None, channels: int = None, size: int = None):
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.size = size
+
+
+class Admission:
+    LIMITS = {
+        # bytes, the largest attachment that's downloaded at all
+        "attachment_size": 104857600,
+        # the longest song (after --start/--end) that's decoded
+        "audio_seconds": 1200,
+    }
+    # a compressed .pac may decompress to at most this many times the attachment size limit
+    DECOMPRESSION_RATIO = 4
+    PROBE_TIMEOUT = 15
+
+    def __init__(self, limits: dict = None, guild_limits: dict = None):
+        """
+        Rejects inputs that are over budget before anything is downloaded or decoded
+        :param limits: Overrides of LIMITS for everyone
+        :param guild_limits: guild/user id to overrides of LIMITS for that guild or user
+        """
+        self.limits = {**self.LIMITS, **(limits or {})}
+        self.guild_limits = guild_limits or {}
+
+    def limits_for(self, ctx: commands.Context) -> dict:
+        overrides = self.guild_limits.get(ctx.guild.id if ctx.guild else ctx.author.id, {})
+        return {**self.limits, **overrides}
+
+    def decompressed_limit(self) -> int:
+        # by the biggest attachment any guild may send, a .pac is decompressed before its guild is looked at
+        sizes = [self.limits["attachment_size"]]
+        sizes.extend(overrides["attachment_size"] for overrides in self.guild_limits.values()
+                     if "attachment_size" in overrides)
+        return max(sizes) * self.DECOMPRESSION_RATIO
+
+    def check_sizes(self, ctx: commands.Context, attachments: typing.Iterable[discord.Attachment]):
+        # done before anything reads the attachments, the converters download them in full
+        limit = self.limits_for(ctx)["attachment_size"]
+
+        for attachment in attachments:
+            if attachment.size > limit:
+                raise JobRejected(f"The file {attachment.filename} is too big "
+                                  f"({attachment.size / 1048576:.1f} MB, limit {limit / 1048576:.1f} MB).")
+
+    async def probe_attachment(self, attachment: discord.Attachment) -> Probe:
+        # ffprobe reads the url itself and only fetches as much as it needs to find the headers
+        proc = await asyncio.create_subprocess_exec(get_prober_name(), "-v", "error",
+                                                    "-show_entries", "format=duration:stream=sample_rate,channels",
+                                                    "-select_streams", "a:0", "-of", "json", attachment.url,
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), self.PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return Probe(size=attachment.size)
+
+        try:
+            data = json.loads(stdout or b"{}")
+            stream = (data.get("streams") or [{}])[0]
+            return Probe(duration=float(data["format"]["duration"]) if "duration" in data.get("format", {}) else None,
+                         sample_rate=int(stream["sample_rate"]) if "sample_rate" in stream else None,
+                         channels=stream.get("channels"),
+                         size=attachment.size)
+        except (ValueError, KeyError, TypeError):
+            return Probe(size=attachment.size)
+
+    async def probe_url(self, url: str) -> Probe:
+        def extract():
+            options = {"quiet": True, "noplaylist": True, "skip_download": True}
+
+            with youtube_dl.YoutubeDL(options) as ydl:
+                return ydl.extract_info(url, download=False, process=False)
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            info = await asyncio.wait_for(loop.run_in_executor(None, extract), self.PROBE_TIMEOUT)
+        except (youtube_dl.utils.DownloadError, youtube_dl.utils.ExtractorError, asyncio.TimeoutError):
+            # left for the download itself to report properly
+            return Probe()
+
+        info = info or {}
+        return Probe(duration=info.get("duration"), size=info.get("filesize") or info.get("filesize_approx"))
+
+    async def probe(self, audio: typing.Union[discord.Attachment, str]) -> Probe:
+        if isinstance(audio, str):
+            return await self.probe_url(audio)
+
+        return await self.probe_attachment(audio)
+
+    async def check_audio(self, ctx: commands.Context, audio_files: list, start: float = None,
+                          end: float = None, known: dict[str, Probe] = None) -> tuple[float, list]:
+        """
+        Probes every audio file/url and rejects the job if any is too long
+        returns the total seconds that will be decoded and the inputs whose length couldn't be found
+        :param known: Probes of urls that don't need probing again, e.g. from a playlist's metadata
+        """
+        known = known or {}
+        limit = self.limits_for(ctx)["audio_seconds"]
+
+        async def probe(audio):
+            if isinstance(audio, str) and audio in known:
+                return known[audio]
+
+            return await self.probe(audio)
+
+        probes = await asyncio.gather(*[probe(audio) for audio in audio_files])
+        total = 0.0
+        unknown = []
+
+        for audio, probe in zip(audio_files, probes):
+            name = audio if isinstance(audio, str) else audio.filename
+
+            if probe.duration is not None:
+                seconds = min(probe.duration, end if end is not None else probe.duration) - (start or 0.0)
+            elif end is not None:
+                # a section is still bounded even when the whole song's length isn't known
+                seconds = end - (start or 0.0)
+            else:
+                unknown.append(audio)
+                continue
+
+            if seconds <= 0:
+                raise JobRejected(f"`--start` is past the end of {name}.")
+
+            if seconds > limit:
+                raise JobRejected(f"{name} is too long ({seconds / 60:.1f} minutes, limit {limit / 60:.1f} minutes), "
+                                  f"use `--start`/`--end` to only use a section of it.")
+
+            total += seconds
+
+        return total, unknown
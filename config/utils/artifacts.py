@@ -0,0 +1,142 @@
+import os
+import hmac
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import secrets
+
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from aiohttp import web
+
+
+class Artifact:
+    def __init__(self, artifact_id: str, path: str, filename: str, expires: float):
+        self.id = artifact_id
+        self.path = path
+        self.filename = filename
+        self.size = os.path.getsize(path)
+        self.created = time.time()
+        self.expires = expires
+        self.download_link = ""
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires
+
+    @property
+    def expires_at(self) -> str:
+        return datetime.fromtimestamp(self.expires, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+
+class ArtifactServer:
+    def __init__(self, root: str, public_url: str, host: str = "0.0.0.0", port: int = 8080,
+                 secret: str = "", ttl: int = 86400, max_bytes: int = 10737418240):
+        """
+        Serves finished files straight from disk with signed links that expire
+        :param root: The directory published files are moved into
+        :param public_url: The url users reach the server at, e.g. https://files.example.com
+        :param host: The address to listen on
+        :param port: The port to listen on
+        :param secret: Signs the links, a random one means links stop working after a restart
+        :param ttl: How many seconds a link stays valid
+        :param max_bytes: The oldest files are evicted once everything published goes over this
+        """
+        self.root = root
+        self.public_url = public_url.rstrip("/")
+        self.host = host
+        self.port = port
+        self.secret = (secret or secrets.token_hex(32)).encode()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.artifacts: dict[str, Artifact] = {}
+        self.runner: web.AppRunner = None
+        self.evictor: asyncio.Task = None
+
+    def sign(self, artifact_id: str, expires: int) -> str:
+        return hmac.new(self.secret, f"{artifact_id}:{expires}".encode(), hashlib.sha256).hexdigest()[:32]
+
+    async def start(self):
+        # anything left from before a restart can't be reached anymore
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+
+        app = web.Application()
+        app.router.add_get("/a/{token}/{filename}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.evictor = asyncio.create_task(self.evict_periodically())
+
+    async def stop(self):
+        if self.evictor is not None:
+            self.evictor.cancel()
+
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        try:
+            artifact_id, expires, signature = request.match_info["token"].split(".")
+            expires = int(expires)
+        except ValueError:
+            raise web.HTTPNotFound()
+
+        if not hmac.compare_digest(signature, self.sign(artifact_id, expires)) or time.time() >= expires:
+            raise web.HTTPGone()
+
+        artifact = self.artifacts.get(artifact_id)
+
+        if artifact is None or not os.path.exists(artifact.path):
+            raise web.HTTPGone()
+
+        # FileResponse handles range requests and uses sendfile when it can
+        return web.FileResponse(artifact.path, headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(artifact.filename)}"
+        })
+
+    def publish(self, path: str, filename: str) -> Artifact:
+        """
+        Moves a finished file out of the job's workspace and returns it with a signed link
+        """
+        artifact_id = uuid.uuid4().hex
+        directory = os.path.join(self.root, artifact_id)
+        os.makedirs(directory)
+        destination = os.path.join(directory, "file")
+        # a rename when the workspace is on the same disk
+        shutil.move(path, destination)
+
+        expires = int(time.time()) + self.ttl
+        artifact = Artifact(artifact_id, destination, filename, expires)
+        token = f"{artifact_id}.{expires}.{self.sign(artifact_id, expires)}"
+        artifact.download_link = f"{self.public_url}/a/{token}/{quote(filename)}"
+
+        self.artifacts[artifact_id] = artifact
+        self.evict()
+        return artifact
+
+    def remove(self, artifact: Artifact):
+        self.artifacts.pop(artifact.id, None)
+        shutil.rmtree(os.path.dirname(artifact.path), ignore_errors=True)
+
+    def evict(self):
+        for artifact in [artifact for artifact in self.artifacts.values() if artifact.expired]:
+            self.remove(artifact)
+
+        total = sum(artifact.size for artifact in self.artifacts.values())
+
+        for artifact in sorted(self.artifacts.values(), key=lambda a: a.created):
+            if total <= self.max_bytes:
+                break
+
+            total -= artifact.size
+            self.remove(artifact)
+
+    async def evict_periodically(self, interval: int = 60):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict()
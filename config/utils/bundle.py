@@ -0,0 +1,117 @@
+import os
+import lzma
+import zlib
+import zipfile
+import concurrent.futures
+
+from config.utils.lazy import LazyModule
+
+py7zr = LazyModule("py7zr")
+
+
+class Bundler:
+    FORMATS = ["7z", "zip"]
+    # how much of each file is compressed to guess how small the whole file would get
+    SAMPLE_SIZE = 1048576
+    # the guess is a little rough, files estimated to land just over the limit are still tried
+    ESTIMATE_MARGIN = 1.05
+
+    def __init__(self, limit: int, directory: str, archive_format: str = "7z"):
+        """
+        :param limit: The size in bytes every bundle has to fit under
+        :param directory: The directory bundles are written to
+        :param archive_format: 7z or zip
+        """
+        if archive_format not in self.FORMATS:
+            raise ValueError(f"Unsupported bundle format {archive_format}.")
+
+        self.limit = limit
+        self.directory = directory
+        self.format = archive_format
+
+    def compress(self, files: list[tuple[str, str]], output_path: str) -> int:
+        # both write each member straight from disk instead of reading it all in first
+        if self.format == "zip":
+            # deflate since explorer and most unzip tools can't open lzma zips
+            with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                for path, name in files:
+                    archive.write(path, name)
+        else:
+            with py7zr.SevenZipFile(output_path, "w") as archive:
+                for path, name in files:
+                    archive.write(path, name)
+
+        return os.path.getsize(output_path)
+
+    def estimate(self, path: str) -> int:
+        # adpcm audio barely compresses, so compressing a sample first avoids compressing
+        # a whole archive only to send it to filebin anyway
+        size = os.path.getsize(path)
+
+        with open(path, "rb") as f:
+            sample = f.read(self.SAMPLE_SIZE)
+
+        if not sample:
+            return size
+
+        compressed = zlib.compress(sample) if self.format == "zip" else lzma.compress(sample, preset=1)
+        return int(size * len(compressed) / len(sample))
+
+    def archive_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.{self.format}")
+
+    def bundle(self, files: list[tuple[str, str]]) -> tuple[list[tuple[str, str, list]], list[tuple[str, str]]]:
+        """
+        Compresses files into as few archives under the limit as it can
+        :param files: The (path, filename) of every file to bundle
+        :return: The (path, filename, files inside) of every archive that fits
+        and the (path, filename) of every file that couldn't be made to fit
+        """
+        candidates = [f for f in files if self.estimate(f[0]) <= self.limit * self.ESTIMATE_MARGIN]
+        leftovers = [f for f in files if f not in candidates]
+
+        if not candidates:
+            return [], leftovers
+
+        singles = [self.archive_path(f"single{i}") for i in range(len(candidates))]
+        names = [f"{os.path.splitext(name)[0]}.{self.format}" for _, name in candidates]
+
+        # lzma lets go of the gil so every file gets compressed on its own thread
+        with concurrent.futures.ThreadPoolExecutor() as pool:
+            sizes = list(pool.map(lambda args: self.compress([args[0]], args[1]), zip(candidates, singles)))
+
+        # first fit decreasing, packing the compressed files into as few archives as possible
+        bins: list[list[int]] = []
+        bin_sizes: list[int] = []
+
+        for i in sorted(range(len(candidates)), key=lambda i: sizes[i], reverse=True):
+            if sizes[i] > self.limit:
+                leftovers.append(candidates[i])
+                continue
+
+            for b, bin_size in enumerate(bin_sizes):
+                if bin_size + sizes[i] <= self.limit:
+                    bins[b].append(i)
+                    bin_sizes[b] += sizes[i]
+                    break
+            else:
+                bins.append([i])
+                bin_sizes.append(sizes[i])
+
+        bundles = []
+
+        for b in bins:
+            if len(b) == 1:
+                bundles.append((singles[b[0]], names[b[0]], [candidates[b[0]]]))
+                continue
+
+            path = self.archive_path(f"bundle{len(bundles)}")
+            name = f"{os.path.splitext(names[b[0]])[0]}_and_{len(b) - 1}_more.{self.format}"
+
+            # archive headers can push a combined bundle over, the single archives still fit
+            if self.compress([candidates[i] for i in b], path) <= self.limit:
+                bundles.append((path, name, [candidates[i] for i in b]))
+            else:
+                bundles.extend((singles[i], names[i], [candidates[i]]) for i in b)
+
+        return bundles, leftovers
@@ -0,0 +1,80 @@
+import os
+import json
+import time
+
+
+class ClusterStats:
+    # a cluster that hasn't written for this long is counted as down
+    MAX_AGE = 120
+
+    def __init__(self, directory: str, cluster_id: int = None):
+        """
+        Each cluster of the sharded launcher writes its stats to a file here so any of them can show the totals
+        :param directory: Shared by every cluster
+        :param cluster_id: This process's cluster, None when the bot isn't run by the launcher
+        """
+        self.directory = directory
+        self.cluster_id = cluster_id
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"cluster-{self.cluster_id}.json")
+
+    @staticmethod
+    def shard_ranges(shard_count: int, clusters: int) -> list[list[int]]:
+        # as even as it gets, the first clusters take one extra shard when it doesn't divide
+        clusters = max(1, min(clusters, shard_count))
+        per_cluster, extra = divmod(shard_count, clusters)
+        ranges = []
+        start = 0
+
+        for i in range(clusters):
+            end = start + per_cluster + (1 if i < extra else 0)
+            ranges.append(list(range(start, end)))
+            start = end
+
+        return ranges
+
+    def write(self, stats: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+
+        with open(temp_path, "w") as f:
+            json.dump({**stats, "cluster": self.cluster_id, "written": time.time()}, f)
+
+        os.replace(temp_path, self.path)
+
+    def read(self, cluster_id: int) -> dict:
+        try:
+            with open(os.path.join(self.directory, f"cluster-{cluster_id}.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def read_all(self) -> list[dict]:
+        """
+        The stats of every cluster that wrote recently
+        """
+        if not os.path.isdir(self.directory):
+            return []
+
+        clusters = []
+
+        for name in os.listdir(self.directory):
+            if not (name.startswith("cluster-") and name.endswith(".json")):
+                continue
+
+            stats = self.read(name[len("cluster-"):-len(".json")])
+
+            if stats and time.time() - stats.get("written", 0) <= self.MAX_AGE:
+                clusters.append(stats)
+
+        return sorted(clusters, key=lambda stats: stats["cluster"])
+
+    def totals(self) -> dict:
+        clusters = self.read_all()
+        return {"clusters": len(clusters),
+                "shards": sum(len(stats.get("shards", [])) for stats in clusters),
+                "guilds": sum(stats.get("guilds", 0) for stats in clusters),
+                "rss": sum(stats.get("rss", 0) for stats in clusters),
+                "latency": max((stats.get("latency", 0.0) for stats in clusters), default=0.0)}
@@ -1,13 +1,14 @@
 import re
 import typing
 
-import filetype
-
 import discord
 from discord import Attachment
 from discord.ext import commands
 
 from config.utils.xwb import XWBCreator
+from config.utils.lazy import LazyModule
+
+filetype = LazyModule("filetype")
 
 
 class PacFileConverter:
@@ -18,9 +19,10 @@ class PacFileConverter:
         if not isinstance(argument, Attachment):
             raise commands.BadArgument(error_msg)
 
-        magic_word = (await argument.read())[:4].decode("ASCII")
+        magic_word = (await argument.read())[:4].decode("ASCII", errors="replace")
 
-        if magic_word != "FPAC":
+        # DFAS starts compressed .pac files
+        if magic_word not in ("FPAC", "DFAS"):
             raise commands.BadArgument(".pac File has an incorrect structure.")
 
         return argument
@@ -28,6 +30,10 @@ class PacFileConverter:
 
 class AudioConverter:
 
+    def __init__(self, keep_playlist: bool = False):
+        # --playlist wants the list= part, it's resolved into its songs later
+        self.keep_playlist = keep_playlist
+
     @staticmethod
     def remove_playlist_if_exists(argument: str) -> str:
 
@@ -41,7 +47,7 @@ class AudioConverter:
 
         if isinstance(argument, str):
             if re.search(r"http[s]?:\/\/(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*(),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+", argument):
-                return self.remove_playlist_if_exists(argument)
+                return argument if self.keep_playlist else self.remove_playlist_if_exists(argument)
 
             raise commands.BadArgument(error_msg)
 
@@ -61,3 +67,84 @@ class AudioConverter:
             argument.filename = f"{argument.filename}.{extension}"
 
         return argument
+
+
+def parse_timestamp(value: str) -> float:
+    """Turns 90, 1:30 or 1:01:30.5 into seconds"""
+    seconds = 0.0
+
+    for part in value.split(":"):
+        if not re.fullmatch(r"\d+(\.\d+)?", part):
+            raise ValueError(value)
+        seconds = seconds * 60 + float(part)
+
+    if value.count(":") > 2:
+        raise ValueError(value)
+
+    return seconds
+
+
+class MusicOptions:
+    # --name: type, bool options don't take a value
+    OPTIONS = {"patch": bool, "start": parse_timestamp, "end": parse_timestamp, "loop": parse_timestamp,
+               "bank": bool, "volume": int, "fit": bool, "normalize": bool,
+               "playlist": bool}
+
+    def __init__(self, urls: list[str], **options):
+        self.urls = urls
+        for name, option_type in self.OPTIONS.items():
+            setattr(self, name, options.get(name, False if option_type is bool else None))
+
+    @property
+    def duration(self) -> typing.Optional[float]:
+        if self.end is None:
+            return None
+
+        return self.end - (self.start or 0.0)
+
+    @classmethod
+    async def convert(cls, ctx, argument: typing.Optional[str]) -> "MusicOptions":
+        """Splits the text after the attachments into urls and --options"""
+        urls = []
+        options = {}
+        tokens = (argument or "").split()
+
+        while tokens:
+            token = tokens.pop(0)
+
+            if not token.startswith("--"):
+                urls.append(token)
+                continue
+
+            name = token[2:].lower()
+            option_type = cls.OPTIONS.get(name)
+
+            if option_type is None:
+                raise commands.BadArgument(f"Unknown option `{token}`.")
+
+            if option_type is bool:
+                options[name] = True
+                continue
+
+            if not tokens:
+                raise commands.BadArgument(f"The option `{token}` needs a value.")
+
+            value = tokens.pop(0)
+
+            try:
+                options[name] = option_type(value)
+            except ValueError:
+                raise commands.BadArgument(f"Invalid value `{value}` for the option `{token}`.")
+
+        options = cls(urls, **options)
+
+        if options.duration is not None and options.duration <= 0:
+            raise commands.BadArgument("`--end` has to be after `--start`.")
+
+        if options.loop is not None and options.duration is not None and options.loop >= options.duration:
+            raise commands.BadArgument("`--loop` has to be before the end of the song.")
+
+        if options.volume is not None and not 0 <= options.volume <= 255:
+            raise commands.BadArgument("`--volume` has to be between 0 and 255.")
+
+        return options
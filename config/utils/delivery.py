@@ -0,0 +1,97 @@
+import os
+import asyncio
+import contextlib
+
+import discord
+
+
+class Delivery:
+    # discord's limit on attachments per message
+    MAX_FILES = 10
+
+    def __init__(self, per_channel: int = 2):
+        """
+        Sends finished files back to discord in as few messages as fit
+        :param per_channel: How many messages may be uploading to one channel at once, discord.py already waits
+        out rate limits, this keeps one big job from queueing all of its messages on the bucket at once
+        """
+        self.per_channel = per_channel
+        # only channels something is being sent to have one, (semaphore, how many sends are using it)
+        self.semaphores: dict[int, list] = {}
+
+    @classmethod
+    def pack(cls, files: list[tuple[str, str]], limit: int) -> tuple[list[list[tuple[str, str]]],
+                                                                    list[tuple[str, str]]]:
+        """
+        Packs files into messages of at most MAX_FILES files and limit bytes, largest first
+        :param files: (path, filename) of every file
+        :return: The files of each message and the files too big for any message
+        """
+        sized = sorted(((os.path.getsize(path), path, name) for path, name in files), reverse=True)
+        batches = []
+        oversized = []
+
+        for size, path, name in sized:
+            if size > limit:
+                oversized.append((path, name))
+                continue
+
+            for batch in batches:
+                if len(batch["files"]) < cls.MAX_FILES and batch["size"] + size <= limit:
+                    batch["files"].append((path, name))
+                    batch["size"] += size
+                    break
+            else:
+                batches.append({"files": [(path, name)], "size": size})
+
+        return [batch["files"] for batch in batches], oversized
+
+    @contextlib.asynccontextmanager
+    async def channel_slot(self, channel_id: int):
+        """
+        Waits for one of the channel's upload slots, its semaphore is dropped once nothing's sending there
+        """
+        entry = self.semaphores.setdefault(channel_id, [asyncio.Semaphore(self.per_channel), 0])
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+
+            if not entry[1]:
+                del self.semaphores[channel_id]
+
+    async def send_batch(self, destination: discord.abc.Messageable, content: str,
+                         batch: list[tuple[str, str]]) -> list[tuple[str, str]]:
+        """
+        Sends one message with every file in batch, returns the files that didn't get sent
+        """
+        # a context sends to its channel
+        channel = getattr(destination, "channel", destination)
+
+        async with self.channel_slot(channel.id):
+            files = [discord.File(path, filename=name) for path, name in batch]
+
+            try:
+                await destination.send(content, files=files)
+            except discord.errors.HTTPException:
+                return batch
+            finally:
+                for file in files:
+                    file.close()
+
+        return []
+
+    async def send(self, destination: discord.abc.Messageable, files: list[tuple[str, str]], limit: int,
+                   content: str = None) -> list[tuple[str, str]]:
+        """
+        Sends every file that fits, returns the (path, filename) of the files that didn't
+        """
+        batches, failed = self.pack(files, limit)
+
+        for unsent in await asyncio.gather(*[self.send_batch(destination, content, batch) for batch in batches]):
+            failed.extend(unsent)
+
+        return failed
@@ -0,0 +1,71 @@
+import os
+import asyncio
+import functools
+
+from config.utils.scheduler import TrackedThreadPoolExecutor
+
+
+class DiskIO:
+    def __init__(self, workers: int = 8, per_device: int = 4):
+        """
+        Runs blocking file work off the event loop on one thread pool shared by everything
+        :param workers: Threads in the pool
+        :param per_device: How many calls may be working on one disk at once, so one big rewrite can't take every
+        thread while the other disks sit idle
+        """
+        self.workers = workers
+        self.per_device = per_device
+        self.executor = None
+        self.semaphores = {}
+
+    def configure(self, workers: int = None, per_device: int = None):
+        # before the first call, the pool is made then
+        self.workers = workers or self.workers
+        self.per_device = per_device or self.per_device
+
+    @staticmethod
+    def device_of(path) -> int:
+        # files that don't exist yet are on their directory's device
+        path = os.path.abspath(path)
+
+        while True:
+            try:
+                return os.stat(path).st_dev
+            except OSError:
+                parent = os.path.dirname(path)
+
+                if parent == path:
+                    return 0
+
+                path = parent
+
+    async def run(self, path, func, *args, **kwargs):
+        """
+        Runs func(*args, **kwargs) in the pool, counting it against the device path is on
+        """
+        if self.executor is None:
+            self.executor = TrackedThreadPoolExecutor(self.workers, thread_name_prefix="disk-io")
+
+        device = self.device_of(path)
+        semaphore = self.semaphores.get(device)
+
+        if semaphore is None:
+            semaphore = self.semaphores[device] = asyncio.Semaphore(self.per_device)
+
+        async with semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                    functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+# one pool for the whole process, sized from the config by the bot
+disk_io = DiskIO()
+
+
+def read_bytes(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
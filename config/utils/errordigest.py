@@ -0,0 +1,84 @@
+import time
+import hashlib
+import traceback
+
+
+class ErrorReport:
+    def __init__(self, fingerprint: str, summary: str, formatted: str):
+        self.fingerprint = fingerprint
+        self.summary = summary
+        self.formatted = formatted
+        self.count = 0
+        self.commands = set()
+        self.first_seen = time.time()
+        self.last_seen = self.first_seen
+
+
+class ErrorDigest:
+    # discord's message length limit
+    MESSAGE_LIMIT = 2000
+    # the tail of a traceback kept in a digest, the innermost frames are the useful ones
+    TRACEBACK_LIMIT = 1500
+
+    def __init__(self):
+        """
+        Groups unexpected errors by where they were raised so the owner gets one message per kind of error
+        every so often instead of one per failure
+        """
+        self.pending: dict[str, ErrorReport] = {}
+        # fingerprints whose traceback was already sent, later digests only count them
+        self.reported = set()
+
+    @staticmethod
+    def fingerprint(error: BaseException) -> str:
+        # the error's type and the code it went through, the message often has ids or paths in it
+        frames = traceback.extract_tb(error.__traceback__)
+        key = type(error).__qualname__ + "".join(f"|{frame.filename}:{frame.name}:{frame.lineno}"
+                                                 for frame in frames)
+        return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+    def add(self, error: BaseException, command: str = None) -> ErrorReport:
+        fingerprint = self.fingerprint(error)
+        report = self.pending.get(fingerprint)
+
+        if report is None:
+            formatted = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+            report = ErrorReport(fingerprint, f"{type(error).__name__}: {error}"[:200], formatted)
+            self.pending[fingerprint] = report
+
+        report.count += 1
+        report.last_seen = time.time()
+
+        if command:
+            report.commands.add(command)
+
+        return report
+
+    def format(self, report: ErrorReport) -> str:
+        commands = ", ".join(f"`{command}`" for command in sorted(report.commands)) or "no command"
+        text = f"**{report.count}x** `{report.fingerprint}` in {commands}: {report.summary}"
+
+        if report.fingerprint not in self.reported:
+            formatted = report.formatted[-self.TRACEBACK_LIMIT:]
+            text += f"\n```Python\n{formatted}```"
+
+        return text[:self.MESSAGE_LIMIT]
+
+    def flush(self) -> list[str]:
+        """
+        Takes everything since the last flush as messages of at most MESSAGE_LIMIT characters, most frequent first
+        """
+        reports = sorted(self.pending.values(), key=lambda report: report.count, reverse=True)
+        self.pending = {}
+        messages = []
+
+        for report in reports:
+            text = self.format(report)
+            self.reported.add(report.fingerprint)
+
+            if messages and len(messages[-1]) + len(text) + 1 <= self.MESSAGE_LIMIT:
+                messages[-1] += "\n" + text
+            else:
+                messages.append(text)
+
+        return messages
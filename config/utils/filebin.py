@@ -5,6 +5,8 @@ import aiohttp
 from discord.ext import commands
 from os import PathLike
 
+from config.utils.diskio import disk_io, read_bytes
+
 UPLOAD_URL = "https://filebin.net"
 
 
@@ -29,8 +31,7 @@ class FileBin:
         if isinstance(file, bytes):
             js = await cls.upload_to_filebin(ctx, name, file, user_id)
         else:
-            with open(file, 'rb') as f:
-                js = await cls.upload_to_filebin(ctx, name, f.read(), user_id)
+            js = await cls.upload_to_filebin(ctx, name, await disk_io.run(file, read_bytes, file), user_id)
 
         file_bin = js.get("bin")
         js = js.get("file")
@@ -0,0 +1,178 @@
+import json
+import time
+import asyncio
+import sqlite3
+import contextlib
+
+
+class JobFailed(Exception):
+    def __init__(self, error_type: str, message: str):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class JobQueue:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, path: str, stale_after: float = 60, poll_interval: float = 0.2, max_attempts: int = 3):
+        """
+        A durable queue in an sqlite file the bot puts work into and worker.py processes take it out of
+        :param path: The database's path, every worker has to reach it and the job files at the same paths
+        :param stale_after: Seconds without a heartbeat before a running job is given to another worker
+        :param poll_interval: Seconds between checks for a job's result or for new jobs
+        :param max_attempts: How many workers a job may go stale on before it's failed instead of given to another,
+        a job that crashes every worker it runs on would otherwise go round them forever
+        """
+        self.path = path
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.create()
+
+    @contextlib.contextmanager
+    def connect(self) -> sqlite3.Connection:
+        # a connection per call so it can be used from any thread, in autocommit mode
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.row_factory = sqlite3.Row
+            yield connection
+        finally:
+            connection.close()
+
+    def create(self):
+        with self.connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    worker TEXT,
+                    result TEXT,
+                    error_type TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    heartbeat REAL
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    def enqueue(self, kind: str, *args, **kwargs) -> int:
+        with self.connect() as connection:
+            cursor = connection.execute("INSERT INTO jobs (kind, payload, state, created) VALUES (?, ?, ?, ?)",
+                                        (kind, json.dumps({"args": args, "kwargs": kwargs}), self.QUEUED,
+                                         time.time()))
+            return cursor.lastrowid
+
+    def claim(self, worker: str) -> sqlite3.Row:
+        """
+        Takes the oldest queued job for worker, jobs whose worker stopped sending heartbeats are queued again first
+        or failed once they've used up their attempts
+        """
+        with self.connect() as connection:
+            # taking the write lock up front so two workers can't claim the same job
+            connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                stale = time.time() - self.stale_after
+                connection.execute("UPDATE jobs SET state = ?, error_type = ?, error = 'The job stopped ' || "
+                                   "attempts || ' workers in a row without finishing, it was given up on.' "
+                                   "WHERE state = ? AND heartbeat < ? AND attempts >= ?",
+                                   (self.FAILED, "JobAbandoned", self.RUNNING, stale, self.max_attempts))
+                connection.execute("UPDATE jobs SET state = ?, worker = NULL WHERE state = ? AND heartbeat < ?",
+                                   (self.QUEUED, self.RUNNING, stale))
+                # nobody is waiting on these anymore, finished ones are normally removed as soon as they're read
+                connection.execute("DELETE FROM jobs WHERE (state = ? AND created < ?) OR (state IN (?, ?) AND "
+                                   "created < ?)", (self.CANCELLED, stale, self.DONE, self.FAILED,
+                                                    time.time() - 86400))
+                job = connection.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id LIMIT 1",
+                                         (self.QUEUED,)).fetchone()
+
+                if job is not None:
+                    connection.execute("UPDATE jobs SET state = ?, worker = ?, heartbeat = ?, "
+                                       "attempts = attempts + 1 WHERE id = ?",
+                                       (self.RUNNING, worker, time.time(), job["id"]))
+
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            return job
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """
+        Returns False once the job was cancelled or handed to another worker
+        """
+        with self.connect() as connection:
+            cursor = connection.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = ? AND worker = ?",
+                                        (time.time(), job_id, self.RUNNING, worker))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker: str, result):
+        with self.connect() as connection:
+            connection.execute("UPDATE jobs SET state = ?, result = ? WHERE id = ? AND state = ? AND worker = ?",
+                               (self.DONE, json.dumps(result), job_id, self.RUNNING, worker))
+
+    def fail(self, job_id: int, worker: str, error: BaseException):
+        with self.connect() as connection:
+            connection.execute("UPDATE jobs SET state = ?, error_type = ?, error = ? "
+                               "WHERE id = ? AND state = ? AND worker = ?",
+                               (self.FAILED, type(error).__name__, str(error), job_id, self.RUNNING, worker))
+
+    def cancel(self, job_id: int):
+        with self.connect() as connection:
+            connection.execute("UPDATE jobs SET state = ? WHERE id = ? AND state IN (?, ?)",
+                               (self.CANCELLED, job_id, self.QUEUED, self.RUNNING))
+
+    def get(self, job_id: int) -> sqlite3.Row:
+        with self.connect() as connection:
+            return connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def remove(self, job_id: int):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def counts(self) -> dict:
+        with self.connect() as connection:
+            return {row["state"]: row["count"] for row in
+                    connection.execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state")}
+
+    async def run(self, kind: str, *args, **kwargs):
+        """
+        Queues a job and waits for a worker to finish it, returning its result
+        cancelling the wait cancels the job
+        """
+        loop = asyncio.get_running_loop()
+        job_id = await loop.run_in_executor(None, lambda: self.enqueue(kind, *args, **kwargs))
+
+        try:
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                job = await loop.run_in_executor(None, self.get, job_id)
+
+                if job["state"] == self.DONE:
+                    return json.loads(job["result"])
+
+                if job["state"] == self.FAILED:
+                    raise JobFailed(job["error_type"], job["error"])
+
+                if job["state"] == self.CANCELLED:
+                    raise asyncio.CancelledError()
+
+        except asyncio.CancelledError:
+            await loop.run_in_executor(None, self.cancel, job_id)
+            raise
+
+        finally:
+            job = await loop.run_in_executor(None, self.get, job_id)
+
+            # finished jobs are only kept until their result is read
+            if job is not None and job["state"] in (self.DONE, self.FAILED):
+                await loop.run_in_executor(None, self.remove, job_id)
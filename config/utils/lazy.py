@@ -0,0 +1,91 @@
+import time
+import typing
+import importlib
+import threading
+import contextlib
+
+
+class StartupReport:
+    def __init__(self):
+        """
+        How long each part of starting up took, imports, cogs and connecting, so restarts can be kept short
+        """
+        self.started = time.perf_counter()
+        self.timings = []
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, name: str, seconds: float):
+        with self.lock:
+            self.timings.append((kind, name, seconds, time.perf_counter() - self.started))
+
+    @contextlib.contextmanager
+    def measure(self, kind: str, name: str):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - start)
+
+    def mark(self, name: str):
+        # a point in time rather than a duration, e.g. when the gateway became ready
+        self.record("mark", name, 0.0)
+
+    def table(self) -> str:
+        with self.lock:
+            timings = list(self.timings)
+
+        width = max([len(name) for _, name, _, _ in timings] + [4])
+        lines = [f"{'kind':<6} {'name':<{width}} {'took':>8} {'at':>8}"]
+
+        for kind, name, seconds, at in timings:
+            took = "" if kind == "mark" else f"{seconds * 1000:.0f}ms"
+            lines.append(f"{kind:<6} {name:<{width}} {took:>8} {at:>7.2f}s")
+
+        return "\n".join(lines)
+
+
+# one for the whole process so every lazy import ends up in the same report
+startup = StartupReport()
+
+
+class LazyModule:
+    def __init__(self, name: str, attribute: str = None, on_import: typing.Callable = None):
+        """
+        Stands in for a module (or one of its attributes) and only imports it the first time it's used
+        the import time is recorded in the startup report
+        :param name: The module to import
+        :param attribute: An attribute of the module to stand in for instead, e.g. a class
+        :param on_import: Called with the module once it's imported, for module level setup
+        """
+        self._name = name
+        self._attribute = attribute
+        self._on_import = on_import
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._target is not None:
+            return self._target
+
+        with self._lock:
+            if self._target is None:
+                with startup.measure("lazy", self._name):
+                    module = importlib.import_module(self._name)
+
+                if self._on_import is not None:
+                    self._on_import(module)
+
+                self._target = getattr(module, self._attribute) if self._attribute else module
+
+        return self._target
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self):
+        state = "imported" if self._target is not None else "not imported"
+        return f"<lazy {self._name}{'.' + self._attribute if self._attribute else ''} ({state})>"
@@ -0,0 +1,154 @@
+import io
+import os
+import zlib
+import struct
+
+from discord.ext import commands
+
+COMPRESSED_MAGIC = b"DFASFPAC"
+BUFFER_SIZE = 1048576
+
+
+class PacCompression:
+    """
+    The compressed .pac container tools/PACFC.exe reads and writes:
+    DFASFPAC, the decompressed size (<I), sometimes the compressed size (<I), then a zlib stream of a regular FPAC
+    """
+
+    @staticmethod
+    def is_compressed(path) -> bool:
+        with open(path, "rb") as f:
+            return f.read(len(COMPRESSED_MAGIC)) == COMPRESSED_MAGIC
+
+    @staticmethod
+    def find_stream(f) -> int:
+        # the stream either follows the size straight away or after the compressed size
+        for offset in (12, 16):
+            f.seek(offset)
+            header = f.read(2)
+
+            # a zlib header is a multiple of 31 when read big endian
+            if len(header) == 2 and header[0] & 0x0F == 8 and int.from_bytes(header, "big") % 31 == 0:
+                return offset
+
+        raise commands.BadArgument("The compressed .pac file has an incorrect structure.")
+
+    @classmethod
+    def decompress(cls, path, output_path, max_size: int = None):
+        """
+        Streams a compressed .pac at path into a regular .pac at output_path
+        :param max_size: The most bytes it may decompress to, checked against the size it claims before anything
+        is written
+        """
+        with open(path, "rb") as f, open(output_path, "wb") as output:
+            if f.read(len(COMPRESSED_MAGIC)) != COMPRESSED_MAGIC:
+                raise commands.BadArgument("The .pac file isn't compressed.")
+
+            size = struct.unpack("<I", f.read(4))[0]
+
+            if max_size is not None and size > max_size:
+                raise commands.BadArgument(f"The compressed .pac file decompresses to {size / 1048576:.1f} MB, "
+                                           f"more than the {max_size / 1048576:.1f} MB allowed.")
+            f.seek(cls.find_stream(f))
+            decompressor = zlib.decompressobj()
+            written = 0
+
+            try:
+                while not decompressor.eof:
+                    chunk = f.read(BUFFER_SIZE)
+                    if not chunk:
+                        break
+
+                    # bounding each step so a tiny bomb of a stream can't balloon past the size it claims
+                    data = decompressor.decompress(chunk, size - written + 1)
+                    while data:
+                        written += len(data)
+                        if written > size:
+                            raise commands.BadArgument("The compressed .pac file is bigger than it claims.")
+                        output.write(data)
+                        data = decompressor.decompress(decompressor.unconsumed_tail, size - written + 1)
+
+            except zlib.error:
+                raise commands.BadArgument("The compressed .pac file is corrupted.")
+
+            if written != size:
+                raise commands.BadArgument("The compressed .pac file is truncated.")
+
+    @classmethod
+    def compress(cls, path, output_path, level: int = 6):
+        """
+        Streams a regular .pac at path into a compressed .pac at output_path
+        """
+        size = os.path.getsize(path)
+
+        with open(path, "rb") as f, open(output_path, "wb") as output:
+            output.write(COMPRESSED_MAGIC)
+            output.write(struct.pack("<I", size))
+
+            compressor = zlib.compressobj(level)
+
+            for chunk in iter(lambda: f.read(BUFFER_SIZE), b""):
+                output.write(compressor.compress(chunk))
+
+            output.write(compressor.flush())
+
+    @classmethod
+    def decompress_in_place(cls, path, max_size: int = None) -> bool:
+        """
+        Decompresses path if it's compressed, returning whether it was
+        :param max_size: See decompress
+        """
+        if not cls.is_compressed(path):
+            return False
+
+        temp_path = f"{path}.tmp"
+
+        try:
+            cls.decompress(path, temp_path, max_size)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        os.replace(temp_path, path)
+        return True
+
+    @classmethod
+    def compress_in_place(cls, path):
+        temp_path = f"{path}.tmp"
+        cls.compress(path, temp_path)
+        os.replace(temp_path, path)
+
+
+class HeadDecompressor:
+    def __init__(self, length: int):
+        """
+        Decompresses the start of a compressed .pac fed to it a piece at a time, e.g. to read the header of an
+        upload without downloading all of it, every piece is only decompressed once
+        :param length: The most bytes kept, the rest of the stream is ignored
+        """
+        self.length = length
+        self.decompressor = None
+        self.head = bytearray()
+
+    def feed(self, data: bytes) -> bytes:
+        """
+        Takes the next piece of the file, the first one starting at its beginning, returns everything
+        decompressed so far
+        """
+        if self.decompressor is None:
+            if data[:len(COMPRESSED_MAGIC)] != COMPRESSED_MAGIC:
+                raise commands.BadArgument("The .pac file isn't compressed.")
+
+            data = data[PacCompression.find_stream(io.BytesIO(data)):]
+            self.decompressor = zlib.decompressobj()
+
+        if len(self.head) >= self.length:
+            return self.head
+
+        try:
+            self.head += self.decompressor.decompress(data, self.length - len(self.head))
+        except zlib.error:
+            raise commands.BadArgument("The compressed .pac file is corrupted.")
+
+        return self.head
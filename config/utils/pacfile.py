@@ -1,9 +1,15 @@
+import io
 import mmap
 import struct
 import os
 
 from discord.ext import commands
 
+from config.utils.diskio import disk_io
+from config.utils.lazy import LazyModule
+
+np = LazyModule("numpy")
+
 
 class File:
     def __init__(self, file_header):
@@ -50,6 +56,10 @@ class File:
 
 
 class FileHeader:
+    # the most files and the longest names an uploaded archive may have, the games' own are far below both
+    MAX_FILES = 65536
+    MAX_NAME_LENGTH = 256
+
     def __init__(self, pac_path):
         self.file_path = pac_path
         self.magic_word = ""
@@ -61,26 +71,155 @@ class FileHeader:
         self.buffer_size = 1048576
 
         with open(pac_path, "rb") as binary_file:
-            magic_word = binary_file.read(4).decode("ASCII")
-
-            if magic_word != "FPAC":
-                raise commands.BadArgument("File has an incorrect structure.")
-
-            self.magic_word = magic_word
-            self.start_offset = struct.unpack("<i", binary_file.read(4))[0]
-            self.file_size = struct.unpack("<i", binary_file.read(4))[0]
-            self.count_of_files = struct.unpack("<i", binary_file.read(4))[0]
-            binary_file.seek(4, 1)
-            self.name_length = struct.unpack("<i", binary_file.read(4))[0]
-            binary_file.seek(8, 1)
-            for _ in range(self.count_of_files):
-                file_obj = File(self)
-                file_obj.file_name = binary_file.read(self.name_length).decode("ASCII").replace("\0", "")
-                file_obj.id = struct.unpack("<i", binary_file.read(4))[0]
-                file_obj.offset = (struct.unpack("<i", binary_file.read(4))[0] + self.start_offset + 15) // 16 * 16
-                file_obj.file_size = struct.unpack("<i", binary_file.read(4))[0]
-                binary_file.seek(4 - (self.name_length % 4), 1)
-                self.files.append(file_obj)
+            self.parse(binary_file, os.fstat(binary_file.fileno()).st_size)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, pac_path=None, actual_size: int = None) -> "FileHeader":
+        """
+        Parses a header from the start of an archive, e.g. the first bytes of an upload, without the rest of it
+        :param actual_size: The whole archive's size if it's known, the entries are checked against it
+        """
+        header = cls.__new__(cls)
+        header.file_path = pac_path
+        header.magic_word = ""
+        header.start_offset = 0
+        header.file_size = 0
+        header.count_of_files = 0
+        header.name_length = 0
+        header.files = []
+        header.buffer_size = 1048576
+        header.parse(io.BytesIO(data), actual_size)
+        return header
+
+    def parse(self, binary_file, actual_size: int = None):
+        fixed = binary_file.read(32)
+
+        if len(fixed) < 32 or fixed[:4] != b"FPAC":
+            raise commands.BadArgument("File has an incorrect structure.")
+
+        self.magic_word = "FPAC"
+        self.start_offset, self.file_size, self.count_of_files = struct.unpack_from("<3i", fixed, 4)
+        self.name_length = struct.unpack_from("<i", fixed, 20)[0]
+        # everything is checked before a single entry is read, a hostile count or name length can't make it loop
+        # or allocate more than the archive is
+        entries = self.validate(binary_file, actual_size)
+
+        for name, file_id, offset, file_size in zip(entries["name"].tolist(), entries["id"].tolist(),
+                                                     entries["offset"].tolist(), entries["size"].tolist()):
+            file_obj = File(self)
+            file_obj.file_name = name.decode("ASCII")
+            file_obj.id = file_id
+            file_obj.offset = (offset + self.start_offset + 15) // 16 * 16
+            file_obj.file_size = file_size
+            self.files.append(file_obj)
+
+    @staticmethod
+    def entry_stride(name_length: int) -> int:
+        # name, id, offset, size and a reserved int, padded to 16 bytes, reading and writing both go by it
+        return (name_length + 16 + 15) // 16 * 16
+
+    @staticmethod
+    def invalid(reason: str) -> commands.BadArgument:
+        return commands.BadArgument(f"File has an incorrect structure ({reason}).")
+
+    def validate(self, binary_file, actual_size: int = None):
+        """
+        Reads the entry table in one go and checks all of it at once, counts, names, ids, bounds and overlaps
+        :param actual_size: The archive's real size, None skips the checks that need it
+        :return: The entries as a numpy structured array of name, id, offset (relative) and size
+        """
+        count, name_length = self.count_of_files, self.name_length
+
+        if not 0 < count <= self.MAX_FILES:
+            raise self.invalid(f"{count} files")
+
+        if not 0 < name_length <= self.MAX_NAME_LENGTH:
+            raise self.invalid(f"names {name_length} bytes long")
+
+        stride = self.entry_stride(name_length)
+        table_end = 32 + count * stride
+
+        if self.start_offset < table_end:
+            raise self.invalid("the files start inside the header")
+
+        if actual_size is not None and (self.start_offset > actual_size or self.file_size > actual_size):
+            raise self.invalid("it's cut short")
+
+        table = binary_file.read(count * stride)
+
+        if len(table) < count * stride:
+            raise self.invalid("it's cut short")
+
+        dtype = np.dtype({"names": ["name", "id", "offset", "size"],
+                          "formats": [f"S{name_length}", "<i4", "<i4", "<i4"],
+                          "offsets": [0, name_length, name_length + 4, name_length + 8],
+                          "itemsize": stride})
+        entries = np.frombuffer(table, dtype=dtype, count=count)
+        names = np.frombuffer(table, dtype=np.uint8).reshape(count, stride)[:, :name_length]
+        offsets = (entries["offset"].astype(np.int64) + self.start_offset + 15) // 16 * 16
+        sizes = entries["size"].astype(np.int64)
+
+        # printable ascii padded with nulls, nothing after the first null and no path separators
+        nulls = names == 0
+        printable = (names >= 0x20) & (names < 0x7F) & (names != ord("/")) & (names != ord("\\"))
+
+        if nulls[:, 0].any() or not (nulls | printable).all() or \
+                (np.logical_or.accumulate(nulls, axis=1) & ~nulls).any() or \
+                (np.char.find(entries["name"], b"..") >= 0).any():
+            raise self.invalid("a file name isn't valid")
+
+        if len(np.unique(entries["id"])) != count:
+            raise self.invalid("two files share an id")
+
+        if (entries["offset"] < 0).any() or (sizes < 0).any():
+            raise self.invalid("a negative offset or size")
+
+        if actual_size is not None and (offsets + sizes > actual_size).any():
+            raise self.invalid("a file goes past the end")
+
+        order = np.argsort(offsets, kind="stable")
+
+        if (offsets[order][:-1] + sizes[order][:-1] > offsets[order][1:]).any():
+            raise self.invalid("two files overlap")
+
+        return entries
+
+    @classmethod
+    async def open(cls, pac_path) -> "FileHeader":
+        """
+        Parses the header on the shared disk pool instead of the event loop
+        """
+        return await disk_io.run(pac_path, cls, pac_path)
+
+    def to_index(self) -> dict:
+        """
+        The parsed header as plain data, so an archive that's read often doesn't need parsing again
+        """
+        return {"start_offset": self.start_offset, "file_size": self.file_size, "name_length": self.name_length,
+                "files": [[file_obj.file_name, file_obj.id, file_obj.offset, file_obj.file_size]
+                          for file_obj in self.files]}
+
+    @classmethod
+    def from_index(cls, pac_path, index: dict) -> "FileHeader":
+        header = cls.__new__(cls)
+        header.file_path = pac_path
+        header.magic_word = "FPAC"
+        header.start_offset = index["start_offset"]
+        header.file_size = index["file_size"]
+        header.count_of_files = len(index["files"])
+        header.name_length = index["name_length"]
+        header.files = []
+        header.buffer_size = 1048576
+
+        for file_name, file_id, offset, file_size in index["files"]:
+            file_obj = File(header)
+            file_obj.file_name = file_name
+            file_obj.id = file_id
+            file_obj.offset = offset
+            file_obj.file_size = file_size
+            header.files.append(file_obj)
+
+        return header
 
     def extract_all_files(self, dir_path):
         with open(self.file_path, "rb") as file_stream:
@@ -96,14 +235,42 @@ class FileHeader:
 
 
 
+    async def extract_all_files_async(self, dir_path):
+        await disk_io.run(self.file_path, self.extract_all_files, dir_path)
+
+    def read(self, file_obj, length: int = None) -> bytes:
+        # only the first length bytes of the file when it's given
+        with open(self.file_path, "rb") as file_stream:
+            file_stream.seek(file_obj.offset)
+            return file_stream.read(file_obj.file_size if length is None else min(length, file_obj.file_size))
+
+    async def read_async(self, file_obj, length: int = None) -> bytes:
+        return await disk_io.run(self.file_path, self.read, file_obj, length)
+
     def replace(self, file_obj, file_path):
-        temp_file_path = "temp.tmp"
-        file_size = os.path.getsize(file_path)
+        self.replace_many([(file_obj, file_path)])
+
+    async def replace_async(self, file_obj, file_path):
+        await self.replace_many_async([(file_obj, file_path)])
+
+    async def replace_many_async(self, replacements):
+        await disk_io.run(self.file_path, self.replace_many, replacements)
+
+    def replace_many(self, replacements):
+        """
+        Replaces several files in one rewrite of the archive
+        :param replacements: (file_obj, path of the new file) pairs
+        """
+        # next to the archive so several archives can be rewritten at once
+        temp_file_path = f"{self.file_path}.tmp"
+        paths = {file_obj.id: file_path for file_obj, file_path in replacements}
+        # the untouched files are copied from where they are now, not where they're moved to
+        old_offsets = {file_item.id: file_item.offset for file_item in self.files}
 
         with open(self.file_path, "rb") as file_stream, open(temp_file_path, "wb") as temp_file_stream:
             for file_item in self.files:
-                if file_item.id == file_obj.id:
-                    file_item.file_size = file_size
+                if file_item.id in paths:
+                    file_item.file_size = os.path.getsize(paths[file_item.id])
 
             self.recalculate_values()
 
@@ -115,6 +282,8 @@ class FileHeader:
             temp_file_stream.write(struct.pack("<i", self.name_length))
             temp_file_stream.write(struct.pack("<q", 0))
 
+            stride = self.entry_stride(self.name_length)
+
             for file_item in self.files:
                 temp_file_stream.write(file_item.file_name.encode("ASCII"))
                 padding_size = max(0, self.name_length - len(file_item.file_name))
@@ -123,15 +292,16 @@ class FileHeader:
                 temp_file_stream.write(struct.pack("<i", file_item.offset - self.start_offset))
                 temp_file_stream.write(struct.pack("<i", file_item.file_size))
                 temp_file_stream.write(struct.pack("<i", 0))
-                # Align to 16-byte boundary
-                while temp_file_stream.tell() % 16 != 0:
-                    temp_file_stream.write(b"\0")
+                # padded out to the stride validate reads the entries with
+                temp_file_stream.write(b"\0" * (stride - self.name_length - 16))
+
+            temp_file_stream.write(b"\0" * (self.start_offset - temp_file_stream.tell()))
 
             for file_item in self.files:
                 buffer_size = self.buffer_size
 
-                if file_item.id == file_obj.id:
-                    with open(file_path, "rb") as replacement_file:
+                if file_item.id in paths:
+                    with open(paths[file_item.id], "rb") as replacement_file:
                         bytes_written = 0
                         while True:
                             data = replacement_file.read(buffer_size)
@@ -145,7 +315,7 @@ class FileHeader:
                         if remaining_size > 0:
                             temp_file_stream.write(b"\0" * remaining_size)
                 else:
-                    file_stream.seek(file_item.offset)
+                    file_stream.seek(old_offsets[file_item.id])
                     data = file_stream.read(file_item.file_size)
                     temp_file_stream.write(data)
 
@@ -158,11 +328,7 @@ class FileHeader:
         num = max(len(file_item.file_name) for file_item in self.files)
         self.name_length = ((num + 1 + 3) // 4) * 4
 
-        # Calculate header entry size (aligned to 16 bytes)
-        header_entry_size = self.name_length + 16
-        header_entry_size = ((header_entry_size + 15) // 16) * 16
-
-        header_size = 32 + len(self.files) * header_entry_size
+        header_size = 32 + len(self.files) * self.entry_stride(self.name_length)
         self.start_offset = ((header_size + 15) // 16) * 16
 
         self.files[0].offset = self.start_offset
@@ -0,0 +1,120 @@
+import os
+import struct
+import hashlib
+
+from config.utils.pacfile import FileHeader
+
+MAGIC = b"ESPATCH1"
+COPY = 0
+DATA = 1
+END = 2
+# the script users run to apply a patch, it doesn't need anything but python
+APPLIER_PATH = os.path.join(os.getcwd(), "tools/applypatch.py")
+
+
+class PacPatchError(Exception):
+    pass
+
+
+class PacPatch:
+    """
+    A patch turning an original .pac into a modified one,
+    members that didn't change are copied from the original and only the rest is stored
+
+    layout:
+    ESPATCH1, original size (<Q), original sha256, modified size (<Q), modified sha256
+    then ops until END, COPY (<BQQ) offset and size in the original, DATA (<BQ) size followed by the bytes
+    """
+
+    def __init__(self, original_path, modified_path, modified_index: dict = None):
+        """
+        :param modified_index: The header the rewrite of modified_path left behind (see FileHeader.to_index),
+        so the output isn't parsed again
+        """
+        self.original = FileHeader(original_path)
+        self.modified = FileHeader.from_index(modified_path, modified_index) if modified_index \
+            else FileHeader(modified_path)
+        self.buffer_size = self.modified.buffer_size
+
+    @staticmethod
+    def file_hash(path, offset=0, size=None) -> bytes:
+        sha = hashlib.sha256()
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            remaining = os.path.getsize(path) - offset if size is None else size
+
+            while remaining > 0:
+                data = f.read(min(remaining, 1048576))
+                if not data:
+                    break
+                sha.update(data)
+                remaining -= len(data)
+
+        return sha.digest()
+
+    def find_unchanged(self, file_obj):
+        # only members with the same name and size are hashed
+        for original in self.original.files:
+            if original.file_name == file_obj.file_name and original.file_size == file_obj.file_size:
+                if self.file_hash(self.original.file_path, original.offset, original.file_size) == \
+                        self.file_hash(self.modified.file_path, file_obj.offset, file_obj.file_size):
+                    return original
+
+        return None
+
+    def write_data(self, source, patch, offset, size):
+        patch.write(struct.pack("<BQ", DATA, size))
+        source.seek(offset)
+
+        while size > 0:
+            data = source.read(min(size, self.buffer_size))
+            if not data:
+                raise PacPatchError("The modified .pac is shorter than its header says.")
+            patch.write(data)
+            size -= len(data)
+
+    def write(self, patch_path) -> int:
+        original_path = self.original.file_path
+        modified_path = self.modified.file_path
+
+        with open(modified_path, "rb") as source, open(patch_path, "wb") as patch:
+            patch.write(MAGIC)
+            patch.write(struct.pack("<Q", os.path.getsize(original_path)))
+            patch.write(self.file_hash(original_path))
+            patch.write(struct.pack("<Q", os.path.getsize(modified_path)))
+            patch.write(self.file_hash(modified_path))
+
+            cursor = 0
+
+            for file_obj in sorted(self.modified.files, key=lambda f: f.offset):
+                # the header table and alignment padding before this member
+                if file_obj.offset > cursor:
+                    self.write_data(source, patch, cursor, file_obj.offset - cursor)
+
+                unchanged = self.find_unchanged(file_obj)
+
+                if unchanged is not None:
+                    patch.write(struct.pack("<BQQ", COPY, unchanged.offset, unchanged.file_size))
+                else:
+                    self.write_data(source, patch, file_obj.offset, file_obj.file_size)
+
+                cursor = file_obj.offset + file_obj.file_size
+
+            end = os.path.getsize(modified_path)
+            if end > cursor:
+                self.write_data(source, patch, cursor, end - cursor)
+
+            patch.write(struct.pack("<B", END))
+
+        return os.path.getsize(patch_path)
+
+    @classmethod
+    def create(cls, original_path, modified_path, patch_path, modified_index: dict = None) -> int:
+        """
+        Writes a patch from original_path to modified_path into patch_path and returns its size
+        """
+        if not os.path.exists(original_path):
+            raise PacPatchError("The original .pac is needed to create a patch.")
+
+        return cls(original_path, modified_path, modified_index).write(patch_path)
@@ -0,0 +1,288 @@
+import math
+
+from config.utils.lazy import LazyModule
+
+np = LazyModule("numpy")
+AudioSegment = LazyModule("pydub", "AudioSegment")
+
+
+class PCMConverter:
+    """
+    Converts decoded audio to the rate, sample width and channel count the xwb expects on whole arrays,
+    pydub's own conversion goes through audioop a sample at a time and audioop is gone in newer pythons
+    """
+    # taps each output sample is made from, more is a sharper anti aliasing filter
+    TAPS = 32
+    # kaiser window beta, about 80 dB of stopband attenuation
+    BETA = 8.6
+    # ITU-R BS.1770 K weighting, a high shelf (gain dB, q, Hz) then a high pass (q, Hz)
+    K_SHELF = (4.0, 1 / math.sqrt(2), 1500.0)
+    K_HIGH_PASS = (0.5, 38.0)
+    # BS.1770 gating, 400 ms blocks every 100 ms, an absolute gate in LUFS and a relative one in LU
+    ABSOLUTE_GATE = -70.0
+    RELATIVE_GATE = -10.0
+    # quiet songs aren't boosted by more than this many dB, it would mostly be noise, and songs already within
+    # GAIN_TOLERANCE dB of the target are left as they are
+    MAX_GAIN = 20.0
+    GAIN_TOLERANCE = 0.1
+    # the sample peak normalized audio is limited under (-1 dBFS), the limiter's block length in seconds and
+    # how many blocks either side a reduction is held over so it fades in and out instead of clicking
+    LIMIT_CEILING = 0.891
+    LIMIT_BLOCK = 0.005
+    LIMIT_HOLD = 4
+
+    @staticmethod
+    def to_array(segment: AudioSegment) -> "np.ndarray":
+        """
+        Returns the segment's samples as float32 in [-1, 1) with the shape (frames, channels)
+        """
+        width = segment.sample_width
+        raw = np.frombuffer(segment.raw_data, dtype=np.uint8)
+
+        if width == 1:
+            # 8 bit wav is unsigned
+            samples = raw.astype(np.float32) - 128
+        elif width == 3:
+            # 24 bit has no numpy type, padding each sample to 32 bits keeps the sign in the top byte
+            padded = np.zeros((len(raw) // 3, 4), dtype=np.uint8)
+            padded[:, 1:] = raw[:len(raw) // 3 * 3].reshape(-1, 3)
+            samples = padded.view("<i4").ravel().astype(np.float32) / 256
+        else:
+            samples = np.frombuffer(segment.raw_data, dtype=f"<i{width}").astype(np.float32)
+
+        samples /= float(1 << (width * 8 - 1))
+        return samples[:len(samples) // segment.channels * segment.channels].reshape(-1, segment.channels)
+
+    @staticmethod
+    def remix(samples: "np.ndarray", channels: int) -> "np.ndarray":
+        if samples.shape[1] == channels:
+            return samples
+
+        if channels == 1:
+            return samples.mean(axis=1, keepdims=True)
+
+        if samples.shape[1] == 1:
+            return np.repeat(samples, channels, axis=1)
+
+        # surround down to stereo, even channels are on the left and odd ones on the right
+        left = samples[:, 0::2].mean(axis=1)
+        right = samples[:, 1::2].mean(axis=1)
+        return np.stack([left, right], axis=1)[:, :channels]
+
+    @classmethod
+    def filter_bank(cls, up: int, down: int) -> "np.ndarray":
+        """
+        A windowed sinc low pass at the upsampled rate split into up phases of TAPS each
+        """
+        length = cls.TAPS * up
+        # cuts at whichever nyquist is lower, slightly early so the transition band is below it
+        cutoff = 0.5 / max(up, down) * 0.94
+        # centred on the same tap resample delays by so nothing is shifted by a fraction of a sample
+        n = np.arange(length) - (length - 1) // 2
+        window = np.i0(cls.BETA * np.sqrt(1 - (n / (length / 2 + 1)) ** 2)) / np.i0(cls.BETA)
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * window * up
+
+        # phase p holds taps p, p + up, p + 2 * up...
+        return taps.reshape(cls.TAPS, up).T.astype(np.float32)
+
+    @classmethod
+    def resample(cls, samples: "np.ndarray", rate: int, new_rate: int) -> "np.ndarray":
+        """
+        Polyphase resampling of (frames, channels) samples from rate to new_rate
+        """
+        if rate == new_rate or not len(samples):
+            return samples
+
+        gcd = math.gcd(rate, new_rate)
+        up, down = new_rate // gcd, rate // gcd
+        bank = cls.filter_bank(up, down)
+
+        frames = math.ceil(len(samples) * up / down)
+        # centering the filter on each output sample so nothing is delayed
+        delay = (cls.TAPS * up - 1) // 2
+        pad = cls.TAPS
+        padded = np.pad(samples, ((pad, pad), (0, 0)))
+        # every input window of TAPS samples as a view, (windows, channels, taps)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, cls.TAPS, axis=0)
+        output = np.empty((frames, samples.shape[1]), dtype=np.float32)
+
+        # output samples up apart use the same phase and windows down apart, so each phase is one matmul
+        for first in range(min(up, frames)):
+            position = first * down + delay
+            start = position // up - (cls.TAPS - 1) + pad
+            count = len(range(first, frames, up))
+            selected = windows[start:start + (count - 1) * down + 1:down]
+            # the windows run oldest to newest and the taps newest to oldest
+            output[first::up] = selected @ bank[position % up, ::-1]
+
+        return output
+
+    @classmethod
+    def k_weights(cls, rate: int, size: int) -> "np.ndarray":
+        """
+        The K weighting biquads' power response at the bins of a size sample rfft, times what each bin counts
+        for by Parseval, so a block's weighted energy is its spectrum's power summed against these
+        """
+        gain, q, frequency = cls.K_SHELF
+        a = 10 ** (gain / 40)
+        w0 = 2 * math.pi * frequency / rate
+        alpha = math.sin(w0) / (2 * q)
+        shelf = ([a * ((a + 1) + (a - 1) * math.cos(w0) + 2 * math.sqrt(a) * alpha),
+                  -2 * a * ((a - 1) + (a + 1) * math.cos(w0)),
+                  a * ((a + 1) + (a - 1) * math.cos(w0) - 2 * math.sqrt(a) * alpha)],
+                 [(a + 1) - (a - 1) * math.cos(w0) + 2 * math.sqrt(a) * alpha,
+                  2 * ((a - 1) - (a + 1) * math.cos(w0)),
+                  (a + 1) - (a - 1) * math.cos(w0) - 2 * math.sqrt(a) * alpha])
+
+        q, frequency = cls.K_HIGH_PASS
+        w0 = 2 * math.pi * frequency / rate
+        alpha = math.sin(w0) / (2 * q)
+        high_pass = ([(1 + math.cos(w0)) / 2, -(1 + math.cos(w0)), (1 + math.cos(w0)) / 2],
+                     [1 + alpha, -2 * math.cos(w0), 1 - alpha])
+
+        z = np.exp(-1j * 2 * np.pi * np.fft.rfftfreq(size))
+        weights = np.full(len(z), 2.0 / size)
+        # the bins that aren't mirrored count once
+        weights[0] /= 2
+
+        if size % 2 == 0:
+            weights[-1] /= 2
+
+        for b, a in (shelf, high_pass):
+            weights *= np.abs(np.polyval(b[::-1], z) / np.polyval(a[::-1], z)) ** 2
+
+        return weights.astype(np.float32)
+
+    @classmethod
+    def loudness(cls, samples: "np.ndarray", rate: int) -> float:
+        """
+        Gated integrated loudness of (frames, channels) samples in LUFS, -inf for silence
+        the K weighting is done on the spectrum of every 100 ms instead of filtering every sample, one rfft each.
+        a sine window keeps the bass from leaking into the bins the high pass drops, its average power of a half
+        is made up for in the weights, within a few hundredths of a dB of filtering on anything but a drifting DC
+        """
+        hop = rate // 10
+        window = np.sin(np.pi * (np.arange(hop) + 0.5) / hop).astype(np.float32)
+        weights = cls.k_weights(rate, hop) * 2
+        count = len(samples) // hop
+        channels = samples.shape[1]
+        # the energy of every 100 ms of the K weighted audio, blocks are made of four of them
+        energies = np.empty((count, channels))
+        # a few seconds of spectra at a time
+        chunk = 100
+
+        for start in range(0, count, chunk):
+            frames = samples[start * hop:min(count, start + chunk) * hop].reshape(-1, hop, channels)
+            spectra = np.fft.rfft(frames.transpose(0, 2, 1) * window, axis=-1)
+            energies[start:start + len(frames)] = (spectra.real ** 2 + spectra.imag ** 2) @ weights
+
+        if len(energies) < 4:
+            # shorter than one block, the whole thing is the block
+            blocks = energies.sum(axis=0, keepdims=True) / max(1, len(energies) * hop)
+        else:
+            blocks = np.lib.stride_tricks.sliding_window_view(energies, 4, axis=0).sum(axis=-1) / (4 * hop)
+
+        power = blocks.sum(axis=1)
+
+        with np.errstate(divide="ignore"):
+            block_loudness = -0.691 + 10 * np.log10(power)
+
+        gated = block_loudness > cls.ABSOLUTE_GATE
+
+        if not gated.any():
+            return -math.inf
+
+        relative = -0.691 + 10 * math.log10(power[gated].mean()) + cls.RELATIVE_GATE
+        gated &= block_loudness > relative
+        return -0.691 + 10 * math.log10(power[gated].mean())
+
+    @classmethod
+    def loudness_gain(cls, samples: "np.ndarray", rate: int, target: float) -> float:
+        """
+        The gain that brings samples to target LUFS
+        """
+        measured = cls.loudness(samples, rate)
+
+        if not math.isfinite(measured):
+            return 1.0
+
+        return 10 ** (min(target - measured, cls.MAX_GAIN) / 20)
+
+    @classmethod
+    def limit(cls, samples: "np.ndarray", rate: int) -> "np.ndarray":
+        """
+        Turns samples down wherever they'd peak over LIMIT_CEILING, a gain per short block held over its
+        neighbours and interpolated between blocks so no sample is over but the gain doesn't jump
+        """
+        block = max(1, int(rate * cls.LIMIT_BLOCK))
+        count = -(-len(samples) // block)
+        padded = np.zeros((count * block, samples.shape[1]), dtype=samples.dtype)
+        padded[:len(samples)] = samples
+        peaks = np.abs(padded).reshape(count, -1).max(axis=1)
+        gains = np.minimum(1.0, cls.LIMIT_CEILING / np.maximum(peaks, 1e-9))
+
+        if gains.min() >= 1.0:
+            return samples
+
+        held = gains.copy()
+
+        for shift in range(1, min(cls.LIMIT_HOLD, count - 1) + 1):
+            held[shift:] = np.minimum(held[shift:], gains[:-shift])
+            held[:-shift] = np.minimum(held[:-shift], gains[shift:])
+
+        # every sample sits between its own block's centre and a neighbour's, both at most its block's gain
+        gain = np.interp(np.arange(len(samples)), (np.arange(count) + 0.5) * block, held)
+        return samples * gain[:, None].astype(samples.dtype)
+
+    @classmethod
+    def normalize(cls, segment: AudioSegment, target: float) -> AudioSegment:
+        """
+        Brings an already converted 16 bit segment to target LUFS, for when pydub did the conversion
+        """
+        samples = cls.to_array(segment)
+        gain = cls.loudness_gain(samples, segment.frame_rate, target)
+
+        if abs(20 * math.log10(gain)) < cls.GAIN_TOLERANCE:
+            return segment
+
+        # when nothing would go over the 16 bit samples are just scaled, only the limiter needs the float ones
+        if np.abs(samples).max() * gain <= cls.LIMIT_CEILING:
+            scaled = np.frombuffer(segment.raw_data, dtype="<i2") * np.float32(gain)
+            return segment._spawn(np.round(scaled).astype("<i2").tobytes())
+
+        samples = cls.limit(samples * np.float32(gain), segment.frame_rate)
+        return segment._spawn(cls.quantize(samples).tobytes())
+
+    @staticmethod
+    def quantize(samples: "np.ndarray", seed: int = None) -> "np.ndarray":
+        """
+        Triangular dithers samples down to interleaved int16
+        """
+        rng = np.random.default_rng(seed)
+        scaled = samples * 32768 + (rng.random(samples.shape, dtype=np.float32) -
+                                    rng.random(samples.shape, dtype=np.float32))
+        return np.clip(np.round(scaled), -32768, 32767).astype("<i2")
+
+    @classmethod
+    def convert(cls, segment: AudioSegment, rate: int, channels: int = 2, loudness: float = None) -> AudioSegment:
+        """
+        Returns segment as 16 bit audio at rate with channels channels
+        :param loudness: Normalizes to this many LUFS, measured on the resampled array before it's quantized
+        """
+        samples = cls.to_array(segment)
+
+        # downmixing first and upmixing last so the fewest channels go through the resampler
+        if channels < segment.channels:
+            samples = cls.remix(samples, channels)
+
+        samples = cls.resample(samples, segment.frame_rate, rate)
+
+        gain = 1.0 if loudness is None else cls.loudness_gain(samples, rate, loudness)
+
+        if abs(20 * math.log10(gain)) >= cls.GAIN_TOLERANCE:
+            samples = cls.limit(samples * np.float32(gain), rate)
+
+        samples = cls.remix(samples, channels)
+
+        return AudioSegment(data=cls.quantize(samples).tobytes(), sample_width=2, frame_rate=rate,
+                            channels=channels)
@@ -51,6 +51,32 @@ class Request:
             headers = response.headers.get("content-type")
             return await self.return_content(response, headers)
 
+    @error_handle
+    async def fetch_range(self, url, start: int, length: int) -> bytes:
+        """
+        Fetches length bytes of url from start, fewer at the end of the file
+        redirects aren't followed, a host that was checked can't hand the request on somewhere else
+        """
+        async with self.session.get(url, headers={"Range": f"bytes={start}-{start + length - 1}"},
+                                    allow_redirects=False) as response:
+
+            if response.status == 416:
+                return b""
+
+            if response.status == 206:
+                return await response.read()
+
+            if not response.status == 200:
+                raise RequestFailed(f"seems like an unexpected error occurred for this request `{response.reason}`.")
+
+            # the server ignored the range, only what's needed of the whole file is read
+            try:
+                data = await response.content.readexactly(start + length)
+            except asyncio.IncompleteReadError as e:
+                data = e.partial
+
+            return data[start:]
+
     @error_handle
     async def post(self, url, **kwargs):
 
@@ -0,0 +1,300 @@
+import os
+import time
+import typing
+import heapq
+import functools
+import asyncio
+import itertools
+import threading
+import contextlib
+import contextvars
+import concurrent.futures
+
+from collections import defaultdict
+
+from discord.ext import commands
+
+from config.utils.lazy import LazyModule
+
+psutil = LazyModule("psutil")
+
+# the job the running task is part of, tasks it starts inherit it
+current_job: contextvars.ContextVar["Job"] = contextvars.ContextVar("current_job", default=None)
+
+
+class JobRejected(Exception):
+    pass
+
+
+class Job:
+    QUEUED = "queued"
+    RUNNING = "running"
+    CANCELLED = "cancelled"
+    DONE = "done"
+
+    def __init__(self, ctx: commands.Context, job_id: int, flow: int, cost: float, priority: int,
+                 start_tag: float, finish_tag: float):
+        self.id = job_id
+        self.ctx = ctx
+        self.author_id = ctx.author.id
+        self.guild_id = ctx.guild.id if ctx.guild else None
+        self.flow = flow
+        self.command = ctx.command.qualified_name if ctx.command else ""
+        self.cost = cost
+        self.priority = priority
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.state = Job.QUEUED
+        # every file a job makes lives in here so it can be found and deleted on cancel
+        self.workspace = os.path.join(ctx.bot.temp_root, f"{ctx.author.id}/{job_id}/")
+        self.created_at = time.monotonic()
+        self.started_at = None
+        self.task: asyncio.Task = None
+        # checked from executor threads, e.g. by the yt-dlp progress hooks
+        self.cancel_event = threading.Event()
+        self.started = asyncio.Event()
+        # executor work submitted for the job that hasn't finished, cancelling the task doesn't stop it
+        self._offloaded = set()
+        self._on_idle = None
+        self._lock = threading.Lock()
+
+    def __lt__(self, other):
+        return (self.priority, self.finish_tag, self.id) < (other.priority, other.finish_tag, other.id)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - (self.started_at or self.created_at)
+
+    def track(self, future: concurrent.futures.Future):
+        with self._lock:
+            self._offloaded.add(future)
+
+        future.add_done_callback(self._untrack)
+
+    def _untrack(self, future: concurrent.futures.Future):
+        # runs on whichever thread finished the future
+        with self._lock:
+            self._offloaded.discard(future)
+            callback = self._on_idle if not self._offloaded else None
+
+            if callback is not None:
+                self._on_idle = None
+
+        if callback is not None:
+            callback()
+
+    def when_idle(self, callback):
+        """
+        Calls callback once nothing offloaded for the job is still running, straight away if nothing is
+        """
+        with self._lock:
+            if self._offloaded:
+                self._on_idle = callback
+                return
+
+        callback()
+
+
+class TrackedExecutor:
+    """
+    Mixed into an executor so what's submitted from inside a job is tracked by it, run_in_executor submits
+    from the calling task so the job is known there
+    """
+    def submit(self, fn, /, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        job = current_job.get()
+
+        if job is not None:
+            job.track(future)
+
+        return future
+
+
+class TrackedThreadPoolExecutor(TrackedExecutor, concurrent.futures.ThreadPoolExecutor):
+    pass
+
+
+class TrackedProcessPoolExecutor(TrackedExecutor, concurrent.futures.ProcessPoolExecutor):
+    pass
+
+
+class JobScheduler:
+    # a job's cost is roughly how many MB it pushes through, a url is assumed to be an average song
+    URL_COST = 50
+    SECOND_COST = 0.2
+
+    def __init__(self, bot, workers: int = 2, max_job_cost: float = 500, max_flow_cost: float = 1000,
+                 weights: dict = None):
+        """
+        :param bot: The bot the jobs run for
+        :param workers: How many jobs can run at once
+        :param max_job_cost: Jobs estimated to cost more than this are rejected
+        :param max_flow_cost: How much cost one guild (or user in dms) can have queued and running at once
+        :param weights: guild/user id to weight, a flow with weight 2 gets twice the share of a flow with weight 1
+        """
+        self.bot = bot
+        self.workers = workers
+        self.max_job_cost = max_job_cost
+        self.max_flow_cost = max_flow_cost
+        self.weights = weights or {}
+        self.jobs: dict[int, Job] = {}
+        self._queue: list[Job] = []
+        self._running = 0
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._flow_cost = defaultdict(float)
+        self._ids = itertools.count(1)
+
+    @classmethod
+    def estimate_cost(cls, attachments=(), urls: int = 0, audio_seconds: float = 0.0) -> float:
+        cost = sum(attachment.size for attachment in attachments) / 1048576
+        cost += urls * cls.URL_COST
+        cost += audio_seconds * cls.SECOND_COST
+        return max(cost, 1.0)
+
+    @staticmethod
+    def flow_of(ctx: commands.Context) -> int:
+        return ctx.guild.id if ctx.guild else ctx.author.id
+
+    def queue_position(self, job: Job) -> int:
+        return sum(1 for other in self._queue if other.state == Job.QUEUED and other < job) + 1
+
+    def admit(self, ctx: commands.Context, cost: float, priority: int) -> Job:
+        flow = self.flow_of(ctx)
+
+        if cost > self.max_job_cost:
+            raise JobRejected(f"This job is too big to process (estimated cost `{cost:.0f}`, "
+                              f"limit `{self.max_job_cost}`).")
+
+        if self._flow_cost[flow] + cost > self.max_flow_cost:
+            raise JobRejected("Too many jobs are already queued here, wait for them to finish or cancel some "
+                              "with `es cancel`.")
+
+        weight = self.weights.get(flow, self.weights.get(ctx.author.id, 1))
+        # weighted fair queuing, each job is tagged with the virtual time it would finish at if its flow
+        # got its fair share, so a flow that queues a lot of work falls behind flows that queue a little
+        start_tag = max(self._virtual_time, self._last_finish.get(flow, 0.0))
+        finish_tag = start_tag + cost / weight
+        self._last_finish[flow] = finish_tag
+        self._flow_cost[flow] += cost
+
+        job = Job(ctx, next(self._ids), flow, cost, priority, start_tag, finish_tag)
+        self.jobs[job.id] = job
+        heapq.heappush(self._queue, job)
+        return job
+
+    def _dispatch(self):
+        while self._running < self.workers and self._queue:
+            job = heapq.heappop(self._queue)
+
+            # cancelled jobs are left in the heap and dropped here
+            if job.state != Job.QUEUED:
+                continue
+
+            self._virtual_time = max(self._virtual_time, job.start_tag)
+            self._running += 1
+            job.state = Job.RUNNING
+            job.started_at = time.monotonic()
+            job.started.set()
+
+    def _finish(self, job: Job):
+        if job.state == Job.RUNNING:
+            self._running -= 1
+
+        job.state = Job.CANCELLED if job.cancelled else Job.DONE
+        self.jobs.pop(job.id, None)
+
+        self._flow_cost[job.flow] -= job.cost
+        if not any(other.flow == job.flow for other in self.jobs.values()):
+            self._flow_cost.pop(job.flow, None)
+            self._last_finish.pop(job.flow, None)
+
+        # a thread or process still working for the job may be writing into the workspace, so it's only
+        # deleted once they've all finished
+        job.when_idle(functools.partial(self.bot.dead_files.put, job.workspace))
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def job(self, ctx: commands.Context, *, cost: float = 1.0, priority: int = 1) -> Job:
+        """
+        Waits for a free worker slot and runs the body of the with block as a job
+        :param ctx: The invoking context
+        :param cost: The job's estimated cost, see estimate_cost
+        :param priority: Lower priorities are always picked first, fairness applies within a priority
+        """
+        job = self.admit(ctx, cost, priority)
+        job.task = asyncio.current_task()
+        token = current_job.set(job)
+
+        try:
+            self._dispatch()
+
+            if not job.started.is_set():
+                await ctx.send(f"> Your job `#{job.id}` is queued at position {self.queue_position(job)}, "
+                               f"use `es jobs` to check on it or `es cancel {job.id}` to cancel it.")
+                await job.started.wait()
+
+            os.makedirs(job.workspace, exist_ok=True)
+            yield job
+
+        finally:
+            current_job.reset(token)
+            self._finish(job)
+
+    def cancel(self, job: Job):
+        job.cancel_event.set()
+
+        if job.task is not None:
+            job.task.cancel()
+
+        self.kill_processes(job.workspace)
+
+    @staticmethod
+    def is_within(path: str, directory: str) -> bool:
+        # comparing whole path components, temp/user/1 must not match temp/user/10
+        if not os.path.isabs(path):
+            return False
+
+        return os.path.commonpath([os.path.normpath(path), directory]) == directory
+
+    @staticmethod
+    def kill_tree(procs: typing.Iterable["psutil.Process"]):
+        # children first are collected up front so killing a parent can't orphan them out of reach
+        to_kill = set()
+
+        for proc in procs:
+            try:
+                to_kill.add(proc)
+                to_kill.update(proc.children(recursive=True))
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+
+        for proc in to_kill:
+            try:
+                proc.kill()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+
+    @classmethod
+    def kill_processes(cls, path: str):
+        # yt-dlp's ffmpeg, the adpcm encode and wine are all either started in or pointed at the job's directory
+        path = os.path.normpath(path)
+        matches = []
+
+        for proc in psutil.Process().children(recursive=True):
+            try:
+                if cls.is_within(proc.cwd(), path) or any(cls.is_within(arg, path) for arg in proc.cmdline()):
+                    matches.append(proc)
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+
+        cls.kill_tree(matches)
+
+    def jobs_for(self, ctx: commands.Context) -> list[Job]:
+        flow = self.flow_of(ctx)
+        return sorted((job for job in self.jobs.values() if job.flow == flow),
+                      key=lambda job: (job.state != Job.RUNNING, job))
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from discord.ext import commands
+
+from config.utils.pacfile import FileHeader
+from config.utils.paccompress import PacCompression
+
+
+class TemplateError(Exception):
+    pass
+
+
+class TemplateFile:
+    """
+    A registered .pac standing in for an uploaded one, has the parts of discord.Attachment the commands use
+    """
+
+    def __init__(self, name: str, path: str, filename: str, sha256: str, size: int, compressed: bool, index: dict,
+                 added: float = 0.0):
+        self.name = name
+        self.path = path
+        self.filename = filename
+        self.sha256 = sha256
+        self.size = size
+        self.compressed = compressed
+        self.index = index
+        self.added = added
+
+    @property
+    def id(self) -> str:
+        return self.sha256
+
+    async def save(self, fp):
+        # the pipeline only ever swaps new files in over the archive, so a link is never written through
+        try:
+            os.link(self.path, fp)
+        except OSError:
+            shutil.copyfile(self.path, fp)
+
+    def header(self, pac_path) -> FileHeader:
+        return FileHeader.from_index(pac_path, self.index)
+
+    def to_dict(self) -> dict:
+        return {"filename": self.filename, "sha256": self.sha256, "size": self.size, "compressed": self.compressed,
+                "index": self.index, "added": self.added}
+
+
+class TemplateRegistry:
+    def __init__(self, root: str):
+        """
+        Base .pac files kept on the server so commands can use them by name instead of an upload
+        :param root: The directory the archives and their index are kept in
+        """
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self.templates: dict[str, TemplateFile] = {}
+        # when the index was last read, the sharded launcher's other clusters can change it
+        self.loaded_mtime = None
+
+    def load(self):
+        os.makedirs(self.root, exist_ok=True)
+
+        if not os.path.exists(self.index_path):
+            return
+
+        self.loaded_mtime = os.stat(self.index_path).st_mtime_ns
+
+        with open(self.index_path) as f:
+            data = json.load(f)
+
+        self.templates = {}
+
+        for name, template in data.items():
+            path = os.path.join(self.root, template["sha256"] + ".pac")
+
+            # an archive deleted by hand is dropped rather than failing every job that uses it
+            if os.path.exists(path):
+                self.templates[name] = TemplateFile(name, path, **template)
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return
+
+        if mtime != self.loaded_mtime:
+            self.load()
+
+    def save(self):
+        temp_path = f"{self.index_path}.tmp"
+
+        with open(temp_path, "w") as f:
+            json.dump({name: template.to_dict() for name, template in self.templates.items()}, f)
+
+        os.replace(temp_path, self.index_path)
+        self.loaded_mtime = os.stat(self.index_path).st_mtime_ns
+
+    @staticmethod
+    def file_hash(path) -> str:
+        sha = hashlib.sha256()
+
+        with open(path, "rb") as f:
+            for data in iter(lambda: f.read(1048576), b""):
+                sha.update(data)
+
+        return sha.hexdigest()
+
+    def add(self, name: str, source_path: str, filename: str, max_size: int = None) -> TemplateFile:
+        """
+        Registers the .pac at source_path under name, the file is moved into the registry
+        compressed archives are kept decompressed so jobs don't have to decompress them every time
+        :param max_size: The most bytes a compressed archive may decompress to
+        """
+        name = name.lower()
+        self.refresh()
+
+        if name in self.templates:
+            raise TemplateError(f"There's already a template called `{name}`.")
+
+        compressed = PacCompression.decompress_in_place(source_path, max_size)
+        header = FileHeader(source_path)
+        sha256 = self.file_hash(source_path)
+        path = os.path.join(self.root, sha256 + ".pac")
+
+        # the same archive under a second name shares the file
+        if not os.path.exists(path):
+            shutil.move(source_path, path)
+
+        template = TemplateFile(name, path, filename, sha256, os.path.getsize(path), compressed, header.to_index(),
+                                time.time())
+        self.templates[name] = template
+        self.save()
+        return template
+
+    def remove(self, name: str) -> TemplateFile:
+        self.refresh()
+        template = self.templates.pop(name.lower(), None)
+
+        if template is None:
+            raise TemplateError(f"There's no template called `{name}`.")
+
+        self.save()
+
+        if not any(other.sha256 == template.sha256 for other in self.templates.values()):
+            os.remove(template.path)
+
+        return template
+
+    def get(self, name: str) -> TemplateFile:
+        self.refresh()
+        template = self.templates.get(name.lower())
+
+        if template is None:
+            raise commands.BadArgument(f"There's no template called `{name}`, see `es template list`.")
+
+        return template
+
+    def __contains__(self, name: str) -> bool:
+        self.refresh()
+        return name.lower() in self.templates
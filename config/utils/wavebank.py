@@ -0,0 +1,264 @@
+import struct
+
+from config.utils.lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+class WaveBankError(Exception):
+    pass
+
+
+class WaveBankEntry:
+    PCM = 0
+    XMA = 1
+    ADPCM = 2
+    WMA = 3
+    # MINIWAVEFORMAT keeps adpcm block aligns minus this per channel
+    ADPCM_BLOCK_ALIGN_OFFSET = 22
+
+    def __init__(self, index: int, flags_and_duration: int, mini_format: int, offset: int, length: int,
+                 loop_start: int = 0, loop_length: int = 0):
+        self.index = index
+        self.flags = flags_and_duration & 0xF
+        self.duration = flags_and_duration >> 4
+        # MINIWAVEFORMAT, tag:2 channels:3 rate:18 block align:8 bits:1
+        self.format_tag = mini_format & 0x3
+        self.channels = (mini_format >> 2) & 0x7
+        self.sample_rate = (mini_format >> 5) & 0x3FFFF
+        self.block_align = (mini_format >> 23) & 0xFF
+        self.bits_per_sample = 16 if mini_format >> 31 else 8
+        self.offset = offset
+        self.length = length
+        self.loop_start = loop_start
+        self.loop_length = loop_length
+
+        if self.format_tag == self.ADPCM:
+            self.block_align = (self.block_align + self.ADPCM_BLOCK_ALIGN_OFFSET) * self.channels
+
+    @property
+    def samples_per_block(self) -> int:
+        if self.format_tag != self.ADPCM:
+            return 1
+
+        return (self.block_align - 7 * self.channels) * 8 // (4 * self.channels) + 2
+
+    @property
+    def seconds(self) -> float:
+        return self.duration / self.sample_rate if self.sample_rate else 0.0
+
+
+class WaveBank:
+    """
+    Reads XACT3 wave banks (.xwb) like the ones XWBTool writes, without needing wine or XACT
+    """
+    SIGNATURE = b"WBND"
+    # the first version with the layout read here
+    MIN_VERSION = 42
+    FLAGS_COMPACT = 0x00020000
+    BANK_DATA, ENTRY_METADATA, SEEK_TABLES, ENTRY_NAMES, ENTRY_WAVE_DATA = range(5)
+
+    def __init__(self, data: bytes):
+        """
+        :param data: The whole .xwb
+        """
+        self.data = memoryview(data)
+
+        if len(data) < 52:
+            raise WaveBankError("The wave bank is truncated.")
+
+        if bytes(data[:4]) == self.SIGNATURE:
+            self.endian = "<"
+        elif bytes(data[:4]) == self.SIGNATURE[::-1]:
+            # xbox 360 banks
+            self.endian = ">"
+        else:
+            raise WaveBankError("The wave bank has an incorrect structure.")
+
+        self.version, self.header_version = self.unpack("II", 4)
+
+        if self.version < self.MIN_VERSION:
+            raise WaveBankError(f"Wave banks made with XACT version {self.version} aren't supported.")
+
+        self.segments = [self.unpack("II", 12 + i * 8) for i in range(5)]
+
+        for offset, length in self.segments:
+            if offset + length > len(data):
+                raise WaveBankError("The wave bank is truncated.")
+
+        bank_offset = self.segments[self.BANK_DATA][0]
+        self.flags, self.entry_count = self.unpack("II", bank_offset)
+        self.name = bytes(self.data[bank_offset + 8:bank_offset + 72]).split(b"\0")[0].decode("ASCII", "replace")
+        self.entry_size, self.name_size, self.alignment, self.compact_format = self.unpack("IIII", bank_offset + 72)
+        self.entries = [self.read_entry(i) for i in range(self.entry_count)]
+
+    @classmethod
+    def entry_count_of(cls, head: bytes) -> int:
+        """
+        How many entries a bank has from just its start, the header and bank data segment come first
+        """
+        if bytes(head[:4]) not in (cls.SIGNATURE, cls.SIGNATURE[::-1]):
+            raise WaveBankError("The wave bank has an incorrect structure.")
+
+        endian = "<" if bytes(head[:4]) == cls.SIGNATURE else ">"
+
+        try:
+            bank_offset = struct.unpack_from(endian + "I", head, 12)[0]
+            return struct.unpack_from(endian + "I", head, bank_offset + 4)[0]
+        except struct.error:
+            raise WaveBankError("The wave bank is truncated.")
+
+    @classmethod
+    def from_path(cls, path) -> "WaveBank":
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+    def unpack(self, fmt: str, offset: int) -> tuple:
+        try:
+            return struct.unpack_from(self.endian + fmt, self.data, offset)
+        except struct.error:
+            raise WaveBankError("The wave bank is truncated.")
+
+    @staticmethod
+    def check_format(entry: WaveBankEntry):
+        # everything the durations and decoding divide by or reshape with comes from here
+        if not entry.channels:
+            raise WaveBankError(f"Entry {entry.index} of the wave bank has no channels.")
+
+        if not entry.sample_rate:
+            raise WaveBankError(f"Entry {entry.index} of the wave bank has no sample rate.")
+
+        if entry.format_tag == WaveBankEntry.ADPCM and entry.block_align <= 7 * entry.channels:
+            raise WaveBankError(f"Entry {entry.index} of the wave bank has ADPCM blocks too small to hold "
+                                f"their headers.")
+
+        if entry.format_tag == WaveBankEntry.PCM and \
+                entry.block_align != entry.channels * entry.bits_per_sample // 8:
+            raise WaveBankError(f"Entry {entry.index} of the wave bank has a block align that doesn't match "
+                                f"its channels.")
+
+    def read_entry(self, index: int) -> WaveBankEntry:
+        metadata_offset, metadata_length = self.segments[self.ENTRY_METADATA]
+        wave_offset, wave_length = self.segments[self.ENTRY_WAVE_DATA]
+        offset = metadata_offset + index * self.entry_size
+
+        if (index + 1) * self.entry_size > metadata_length:
+            raise WaveBankError("The wave bank's entry table is truncated.")
+
+        if self.flags & self.FLAGS_COMPACT:
+            # offset in alignment units, the length is only known from the next entry
+            value = self.unpack("I", offset)[0]
+            start = (value & 0x1FFFFF) * self.alignment
+
+            if index + 1 < self.entry_count:
+                end = (self.unpack("I", offset + self.entry_size)[0] & 0x1FFFFF) * self.alignment
+            else:
+                end = wave_length
+
+            entry = WaveBankEntry(index, 0, self.compact_format, start, end - start - (value >> 21))
+            self.check_format(entry)
+            entry.duration = entry.length // entry.block_align * entry.samples_per_block if entry.block_align else 0
+        else:
+            fields = self.unpack("IIIIII", offset)
+            entry = WaveBankEntry(index, *fields)
+            self.check_format(entry)
+
+        if entry.offset + entry.length > wave_length:
+            raise WaveBankError(f"Entry {index} of the wave bank points past its data.")
+
+        entry.offset += wave_offset
+        return entry
+
+    def wave_data(self, entry: WaveBankEntry) -> memoryview:
+        return self.data[entry.offset:entry.offset + entry.length]
+
+    def decode(self, entry: WaveBankEntry, start: float = 0.0, seconds: float = None) -> "np.ndarray":
+        """
+        Decodes a window of an entry to int16 samples shaped (frames, channels)
+        :param start: Seconds into the entry the window starts at
+        :param seconds: How long the window is, the rest of the entry by default
+        """
+        first = int(start * entry.sample_rate)
+        count = entry.duration - first if seconds is None else int(seconds * entry.sample_rate)
+        count = max(0, min(count, entry.duration - first))
+        data = self.wave_data(entry)
+
+        if entry.format_tag == WaveBankEntry.PCM:
+            width = entry.bits_per_sample // 8
+            frame = width * entry.channels
+            window = np.frombuffer(data[first * frame:(first + count) * frame], dtype=f"{self.endian}i{width}")
+
+            if width == 1:
+                window = (window.astype(np.int16) - 128) << 8
+
+            return window.astype(np.int16).reshape(-1, entry.channels)
+
+        if entry.format_tag != WaveBankEntry.ADPCM:
+            raise WaveBankError("Only PCM and ADPCM wave banks can be decoded.")
+
+        # only the blocks covering the window are decoded
+        per_block = entry.samples_per_block
+        first_block = first // per_block
+        last_block = -(-(first + count) // per_block)
+        blocks = data[first_block * entry.block_align:last_block * entry.block_align]
+        samples = MSADPCM.decode(blocks, entry.channels, entry.block_align)
+        skip = first - first_block * per_block
+        return samples[skip:skip + count]
+
+
+class MSADPCM:
+    COEFFICIENTS = ((256, 0), (512, -256), (0, 0), (192, 64), (240, 0), (460, -208), (392, -232))
+    ADAPTATION = (230, 230, 230, 230, 307, 409, 512, 614, 768, 614, 512, 409, 307, 230, 230, 230)
+    MAX_DELTA = 2147483647 // 768
+
+    @classmethod
+    def decode(cls, data: bytes, channels: int, block_align: int) -> "np.ndarray":
+        """
+        Decodes MS-ADPCM to int16 samples shaped (frames, channels)
+        each block restarts the predictor, so every block is decoded at once and only the samples within a block
+        are stepped through one by one
+        """
+        coefficients = np.array(cls.COEFFICIENTS, dtype=np.int32)
+        adaptation = np.array(cls.ADAPTATION, dtype=np.int32)
+        raw = np.frombuffer(data, dtype=np.uint8)
+        count = len(raw) // block_align
+
+        if not count:
+            return np.zeros((0, channels), dtype=np.int16)
+
+        blocks = raw[:count * block_align].reshape(count, block_align)
+
+        # the block header, predictor per channel then delta, sample 1 and sample 2 as int16 per channel
+        predictors = blocks[:, :channels].astype(np.intp)
+        header = blocks[:, channels:7 * channels].copy().view("<i2").reshape(count, 3, channels).astype(np.int32)
+        delta, sample1, sample2 = header[:, 0], header[:, 1], header[:, 2]
+
+        if (predictors >= len(cls.COEFFICIENTS)).any():
+            raise WaveBankError("The ADPCM data is corrupted.")
+
+        coefficient1 = coefficients[predictors, 0]
+        coefficient2 = coefficients[predictors, 1]
+
+        # high nibble first, channels interleaved
+        body = blocks[:, 7 * channels:]
+        nibbles = np.empty((count, body.shape[1] * 2), dtype=np.int32)
+        nibbles[:, 0::2] = body >> 4
+        nibbles[:, 1::2] = body & 0xF
+        nibbles = nibbles.reshape(count, -1, channels)
+        signed = np.where(nibbles >= 8, nibbles - 16, nibbles)
+
+        steps = nibbles.shape[1]
+        output = np.empty((count, steps + 2, channels), dtype=np.int16)
+        output[:, 0] = sample2
+        output[:, 1] = sample1
+
+        for i in range(steps):
+            predicted = (sample1 * coefficient1 + sample2 * coefficient2) >> 8
+            sample = np.clip(predicted + signed[:, i] * delta, -32768, 32767)
+            output[:, i + 2] = sample
+            sample2 = sample1
+            sample1 = sample
+            # bounded like ffmpeg does so corrupt data can't overflow it
+            delta = np.clip((adaptation[nibbles[:, i]] * delta) >> 8, 16, cls.MAX_DELTA)
+
+        return output.reshape(-1, channels)
@@ -6,9 +6,21 @@ import subprocess
 import platform
 import typing
 
-from pydub import AudioSegment
 
+try:
+    import audioop
+except ImportError:
+    # removed in python 3.13, pydub can't convert without it
+    audioop = None
+
+from config.utils.lazy import LazyModule
+from config.utils.diskio import disk_io
 from config.utils.pacfile import FileHeader
+from config.utils.pcm import PCMConverter
+from config.utils.wavebank import WaveBank, WaveBankEntry, WaveBankError
+
+# pydub is only imported once a track is actually converted
+AudioSegment = LazyModule("pydub", "AudioSegment")
 
 
 class XWBCreatorError(Exception):
@@ -82,17 +94,45 @@ class XSBEditor:
     def write_track(self, new_byte: int):
         self.__write_byte_at_offset(new_byte, 0xDB)
 
+    def write_volume(self, new_byte: int):
+        # the sound and track volume then the checksum over both, in one go
+        self.write_sound(new_byte)
+        self.write_track(new_byte)
+        self.calculate_checksum()
+
+    async def calculate_checksum_async(self):
+        await disk_io.run(self.path, self.calculate_checksum)
+
+    async def write_volume_async(self, new_byte: int):
+        await disk_io.run(self.path, self.write_volume, new_byte)
+
 
 class XWBCreator:
     FILE_FORMATS = ["mp3", "mp4", "ogg", "wav", "flac", "acc", "aiff", "amr", "mid"]
     # HZ
     OUTPUT_RATE = 48000
+    # adpcm block bytes per channel, XACT can't describe much bigger blocks, and the samples each one holds
+    BLOCK_SIZE = 256
+    SAMPLES_PER_BLOCK = 500
+    # the .xwb's own headers and the alignment of its wave data
+    BANK_OVERHEAD = 4096
+    # what --fit steps down through, best first
+    FIT_FORMATS = [(48000, 2), (44100, 2), (32000, 2), (48000, 1), (32000, 1), (24000, 1), (22050, 1)]
+    # milliseconds faded out at the end of a song that had to be cut to fit
+    FIT_FADE = 3000
 
     def __init__(self, xwb_name: str,
                  pac_name: str,
                  audio_file="*",
                  audio_file_format="",
-                 directory=os.getcwd() + "/"):
+                 directory=os.getcwd() + "/",
+                 resampler="pydub",
+                 wav_name="temp.wav",
+                 start: float = None,
+                 duration: float = None,
+                 loop: float = None,
+                 budget: int = None,
+                 loudness: float = None):
         """
         :param xwb_name: The xwb filename to be replaced
         :param pac_name: The pac filename
@@ -100,12 +140,29 @@ class XWBCreator:
         if no filename is inserted will look for audio files in the parent then subdirectories
         :param audio_file_format: The file format of this audio file
         :param directory: The directory file creation operations will take place in.
+        :param resampler: "pydub" or "numpy", numpy is always used when audioop isn't available
+        :param wav_name: The adpcm wav's filename, several creators can share a directory with different ones
+        :param start: Only decode from this many seconds in, ffmpeg seeks there instead of decoding up to it
+        :param duration: Only decode this many seconds
+        :param loop: Seconds into the (trimmed) audio the song loops back to once it ends
+        :param budget: The most bytes the encoded song may take, the rate and channels are lowered and then the
+        song is cut to fit, what was changed ends up in changes
+        :param loudness: Normalizes the song to this many LUFS, limiting the peaks the gain would push over
         """
         self.xwb_name = xwb_name
         self.pac_name = pac_name
         self.directory = directory
+        self.resampler = resampler if audioop is not None else "numpy"
+        self.loop = loop
+        self.loudness = loudness
+        self.wav_name = wav_name
+        # only passed on when set, pydub puts them straight into ffmpeg's arguments
+        trim = {key: value for key, value in (("start_second", start), ("duration", duration)) if value is not None}
         self.output: AudioSegment = None
         self.input: AudioSegment = None
+        self.rate = self.OUTPUT_RATE
+        self.channels = 2
+        self.changes = []
 
         if not audio_file_format or audio_file == "*":
 
@@ -115,11 +172,55 @@ class XWBCreator:
                 audio_files.extend(list(self.get_files(f"{audio_file}.{file_type}", directory)))
 
             file = audio_files[0][1]
-            self.input = AudioSegment.from_file(self.directory + file, format=file.split(".")[1])
+            self.input = AudioSegment.from_file(self.directory + file, format=file.split(".")[1], **trim)
 
         else:
 
-            self.input = AudioSegment.from_file(audio_file, format=audio_file_format)
+            self.input = AudioSegment.from_file(audio_file, format=audio_file_format, **trim)
+
+        if not len(self.input):
+            raise XWBCreatorError("There's no audio in the requested section.")
+
+        if budget is not None:
+            self.fit_to(budget)
+
+    @classmethod
+    def encoded_size(cls, seconds: float, rate: int, channels: int) -> int:
+        blocks = -(-int(seconds * rate) // cls.SAMPLES_PER_BLOCK)
+        return blocks * cls.BLOCK_SIZE * channels + cls.BANK_OVERHEAD
+
+    @classmethod
+    def fit(cls, seconds: float, budget: int) -> tuple[int, int, typing.Optional[float]]:
+        """
+        The best rate and channels an encode of seconds fits into budget bytes with
+        :return: rate, channels and how many seconds fit if even the smallest format is too big, otherwise None
+        """
+        for rate, channels in cls.FIT_FORMATS:
+            if cls.encoded_size(seconds, rate, channels) <= budget:
+                return rate, channels, None
+
+        rate, channels = cls.FIT_FORMATS[-1]
+        blocks = (budget - cls.BANK_OVERHEAD) // (cls.BLOCK_SIZE * channels)
+        return rate, channels, max(0, blocks * cls.SAMPLES_PER_BLOCK) / rate
+
+    def fit_to(self, budget: int):
+        seconds = len(self.input) / 1000
+        self.rate, self.channels, fitted_seconds = self.fit(seconds, budget)
+
+        if fitted_seconds is not None:
+            if fitted_seconds < self.FIT_FADE / 1000:
+                raise XWBCreatorError("The .pac is too close to the upload limit to fit any music.")
+
+            fade = min(self.FIT_FADE, int(fitted_seconds * 1000) // 4)
+            self.input = self.input[:int(fitted_seconds * 1000)].fade_out(fade)
+            self.changes.append(f"cut to {int(fitted_seconds) // 60}:{int(fitted_seconds) % 60:02} "
+                                f"with a fade out")
+
+        if self.rate != self.OUTPUT_RATE:
+            self.changes.append(f"{self.rate} Hz instead of {self.OUTPUT_RATE} Hz")
+
+        if self.channels != 2:
+            self.changes.append("mono")
 
     @staticmethod
     def walk_path(path) -> [typing.List[tuple[str, str, str]]]:
@@ -142,9 +243,36 @@ class XWBCreator:
                     yield os.path.join(dirpath, f), f
 
     def export_input(self):
-        audio_data = self.input.set_frame_rate(self.OUTPUT_RATE).set_sample_width(2).set_channels(2)
+        if self.resampler == "numpy":
+            self.output = PCMConverter.convert(self.input, self.rate, self.channels, self.loudness)
+            return
+
+        audio_data = self.input.set_frame_rate(self.rate).set_sample_width(2).set_channels(self.channels)
+
+        if self.loudness is not None:
+            audio_data = PCMConverter.normalize(audio_data, self.loudness)
+
         self.output = audio_data
 
+    @staticmethod
+    def write_loop(wav_path: str, loop_start: int, loop_end: int):
+        """
+        Appends a smpl chunk looping loop_start to loop_end (in samples, inclusive), XWBTool keeps it as the
+        entry's loop region
+        """
+        smpl = struct.pack("<9I", 0, 0, 0, 60, 0, 0, 0, 1, 0)
+        smpl += struct.pack("<6I", 0, 0, loop_start, loop_end, 0, 0)
+
+        with open(wav_path, "rb+") as f:
+            if f.read(4) != b"RIFF":
+                raise XWBCreatorError("The encoded wav has an incorrect structure.")
+
+            f.seek(0, os.SEEK_END)
+            f.write(b"smpl" + struct.pack("<I", len(smpl)) + smpl)
+            riff_size = f.tell() - 8
+            f.seek(4)
+            f.write(struct.pack("<I", riff_size))
+
     def create_xwb_file(self, wav_file_path):
         # to be done later
         pass
@@ -152,12 +280,67 @@ class XWBCreator:
     def adpcm_compress(self):
         self.export_input()
 
-        self.output.export(self.directory + "temp.wav", format="wav", codec="adpcm_ms", parameters=
-        ["-block_size", "512",
-         "-ar", "48000",
-         "-ac", "2",
-        "-strict", "experimental",
-        ])
+        # pydub writes plain wav itself, ffmpeg is then run inside the directory rather than on pydub's temp files
+        # so a cancelled job can find and stop it
+        self.output.export(self.directory + "input_" + self.wav_name, format="wav")
+
+        subprocess.run([AudioSegment.converter, "-y", "-i", "input_" + self.wav_name,
+                        "-acodec", "adpcm_ms",
+                        "-block_size", str(self.BLOCK_SIZE * self.channels),
+                        "-ar", str(self.rate),
+                        "-ac", str(self.channels),
+                        "-strict", "experimental",
+                        self.wav_name], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       cwd=self.directory)
+
+        if self.loop is not None:
+            frames = int(self.output.frame_count())
+            loop_start = int(self.loop * self.output.frame_rate)
+
+            if loop_start >= frames:
+                raise XWBCreatorError("The loop point is past the end of the song.")
+
+            self.write_loop(self.directory + self.wav_name, loop_start, frames - 1)
+
+    @property
+    def track(self) -> tuple[int, int, int]:
+        """
+        The frames, rate and channels of the encoded audio, what validate_bank checks an entry against
+        """
+        return int(self.output.frame_count()), self.output.frame_rate, self.output.channels
+
+    def validate_xwb(self, xwb_path: str):
+        self.validate_bank(xwb_path, [self.track])
+
+    @staticmethod
+    def validate_bank(xwb_path: str, tracks: list[tuple[int, int, int]]):
+        """
+        Checks the .xwb XWBTool made actually holds the encoded tracks in order, only the first and last blocks of
+        each entry are decoded
+        """
+        name = os.path.basename(xwb_path)
+
+        try:
+            bank = WaveBank.from_path(xwb_path)
+
+            if len(bank.entries) != len(tracks):
+                raise XWBCreatorError(f"The created xwb {name} has {len(bank.entries)} songs "
+                                      f"instead of {len(tracks)}.")
+
+            for entry, (frames, rate, channels) in zip(bank.entries, tracks):
+                if entry.format_tag != WaveBankEntry.ADPCM or entry.sample_rate != rate or entry.channels != channels:
+                    raise XWBCreatorError(f"The created xwb {name} has the wrong format.")
+
+                # the encoder pads the last block out
+                if abs(entry.duration - frames) > entry.samples_per_block:
+                    raise XWBCreatorError(f"The created xwb {name} is missing audio.")
+
+                block = entry.samples_per_block / entry.sample_rate
+                bank.decode(entry, 0, block)
+                bank.decode(entry, max(0.0, entry.seconds - block))
+
+        except WaveBankError as e:
+            raise XWBCreatorError(f"The created xwb {name} is corrupted: {e}")
 
     def create_xwb(self):
         self.adpcm_compress()
@@ -172,34 +355,89 @@ class XWBCreator:
         if platform.system() == "Windows":
             subprocess.run([xwb_tools_path, "-o",
                             self.xwb_name + ".xwb",
-                            "temp.wav", "-f", "-nc"], check=True, stdout=subprocess.DEVNULL, cwd=self.directory)
+                            self.wav_name, "-f", "-nc"], check=True, stdout=subprocess.DEVNULL, cwd=self.directory)
         else:
             # use wine if it's linux
             subprocess.run(["wine", xwb_tools_path, "-o",
                             self.xwb_name + ".xwb",
-                            "temp.wav", "-f", "-nc"], check=True, stdout=subprocess.DEVNULL, cwd=self.directory,
+                            self.wav_name, "-f", "-nc"], check=True, stdout=subprocess.DEVNULL, cwd=self.directory,
                            env={"DISPLAY": ":1", **os.environ})
 
-    def replace_xwb(self, new_xwb_path=""):
+    def replace_xwb(self, new_xwb_path="", pac_name="", xwb_name=""):
+        """
+        :param new_xwb_path: The path of the .xwb to insert, defaults to the one made by create_xwb
+        :param pac_name: The pac filename to edit, defaults to this creator's pac
+        :param xwb_name: The xwb filename to be replaced, defaults to this creator's xwb
+        this lets one created .xwb be inserted into several .pac files
+        """
 
-        xwb_name = self.xwb_name + ".xwb"
-        pac_name = self.pac_name + ".pac"
+        xwb_name = (xwb_name or self.xwb_name) + ".xwb"
+        pac_name = (pac_name or self.pac_name) + ".pac"
 
         if new_xwb_path == "":
-            new_xwb_path = self.directory + xwb_name
+            new_xwb_path = self.directory + self.xwb_name + ".xwb"
 
         header = FileHeader(self.directory + pac_name)
+        header.replace(self.find_in_pac(header, xwb_name), new_xwb_path)
+
+    @staticmethod
+    def find_in_pac(header: FileHeader, file_name: str):
+        """
+        Finds the .xwb or .xsb file_name replaces inside a .pac, vs themes only match on part of the name
+        """
+        extension = os.path.splitext(file_name)[1].lower()
         to_replace = None
 
         for file in header.files:
 
-            if file.file_name.lower() == xwb_name.lower():
+            if file.file_name.lower() == file_name.lower():
                 to_replace = file
             # for vs themes
-            elif file.file_name.lower() in xwb_name.lower() and ".xsb" not in file.file_name.lower():
+            elif file.file_name.lower() in file_name.lower() and file.file_name.lower().endswith(extension):
                 to_replace = file
 
         if to_replace is None:
-            raise XWBCreatorError(f"Replacing the xwb ran into error the File {xwb_name} was not found in the .pac.")
-
-        header.replace(to_replace, new_xwb_path)
+            raise XWBCreatorError(f"Replacing the {extension[1:]} ran into error the File {file_name} was not found "
+                                  f"in the .pac.")
+
+        return to_replace
+
+
+def encode_track(directory: str, audio_file: str, audio_file_format: str, wav_name: str,
+                 **options) -> tuple[tuple[int, int, int], list[str]]:
+    """
+    Encodes one audio file into an adpcm wav inside directory, made to run in a worker process so several tracks
+    are encoded at once, returns XWBCreator.track and what was changed to fit the budget
+    :param options: resampler, start, duration, loop, budget and loudness, see XWBCreator
+    """
+    creator = XWBCreator("", "", audio_file=audio_file, audio_file_format=audio_file_format, directory=directory,
+                         wav_name=wav_name, **options)
+    creator.adpcm_compress()
+    return creator.track, creator.changes
+
+
+def pack_music(pac_path: str, xwb_path: str, xwb_name: str, volume: typing.Optional[int] = None,
+               index: dict = None) -> dict:
+    """
+    Swaps the .xwb at xwb_path into the .pac, and sets the matching .xsb's volume in the same rewrite
+    :param index: The .pac's already parsed header, see FileHeader.to_index
+    :return: The rewritten .pac's header as an index
+    """
+    header = FileHeader.from_index(pac_path, index) if index else FileHeader(pac_path)
+    replacements = [(XWBCreator.find_in_pac(header, xwb_name + ".xwb"), xwb_path)]
+
+    if volume is not None:
+        xsb_file = XWBCreator.find_in_pac(header, xwb_name + ".xsb")
+        xsb_path = os.path.splitext(pac_path)[0] + ".xsb"
+
+        with open(xsb_path, "wb") as f:
+            f.write(header.read(xsb_file))
+
+        editor = XSBEditor(xsb_path)
+        editor.write_sound(volume)
+        editor.write_track(volume)
+        editor.calculate_checksum()
+        replacements.append((xsb_file, xsb_path))
+
+    header.replace_many(replacements)
+    return header.to_index()
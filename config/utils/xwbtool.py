@@ -0,0 +1,268 @@
+import os
+import sys
+import time
+import typing
+import asyncio
+import platform
+import statistics
+
+from collections import deque
+
+from config.utils.xwb import XWBCreatorError
+from config.utils.scheduler import JobScheduler, psutil
+
+
+class Conversion:
+    def __init__(self, directory: str, xwb_name: str, wav_names: list[str]):
+        self.directory = directory
+        self.xwb_name = xwb_name
+        # one entry in the bank per wav, in order
+        self.wav_names = wav_names
+        self.future = asyncio.get_running_loop().create_future()
+
+    @property
+    def output_path(self) -> str:
+        return os.path.join(self.directory, self.xwb_name)
+
+    @property
+    def finished(self) -> bool:
+        return os.path.exists(self.output_path) and os.path.getsize(self.output_path) > 0
+
+    async def run(self, args: list[str], env: dict, timeout: float) -> str:
+        """
+        Runs the tool for this conversion and returns "done", "failed", "timeout" or "cancelled"
+        """
+        # run inside the job's directory so the scheduler can find it on cancel, and as an argv list
+        # so nothing in the filenames is ever interpreted by a shell
+        proc = await asyncio.create_subprocess_exec(*args, "-o", self.xwb_name, *self.wav_names, "-f", "-nc",
+                                                    cwd=self.directory, env=env,
+                                                    stdout=asyncio.subprocess.DEVNULL,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+        waiter = asyncio.ensure_future(proc.wait())
+        timed_out = False
+
+        try:
+            await asyncio.wait([waiter, self.future], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            timed_out = not waiter.done() and not self.future.done()
+        finally:
+            if not waiter.done():
+                # wine can start more processes for one call, so the whole tree goes
+                try:
+                    JobScheduler.kill_tree([psutil.Process(proc.pid)])
+                except psutil.NoSuchProcess:
+                    pass
+                await waiter
+
+        if self.future.done():
+            return "cancelled"
+
+        # a call that wrote its bank just as the timeout hit still counts
+        if self.finished and (proc.returncode == 0 or timed_out):
+            return "done"
+
+        return "timeout" if timed_out else "failed"
+
+
+class WineWorker:
+    def __init__(self, pool, index: int):
+        self.pool = pool
+        self.index = index
+        self.prefix = os.path.join(pool.prefix_root, f"worker{index}")
+        self.env = {**os.environ, "DISPLAY": ":1", "WINEPREFIX": self.prefix, "WINEDEBUG": "-all"}
+        self.failures = 0
+        self.server: asyncio.subprocess.Process = None
+        self.task: asyncio.Task = None
+
+    async def run_command(self, *args, timeout: float):
+        proc = await asyncio.create_subprocess_exec(*args, env=self.env,
+                                                    stdout=asyncio.subprocess.DEVNULL,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            raise
+
+        return proc.returncode
+
+    async def start(self):
+        os.makedirs(self.prefix, exist_ok=True)
+        # a persistent wineserver keeps the prefix loaded between invocations
+        self.server = await asyncio.create_subprocess_exec("wineserver", "-p", env=self.env)
+
+        start = time.perf_counter()
+        await self.run_command("wine", "cmd", "/c", "exit", timeout=self.pool.timeout * 4)
+        self.pool.record(time.perf_counter() - start, cold=True)
+
+        self.failures = 0
+
+    async def stop(self):
+        try:
+            await self.run_command("wineserver", "-k", timeout=self.pool.timeout)
+        except (asyncio.TimeoutError, OSError):
+            pass
+
+        if self.server is not None and self.server.returncode is None:
+            self.server.kill()
+            await self.server.wait()
+
+    async def recycle(self):
+        self.pool.recycles += 1
+        await self.stop()
+        await self.start()
+
+    async def convert_one(self, conversion: Conversion, batch_size: int) -> bool:
+        start = time.perf_counter()
+        result = await conversion.run(["wine", self.pool.tool_path], self.env, self.pool.timeout)
+
+        if result == "cancelled":
+            return True
+
+        self.pool.record(time.perf_counter() - start, cold=False, batch_size=batch_size)
+
+        if result == "done":
+            conversion.future.set_result(conversion.output_path)
+        elif result == "timeout":
+            conversion.future.set_exception(XWBCreatorError(f"Creating the xwb {conversion.xwb_name} timed out."))
+        else:
+            conversion.future.set_exception(
+                XWBCreatorError(f"Creating the xwb {conversion.xwb_name} ran into an error."))
+
+        return result == "done"
+
+    async def convert(self, batch: list[Conversion]):
+        # the whole batch runs at once against the same warm wineserver, each call with its own timeout
+        results = await asyncio.gather(*[self.convert_one(conversion, len(batch)) for conversion in batch])
+        self.failures = 0 if all(results) else self.failures + 1
+
+    def abandon(self, error: Exception):
+        # wine isn't usable, anything left queued falls back to running the tool once per conversion
+        print(f"XWBTool worker {self.index} could not be started: {error}", file=sys.stderr)
+        self.pool.pool.remove(self)
+
+        if not self.pool.pool:
+            while not self.pool.queue.empty():
+                asyncio.create_task(self.pool.resolve_once(self.pool.queue.get_nowait()))
+
+    async def run(self):
+        try:
+            await self.start()
+        except (OSError, asyncio.TimeoutError) as e:
+            return self.abandon(e)
+
+        while True:
+            batch = [await self.pool.queue.get()]
+
+            while len(batch) < self.pool.batch_size and not self.pool.queue.empty():
+                batch.append(self.pool.queue.get_nowait())
+
+            batch = [conversion for conversion in batch if not conversion.future.done()]
+
+            if batch:
+                await self.convert(batch)
+
+            if self.failures >= self.pool.max_failures:
+                try:
+                    await self.recycle()
+                except (OSError, asyncio.TimeoutError) as e:
+                    return self.abandon(e)
+
+
+class XWBToolPool:
+    def __init__(self, workers: int = 2, batch_size: int = 4, timeout: float = 60, max_failures: int = 3,
+                 prefix_root: str = os.path.join(os.getcwd(), "wine")):
+        """
+        :param workers: How many warm wine prefixes to keep, 0 runs a fresh wine for every conversion
+        :param batch_size: The most conversions a worker runs at once
+        :param timeout: How long one conversion may take before it's killed
+        :param max_failures: How many failed batches in a row before a worker's wineserver is restarted
+        :param prefix_root: Where the wine prefixes are kept
+        """
+        self.workers = workers if platform.system() != "Windows" else 0
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.prefix_root = prefix_root
+        self.tool_path = os.path.join(os.getcwd(), "tools/XWBTool.exe")
+        self.queue: asyncio.Queue = None
+        self.pool: list[WineWorker] = []
+        self.recycles = 0
+        # (seconds, batch size) of each conversion
+        self.cold_latency = deque(maxlen=100)
+        self.warm_latency = deque(maxlen=100)
+
+    def record(self, latency: float, cold: bool, batch_size: int = 1):
+        (self.cold_latency if cold else self.warm_latency).append((latency, batch_size))
+
+    def stats(self) -> dict:
+        def summary(latencies):
+            if not latencies:
+                return {"count": 0, "mean": 0.0, "p95": 0.0, "batch": 0.0}
+
+            ordered = sorted(latency for latency, _ in latencies)
+            return {"count": len(ordered),
+                    "mean": statistics.fmean(ordered),
+                    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "batch": statistics.fmean(batch_size for _, batch_size in latencies)}
+
+        return {"cold": summary(self.cold_latency), "warm": summary(self.warm_latency), "recycles": self.recycles}
+
+    def start(self):
+        self.queue = asyncio.Queue()
+
+        for i in range(self.workers):
+            worker = WineWorker(self, i)
+            worker.task = asyncio.create_task(worker.run())
+            self.pool.append(worker)
+
+    async def close(self):
+        for worker in self.pool:
+            worker.task.cancel()
+            await worker.stop()
+
+        self.pool.clear()
+
+    async def run_once(self, conversion: Conversion) -> str:
+        # no warm workers, pays the full start up of the tool every time
+        args = [self.tool_path]
+        env = None
+
+        if platform.system() != "Windows":
+            args.insert(0, "wine")
+            env = {"DISPLAY": ":1", **os.environ}
+
+        start = time.perf_counter()
+        result = await conversion.run(args, env, self.timeout)
+        self.record(time.perf_counter() - start, cold=True)
+
+        if result == "timeout":
+            raise XWBCreatorError(f"Creating the xwb {conversion.xwb_name} timed out.")
+
+        if result != "done":
+            raise XWBCreatorError(f"Creating the xwb {conversion.xwb_name} ran into an error.")
+
+        return conversion.output_path
+
+    async def resolve_once(self, conversion: Conversion):
+        if conversion.future.done():
+            return
+
+        try:
+            conversion.future.set_result(await self.run_once(conversion))
+        except XWBCreatorError as e:
+            conversion.future.set_exception(e)
+
+    async def convert(self, directory: str, xwb_name: str, wav_names: typing.Sequence[str] = ("temp.wav",)) -> str:
+        """
+        Converts adpcm wavs inside directory into an xwb, returning the path of the xwb
+        :param directory: The directory the wavs are in and the xwb is written to
+        :param xwb_name: The xwb's filename
+        :param wav_names: The wavs' filenames, each one becomes an entry of the bank
+        """
+        conversion = Conversion(directory, xwb_name, list(wav_names))
+
+        if not self.pool:
+            return await self.run_once(conversion)
+
+        await self.queue.put(conversion)
+        return await conversion.future
@@ -2,14 +2,21 @@ import asyncio
 import concurrent.futures
 import functools
 import io
+import os
 import uuid
+import threading
 
 from copy import deepcopy
 
-import yt_dlp as youtube_dl
+from config.utils.lazy import LazyModule
 
 
-youtube_dl.utils.bug_reports_message = lambda: ''
+def quiet_bug_reports(module):
+    module.utils.bug_reports_message = lambda: ''
+
+
+# yt_dlp takes a while to import and isn't needed until the first download
+youtube_dl = LazyModule("yt_dlp", on_import=quiet_bug_reports)
 
 
 class YTDLError(Exception):
@@ -45,8 +52,60 @@ class YTDL:
         filename = str(uuid.uuid4().hex)
         return filename
 
+    @staticmethod
+    def check_cancelled(cancel_event: threading.Event, _):
+        # raising inside a progress hook is the only way to stop a download that's already running
+        if cancel_event.is_set():
+            raise YTDLError("The download was cancelled.")
+
     @classmethod
-    async def create_mp3(cls, bot, search: str, *, loop: asyncio.BaseEventLoop = None):
+    async def resolve_playlist(cls, url: str, limit: int, *, loop: asyncio.BaseEventLoop = None) -> list[dict]:
+        """
+        The first limit songs of the playlist at url as {"url", "title", "duration"}, only its metadata is read
+        so nothing is downloaded, a url that isn't a playlist is its own only song
+        """
+        loop = loop or asyncio.get_event_loop()
+        # entries come back as the playlist lists them instead of each one being extracted
+        options = {"quiet": True, "extract_flat": "in_playlist", "playlistend": limit, "skip_download": True}
+
+        def extract():
+            with youtube_dl.YoutubeDL(options) as ydl:
+                return ydl.extract_info(url, download=False)
+
+        try:
+            info = await loop.run_in_executor(None, extract)
+        except (youtube_dl.utils.DownloadError, youtube_dl.utils.ExtractorError):
+            raise YTDLError("Couldn't read the playlist `{}`".format(url))
+
+        if not info:
+            raise YTDLError("Couldn't find anything that matches `{}`".format(url))
+
+        if info.get("_type") != "playlist":
+            return [{"url": url, "title": info.get("title"), "duration": info.get("duration")}]
+
+        entries = []
+
+        for entry in info.get("entries") or []:
+            entry_url = (entry or {}).get("url") or (entry or {}).get("webpage_url")
+
+            if entry_url:
+                entries.append({"url": entry_url, "title": entry.get("title"), "duration": entry.get("duration")})
+
+        if not entries:
+            raise YTDLError("The playlist `{}` has nothing in it that can be downloaded.".format(url))
+
+        return entries[:limit]
+
+    @classmethod
+    async def create_mp3(cls, bot, search: str, *, loop: asyncio.BaseEventLoop = None, directory: str = "",
+                         cancel_event: threading.Event = None, start: float = None, end: float = None):
+        """
+        :param directory: Download into this directory and return the file's path instead of reading it into memory,
+        the file is left for the caller to clean up with the directory
+        :param cancel_event: Stops the download once set
+        :param start: Only download from this many seconds in
+        :param end: Only download up to this many seconds in
+        """
         buffer = io.BytesIO()
 
         loop = loop or asyncio.get_event_loop()
@@ -54,7 +113,16 @@ class YTDL:
         unique_filename = cls.generate_unique_filename()
         options = deepcopy(cls.YTDL_OPTIONS)
 
-        options["outtmpl"] = unique_filename  # Update the unique filename in YTDL_OPTIONS
+        options["outtmpl"] = os.path.join(directory, unique_filename)  # Update the unique filename in YTDL_OPTIONS
+
+        if cancel_event is not None:
+            options["progress_hooks"] = [functools.partial(cls.check_cancelled, cancel_event)]
+
+        if start is not None or end is not None:
+            # only the requested section is fetched and transcoded, cut on exact timestamps rather than keyframes
+            options["download_ranges"] = youtube_dl.utils.download_range_func(
+                None, [(start or 0.0, end if end is not None else float("inf"))])
+            options["force_keyframes_at_cuts"] = True
 
         with youtube_dl.YoutubeDL(options) as ydl:
             partial = functools.partial(ydl.download, search)
@@ -70,15 +138,19 @@ class YTDL:
             if data is None:
                 raise YTDLError("Couldn't find anything that matches `{}`".format(search))
 
-            filename = f"{unique_filename}.mp3"
+            filename = f"{options['outtmpl']}.mp3"
 
-            with open(filename, "rb") as f:
-                buffer.write(f.read())
-            buffer.seek(0)
-            # schedule file for deletion
-            bot.dead_files.put(filename)
+            if directory:
+                audio = filename
+            else:
+                with open(filename, "rb") as f:
+                    buffer.write(f.read())
+                buffer.seek(0)
+                audio = buffer
+                # schedule file for deletion
+                bot.dead_files.put(filename)
 
-        info = {"audio": buffer,
+        info = {"audio": audio,
                 "title": filename}
 
         return cls(data=info)
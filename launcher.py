@@ -0,0 +1,122 @@
+"""
+Runs the bot as several processes, each connecting a range of the shards
+------------------------------------------------------------------------
+python launcher.py
+__clusters__ and __shard_count__ in the config decide the split, crashed clusters are started again
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import urllib.request
+
+from config import config
+from config.utils.cluster import ClusterStats
+
+# a cluster that stays up this long has its restart backoff reset
+STABLE_AFTER = 300
+MAX_BACKOFF = 60
+# how long to wait for a cluster to be ready before starting the next one anyway
+READY_TIMEOUT = 120
+
+
+def recommended_shards() -> int:
+    request = urllib.request.Request("https://discord.com/api/v10/gateway/bot",
+                                     headers={"Authorization": f"Bot {config.__bot_token__}",
+                                              "User-Agent": "DiscordBot (launcher.py, 1.0)"})
+
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.load(response)["shards"]
+
+
+class Cluster:
+    def __init__(self, cluster_id: int, shard_ids: list[int], shard_count: int, stats: ClusterStats):
+        self.id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.stats = stats
+        self.proc: asyncio.subprocess.Process = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.stopping = False
+
+    async def start(self):
+        env = {**os.environ,
+               "ES_CLUSTER_ID": str(self.id),
+               "ES_SHARD_IDS": ",".join(str(shard) for shard in self.shard_ids),
+               "ES_SHARD_COUNT": str(self.shard_count)}
+        self.started_at = time.time()
+        self.proc = await asyncio.create_subprocess_exec(sys.executable, "main.py", env=env)
+        print(f"cluster {self.id} started with shards {self.shard_ids[0]}-{self.shard_ids[-1]} (pid {self.proc.pid})")
+
+    async def wait_until_ready(self):
+        # discord only lets a bot identify so often, so clusters connect one after another
+        deadline = time.monotonic() + READY_TIMEOUT
+
+        while time.monotonic() < deadline and self.proc.returncode is None:
+            stats = self.stats.read(self.id)
+
+            if stats.get("ready") and stats.get("written", 0) >= self.started_at:
+                return
+
+            await asyncio.sleep(1)
+
+    async def supervise(self):
+        while True:
+            code = await self.proc.wait()
+
+            if self.stopping:
+                return
+
+            if time.time() - self.started_at > STABLE_AFTER:
+                self.restarts = 0
+
+            backoff = min(MAX_BACKOFF, 2 ** self.restarts)
+            self.restarts += 1
+            print(f"cluster {self.id} exited with {code}, restarting in {backoff}s")
+            await asyncio.sleep(backoff)
+
+            if self.stopping:
+                return
+
+            await self.start()
+
+    def stop(self):
+        self.stopping = True
+
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.send_signal(signal.SIGINT)
+
+
+async def main():
+    shard_count = getattr(config, "__shard_count__", 0) or recommended_shards()
+    stats = ClusterStats(os.path.join(os.getcwd(), "clusters"))
+    ranges = ClusterStats.shard_ranges(shard_count, getattr(config, "__clusters__", 2))
+    clusters = [Cluster(i, shard_ids, shard_count, stats) for i, shard_ids in enumerate(ranges)]
+    loop = asyncio.get_running_loop()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: [cluster.stop() for cluster in clusters])
+        except NotImplementedError:
+            # windows, ctrl+c reaches the clusters directly there
+            pass
+
+    print(f"{shard_count} shards over {len(clusters)} clusters")
+    supervisors = []
+
+    for cluster in clusters:
+        if cluster.stopping:
+            break
+
+        await cluster.start()
+        supervisors.append(asyncio.create_task(cluster.supervise()))
+        await cluster.wait_until_ready()
+
+    await asyncio.gather(*supervisors)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
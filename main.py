@@ -7,13 +7,15 @@ import re
 
 import asyncio
 import aiohttp
+import functools
+import importlib
+import collections
 import sys
+import time
 
 import platform
 
-import psutil
-
-import humanize as h
+from config.utils.lazy import LazyModule, startup
 
 import discord
 
@@ -21,21 +23,166 @@ from discord.ext import commands
 
 from config.cogs import __cogs__
 from config.utils import requests
+from config.utils.scheduler import JobScheduler, TrackedThreadPoolExecutor, TrackedProcessPoolExecutor
+from config.utils.xwbtool import XWBToolPool
+from config.utils.artifacts import ArtifactServer
+from config.utils.admission import Admission
+from config.utils.templates import TemplateRegistry
+from config.utils.delivery import Delivery
+from config.utils.jobqueue import JobQueue, JobFailed
+from config.utils.diskio import disk_io
+from config.utils.cluster import ClusterStats
+from config.utils.xwb import XWBCreatorError
 from config import config
 
+# only needed by about
+psutil = LazyModule("psutil")
+h = LazyModule("humanize")
+
 
-class ES(commands.Bot):
+class ES(commands.AutoShardedBot):
     def __init__(self, *args, **kwargs):
+        # set when launcher.py runs this process as one cluster of the shards
+        self.cluster_id = kwargs.pop("cluster_id", None)
+        self.cluster_stats = ClusterStats(os.path.join(os.getcwd(), "clusters"), self.cluster_id)
+        # clusters clean up their own temp directory on start, so they can't share one
+        self.temp_root = os.path.join(os.getcwd(), "temp")
+
+        if self.cluster_id is not None:
+            self.temp_root = os.path.join(self.temp_root, f"cluster-{self.cluster_id}")
+
         # when you want to delete a file, do:
         # dead_files.put(file_path)
         self.dead_files = queue.Queue()
         self.END_OF_DATA = object()  # a unique sentinel value
         self.embed_colour = 0x00dcff
         self.deleter = threading.Thread(target=self.background_deleter)
+        self.scheduler = JobScheduler(self,
+                                      workers=getattr(config, "__scheduler_workers__", 2),
+                                      max_job_cost=getattr(config, "__scheduler_max_job_cost__", 500),
+                                      max_flow_cost=getattr(config, "__scheduler_max_flow_cost__", 1000),
+                                      weights=getattr(config, "__scheduler_weights__", {}))
+        # each cluster keeps its own wine prefixes, wineserver -k on a shared one would kill the other clusters'
+        # conversions
+        wine_root = os.path.join(os.getcwd(), "wine")
+
+        if self.cluster_id is not None:
+            wine_root = os.path.join(wine_root, f"cluster-{self.cluster_id}")
+
+        self.xwb_tool = XWBToolPool(workers=getattr(config, "__xwb_tool_workers__", 2),
+                                    batch_size=getattr(config, "__xwb_tool_batch_size__", 4),
+                                    timeout=getattr(config, "__xwb_tool_timeout__", 60),
+                                    prefix_root=wine_root)
+        # tracks are encoded in their own processes, several at once
+        self.encoders = TrackedProcessPoolExecutor(getattr(config, "__encode_workers__", None))
+        # with a job queue the heavy work is done by worker.py processes instead
+        self.job_queue = JobQueue(config.__job_queue__) if getattr(config, "__job_queue__", "") else None
+        self.admission = Admission(limits=getattr(config, "__admission_limits__", {}),
+                                   guild_limits=getattr(config, "__guild_limits__", {}))
+        self.delivery = Delivery(getattr(config, "__delivery_per_channel__", 2))
+        disk_io.configure(workers=getattr(config, "__disk_io_workers__", 8),
+                          per_device=getattr(config, "__disk_io_per_device__", 4))
+        self.templates = TemplateRegistry(os.path.join(os.getcwd(), "templates"))
+        self.templates.load()
+        # users looked up by id that discord.py doesn't keep, least recently used first
+        self.fetched_users = collections.OrderedDict()
+        self.fetched_users_size = getattr(config, "__fetched_users_size__", 256)
+        self.artifacts = None
+
+        if getattr(config, "__fallback_host__", "filebin") == "local":
+            # every cluster serves its own files, on the port after the previous cluster's
+            cluster = self.cluster_id or 0
+            port = getattr(config, "__artifact_port__", 8080) + cluster
+            self.artifacts = ArtifactServer(os.path.join(os.getcwd(), "artifacts", f"cluster-{cluster}"),
+                                            config.__artifact_url__.format(cluster=cluster, port=port),
+                                            host=getattr(config, "__artifact_host__", "0.0.0.0"),
+                                            port=port,
+                                            secret=getattr(config, "__artifact_secret__", ""),
+                                            ttl=getattr(config, "__artifact_ttl__", 86400),
+                                            max_bytes=getattr(config, "__artifact_max_bytes__", 10737418240))
         super().__init__(*args, **kwargs)
 
+    async def offload(self, kind: str, func, *args, executor=False, **kwargs):
+        """
+        Runs func(*args, **kwargs) on a worker when there's a job queue, otherwise locally
+        :param kind: The name worker.py knows func by
+        :param executor: The local executor, the encoders' process pool by default and None for the thread pool
+        """
+        if self.job_queue is None:
+            executor = self.encoders if executor is False else executor
+            return await self.loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+        try:
+            return await self.job_queue.run(kind, *args, **kwargs)
+        except JobFailed as e:
+            # errors meant for the user come back as the same error, so does a job no worker could finish
+            if e.error_type in ("XWBCreatorError", "XSBEditorError", "JobAbandoned"):
+                raise XWBCreatorError(str(e))
+            raise
+
+    async def get_or_fetch_user(self, user_id: int) -> discord.User:
+        # with the lean cache most users aren't cached, so they're fetched once and kept for a while
+        user = self.get_user(user_id) or self.fetched_users.get(user_id)
+
+        if user is None:
+            user = await self.fetch_user(user_id)
+
+        self.fetched_users[user_id] = user
+        self.fetched_users.move_to_end(user_id)
+
+        while len(self.fetched_users) > self.fetched_users_size:
+            self.fetched_users.popitem(last=False)
+
+        return user
+
+    def cache_sizes(self) -> dict:
+        return {"guilds": len(self.guilds),
+                "users": len(self.users),
+                "members": sum(len(guild.members) for guild in self.guilds),
+                "messages": len(self.cached_messages),
+                "fetched users": len(self.fetched_users)}
+
+    def stats(self) -> dict:
+        return {"shards": sorted(self.shard_ids or self.shards),
+                "guilds": len(self.guilds),
+                "latency": self.latency,
+                "rss": psutil.Process().memory_info().rss,
+                "ready": self.is_ready()}
+
+    async def write_stats_periodically(self, interval: int = 30):
+        while True:
+            await self.loop.run_in_executor(None, self.cluster_stats.write, self.stats())
+            await asyncio.sleep(interval)
+
     async def __ainit__(self, *args, **kwargs):
         self.request = requests.Request(self, self.session)
+        # run_in_executor(None, ...) calls made by a job are tracked too, so its workspace outlives them
+        self.loop.set_default_executor(TrackedThreadPoolExecutor(thread_name_prefix="asyncio"))
+        self.xwb_tool.start()
+
+        if self.artifacts is not None:
+            await self.artifacts.start()
+
+        # runs alongside connecting to the gateway
+        self.loop.create_task(self.load_cogs(getattr(config, "__deferred_cogs__", [])))
+
+        if self.cluster_id is not None:
+            self.loop.create_task(self.write_stats_periodically())
+
+    async def load_cogs(self, cogs):
+        for c in cogs:
+            try:
+                with startup.measure("cog", c):
+                    # imported in a thread first so the loop keeps heartbeating, loading it again is then cheap
+                    await asyncio.to_thread(importlib.import_module, c)
+                    await self.load_extension(c)
+
+            except Exception as e:
+                # the bot is already up by now, so one broken cog doesn't take it down
+                print(f"{c} could not be loaded: {e!r}")
+
+        if cogs:
+            startup.mark("deferred cogs loaded")
 
     def create_directory(self, path):
         if not os.path.exists(path):
@@ -74,6 +221,9 @@ class ES(commands.Bot):
     async def fetch(self, url, **kwargs):
         return await self.request.fetch(url, **kwargs)
 
+    async def fetch_range(self, url, start, length):
+        return await self.request.fetch_range(url, start, length)
+
     async def post(self, url, **kwargs):
         return await self.request.post(url, **kwargs)
 
@@ -86,6 +236,12 @@ class ES(commands.Bot):
         await self.process_commands(message)
 
     async def close(self):
+        await self.xwb_tool.close()
+        self.encoders.shutdown(wait=False, cancel_futures=True)
+        disk_io.shutdown()
+
+        if self.artifacts is not None:
+            await self.artifacts.stop()
         await self.session.close()
         # shutting down thread cleanly
         self.dead_files.put(self.END_OF_DATA)
@@ -97,23 +253,49 @@ class ES(commands.Bot):
 # since I have a say command and in the future may implement replies for long to process commands
 allowed_mentions = discord.AllowedMentions(everyone=False, roles=False, replied_user=False)
 intents = discord.Intents.default()  # All but the privileged ones
-# need this for discord.User to work as intended
-intents.members = True
+lean_cache = getattr(config, "__lean_cache__", False)
+# need this for discord.User to work as intended, the lean cache gets by with ctx.author and fetching the rest
+intents.members = not lean_cache
 intents.message_content = True
+cache_options = {}
+
+if lean_cache:
+    # no member lists are chunked or kept, the message cache is only there for edits of recent commands
+    cache_options = {"chunk_guilds_at_startup": False,
+                     "member_cache_flags": discord.MemberCacheFlags.none(),
+                     "max_messages": getattr(config, "__max_messages__", 100)}
 
 
 async def get_prefix(bot, message):
     return commands.when_mentioned_or(*config.__prefixes__)(bot, message)
 
 
+shard_options = {}
+
+if "ES_CLUSTER_ID" in os.environ:
+    # run by launcher.py, which splits the shards between its processes
+    shard_options = {"cluster_id": int(os.environ["ES_CLUSTER_ID"]),
+                     "shard_ids": [int(shard) for shard in os.environ["ES_SHARD_IDS"].split(",")],
+                     "shard_count": int(os.environ["ES_SHARD_COUNT"])}
+
 bot = ES(command_prefix=get_prefix,
          case_insensitive=True,
          intents=intents,
-         allowed_mentions=allowed_mentions)
+         allowed_mentions=allowed_mentions,
+         **cache_options,
+         **shard_options)
 
 
 @bot.event
 async def on_ready():
+    if not any(name == "ready" for _, name, _, _ in startup.timings):
+        startup.mark("ready")
+        print(startup.table())
+
+    if bot.cluster_id is not None:
+        # the launcher waits for this before starting the next cluster
+        await bot.loop.run_in_executor(None, bot.cluster_stats.write, bot.stats())
+
     print(f"Successfully logged in and booted...!")
     print(f"\nLogged in as: {bot.user.name} - {bot.user.id}\nDiscord.py version: {discord.__version__}\n")
 
@@ -175,41 +357,91 @@ async def about(ctx):
                          command.name and "jishaku" not in command.qualified_name})
     py_version = ".".join(str(n) for n in sys.version_info[:3])
     guild_count = f"```{(len(bot.guilds))}```"
+    ram = f"```Using {h.naturalsize(mem.rss)}```"
+
+    if bot.cluster_id is not None:
+        totals = await bot.loop.run_in_executor(None, bot.cluster_stats.totals)
+        guild_count = f"```{totals['guilds']} ({totals['clusters']} clusters, {totals['shards']} shards)```"
+        ram = f"```Using {h.naturalsize(totals['rss'])} in total```"
+
     embed = discord.Embed(color=bot.embed_colour, title="", description=f"")
     embed.add_field(name="Basic:", value=f"**OS**: {platform.platform()}\n**Hostname: **OVH\n**Python Version: **"
                                          f"{py_version}\n**Links**: {invite_url}", inline=False)
     embed.add_field(name="Dev:", value="```CaladWoDestroyer#9313```")
     embed.add_field(name="Library:", value=f"```Discord.py {discord.__version__}```")
     embed.add_field(name="Commands:", value=f"```{command_count}```")
-    embed.add_field(name="RAM:", value=f"```Using {h.naturalsize(mem.rss)}```")
+    embed.add_field(name="RAM:", value=ram)
     embed.add_field(name="VRAM:", value=f"```Using {h.naturalsize(mem.vms)}```")
     embed.add_field(name="Web socket ping", value=f"```{round(ctx.bot.latency * 1000, 2)}```")
     embed.add_field(name="Guilds:", value=guild_count)
+    xwb_stats = bot.xwb_tool.stats()
+    embed.add_field(name="XWBTool latency:",
+                    value=f"```cold {xwb_stats['cold']['mean'] * 1000:.0f}ms ({xwb_stats['cold']['count']})\n"
+                          f"warm {xwb_stats['warm']['mean'] * 1000:.0f}ms ({xwb_stats['warm']['count']}) "
+                          f"p95 {xwb_stats['warm']['p95'] * 1000:.0f}ms "
+                          f"batch {xwb_stats['warm']['batch']:.1f}\n"
+                          f"recycled {xwb_stats['recycles']}```", inline=False)
     await ctx.send(embed=embed)
 
 
+@bot.command()
+@commands.is_owner()
+async def cache(ctx):
+    """
+    How much discord.py is keeping in memory
+    -------------------------------------------------------------
+    es cache
+    """
+    embed = discord.Embed(color=bot.embed_colour, title="Cache")
+
+    for name, size in ctx.bot.cache_sizes().items():
+        embed.add_field(name=f"{name.capitalize()}:", value=f"```{size}```")
+
+    embed.add_field(name="Lean:", value=f"```{'yes' if lean_cache else 'no'}```")
+    embed.add_field(name="RAM:", value=f"```Using {h.naturalsize(psutil.Process().memory_info().rss)}```")
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+@commands.is_owner()
+async def startup_report(ctx):
+    """
+    How long each part of the last start took
+    -------------------------------------------------------------
+    es startup_report
+    """
+    await ctx.send(f"```{startup.table()}```")
+
+
 if __name__ == "__main__":
+    startup.record("phase", "main module", time.perf_counter() - startup.started)
 
     async def main():
         async with aiohttp.ClientSession() as session:
 
             bot.session = session
             bot.deleter.start()  # starting the deleting thread
-            bot.cleanup_directory(os.path.join(os.getcwd(), "temp"))  # clean up the temporary directory
+            bot.create_directory(bot.temp_root)
+            bot.cleanup_directory(bot.temp_root)  # clean up the temporary directory
             # print(config.__mega_email__)
             # subprocess.run(["mega-login", config.__mega_email__, config.__mega_password__], shell=True)
             async with bot:
+                deferred = getattr(config, "__deferred_cogs__", [])
 
                 for c in __cogs__:
+                    if c in deferred:
+                        continue
 
                     try:
 
-                        await bot.load_extension(c)
+                        with startup.measure("cog", c):
+                            await bot.load_extension(c)
 
                     except Exception as e:
                         print(f"{c} could not be loaded.")
                         raise e
 
+                startup.mark("connecting")
                 await bot.start(config.__bot_token__, reconnect=True)
 
 
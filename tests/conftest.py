@@ -0,0 +1,20 @@
+import struct
+
+
+def build_pac(path, files: list[tuple[str, bytes]]):
+    # laid out by hand rather than with replace_many, so the reader is checked against the format itself
+    name_length = (max(len(name) for name, _ in files) + 1 + 3) // 4 * 4
+    stride = (name_length + 16 + 15) // 16 * 16
+    start_offset = (32 + len(files) * stride + 15) // 16 * 16
+    entries = b""
+    data = b""
+
+    for file_id, (name, content) in enumerate(files):
+        entries += name.encode("ASCII").ljust(name_length, b"\0")
+        entries += struct.pack("<4i", file_id, len(data), len(content), 0).ljust(stride - name_length, b"\0")
+        data += content + b"\0" * (-len(content) % 16)
+
+    header = struct.pack("<4s5iq", b"FPAC", start_offset, start_offset + len(data), len(files), 1, name_length, 0)
+
+    with open(path, "wb") as f:
+        f.write((header + entries).ljust(start_offset, b"\0") + data)
@@ -0,0 +1,36 @@
+import asyncio
+
+from config.utils.delivery import Delivery
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.sending = 0
+        self.most = 0
+
+    async def send(self, content, files):
+        self.sending += 1
+        self.most = max(self.most, self.sending)
+        await asyncio.sleep(0.01)
+        self.sending -= 1
+
+
+def test_uploads_are_bounded_per_channel_and_forgotten_after(tmp_path):
+    delivery = Delivery(per_channel=2)
+    files = []
+
+    for i in range(6):
+        path = tmp_path / f"{i}.pac"
+        path.write_bytes(b"\0" * 100)
+        files.append((str(path), path.name))
+
+    channels = [FakeChannel(channel_id) for channel_id in range(50)]
+
+    async def main():
+        # one file a message, so every channel has six messages going at once
+        return await asyncio.gather(*[delivery.send(channel, files, limit=150) for channel in channels])
+
+    assert asyncio.run(main()) == [[]] * 50
+    assert all(channel.most == 2 for channel in channels)
+    assert delivery.semaphores == {}
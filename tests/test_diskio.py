@@ -0,0 +1,115 @@
+import time
+import asyncio
+
+import pytest
+
+from config.utils.diskio import disk_io, DiskIO
+from config.utils.pacfile import FileHeader
+from config.utils.xwb import XSBEditor
+
+from conftest import build_pac
+
+# how long the loop may go without running a ready callback while the files are worked on
+MAX_LAG = 0.1
+
+
+@pytest.fixture(autouse=True)
+def fresh_semaphores(monkeypatch):
+    # the semaphores belong to whichever loop first waited on them, every test runs its own
+    monkeypatch.setattr(disk_io, "semaphores", {})
+
+
+async def max_lag_during(work) -> float:
+    """
+    Runs work while a heartbeat ticks on the loop, the longest gap between ticks past when it was due
+    """
+    lag = 0.0
+    done = False
+
+    async def heartbeat():
+        nonlocal lag
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lag = max(lag, time.perf_counter() - start - 0.005)
+
+    task = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0)
+
+    try:
+        await work
+    finally:
+        done = True
+        await task
+
+    return lag
+
+
+@pytest.fixture
+def big_pac(tmp_path):
+    path = tmp_path / "big.pac"
+    build_pac(path, [(f"bgm_{i:03}.xwb", bytes([i]) * 4194304) for i in range(24)])
+    replacement = tmp_path / "new.xwb"
+    replacement.write_bytes(b"\1" * 33554432)
+    return path, replacement
+
+
+def test_pac_work_does_not_block_the_loop(tmp_path, big_pac):
+    path, replacement = big_pac
+    extracted = tmp_path / "extracted"
+    extracted.mkdir()
+
+    # the same work done on the loop is what the threshold is meant to catch
+    start = time.perf_counter()
+    header = FileHeader(str(path))
+    header.replace(header.files[0], str(replacement))
+    header.extract_all_files(str(extracted))
+    assert time.perf_counter() - start > MAX_LAG
+
+    async def work():
+        header = await FileHeader.open(str(path))
+        await header.replace_async(header.files[1], str(replacement))
+        await header.read_async(header.files[1])
+        await header.extract_all_files_async(str(extracted))
+
+    assert asyncio.run(max_lag_during(work())) < MAX_LAG
+
+
+def test_xsb_work_does_not_block_the_loop(tmp_path):
+    path = tmp_path / "bgm.xsb"
+    path.write_bytes(b"\0" * 4194304)
+    editor = XSBEditor(str(path))
+
+    start = time.perf_counter()
+    editor.calculate_checksum()
+    assert time.perf_counter() - start > MAX_LAG
+
+    async def work():
+        await editor.write_volume_async(0x50)
+        await editor.calculate_checksum_async()
+
+    assert asyncio.run(max_lag_during(work())) < MAX_LAG
+    assert path.read_bytes()[0xCD] == 0x50
+
+
+def test_calls_on_one_device_are_bounded(tmp_path):
+    pool = DiskIO(workers=8, per_device=2)
+    running = 0
+    most = 0
+
+    def work():
+        nonlocal running, most
+        running += 1
+        most = max(most, running)
+        time.sleep(0.02)
+        running -= 1
+
+    async def main():
+        await asyncio.gather(*(pool.run(tmp_path, work) for _ in range(8)))
+
+    try:
+        asyncio.run(main())
+    finally:
+        pool.shutdown()
+
+    assert most == 2
@@ -0,0 +1,31 @@
+import time
+
+from config.utils.jobqueue import JobQueue
+
+
+def test_a_job_that_keeps_going_stale_is_failed(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "jobs.sqlite"), stale_after=0, max_attempts=2)
+    job_id = job_queue.enqueue("encode", "a.wav")
+
+    for attempt in range(2):
+        job = job_queue.claim(f"worker-{attempt}")
+        assert job["id"] == job_id
+        # the worker dies without another heartbeat
+        time.sleep(0.01)
+
+    assert job_queue.claim("worker-2") is None
+    job = job_queue.get(job_id)
+    assert job["state"] == JobQueue.FAILED
+    assert job["error_type"] == "JobAbandoned"
+    assert "2 workers" in job["error"]
+
+
+def test_a_stale_job_with_attempts_left_is_claimed_again(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "jobs.sqlite"), stale_after=0, max_attempts=3)
+    job_id = job_queue.enqueue("encode", "a.wav")
+    job_queue.claim("worker-0")
+    time.sleep(0.01)
+
+    job = job_queue.claim("worker-1")
+    assert job["id"] == job_id
+    assert job_queue.get(job_id)["attempts"] == 2
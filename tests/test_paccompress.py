@@ -0,0 +1,62 @@
+import struct
+import zlib
+
+import pytest
+
+from discord.ext import commands
+
+from config.utils.paccompress import PacCompression, HeadDecompressor, COMPRESSED_MAGIC
+
+
+def write_compressed(path, data: bytes, claimed: int = None):
+    path.write_bytes(COMPRESSED_MAGIC + struct.pack("<I", len(data) if claimed is None else claimed) +
+                     zlib.compress(data))
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "test.pac"
+    data = b"FPAC" + bytes(range(256)) * 1000
+    path.write_bytes(data)
+
+    PacCompression.compress_in_place(path)
+    assert PacCompression.is_compressed(path)
+    assert PacCompression.decompress_in_place(path, max_size=len(data))
+    assert path.read_bytes() == data
+
+
+def test_over_the_limit_is_rejected_before_writing(tmp_path):
+    path = tmp_path / "test.pac"
+    write_compressed(path, b"\0" * 4194304)
+
+    with pytest.raises(commands.BadArgument):
+        PacCompression.decompress_in_place(path, max_size=1048576)
+
+    assert not (tmp_path / "test.pac.tmp").exists()
+    assert PacCompression.is_compressed(path)
+
+
+def test_bigger_than_claimed(tmp_path):
+    path = tmp_path / "test.pac"
+    write_compressed(path, b"\0" * 65536, claimed=1024)
+
+    with pytest.raises(commands.BadArgument):
+        PacCompression.decompress_in_place(path)
+
+
+def test_head_decompressor_fed_in_pieces():
+    data = b"FPAC" + bytes(range(256)) * 4000
+    compressed = COMPRESSED_MAGIC + struct.pack("<I", len(data)) + zlib.compress(data)
+    decompressor = HeadDecompressor(65536)
+
+    for start in range(0, len(compressed), 1000):
+        head = decompressor.feed(compressed[start:start + 1000])
+
+    assert bytes(head) == data[:65536]
+
+
+def test_head_decompressor_rejects_garbage():
+    decompressor = HeadDecompressor(65536)
+    decompressor.feed(COMPRESSED_MAGIC + struct.pack("<I", 1024) + zlib.compress(b"FPAC")[:2])
+
+    with pytest.raises(commands.BadArgument):
+        decompressor.feed(b"\xff" * 4096)
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from discord.ext import commands
+
+from config.utils.pacfile import FileHeader
+
+from conftest import build_pac
+
+
+# name lengths on both sides of every 16 byte boundary the stride can land on
+@pytest.mark.parametrize("longest", [3, 7, 11, 15, 19, 21, 27, 31, 35])
+def test_replace_then_parse(tmp_path, longest):
+    pac_path = tmp_path / "test.pac"
+    files = [("a" * longest, b"first" * 7), ("b.xsb", b"second"), ("c.xwb", b"third" * 100)]
+    build_pac(pac_path, files)
+    replacement = tmp_path / "new.xwb"
+    replacement.write_bytes(b"replaced" * 33)
+
+    header = FileHeader(pac_path)
+    assert [f.file_name for f in header.files] == [name for name, _ in files]
+    header.replace(header.files[2], replacement)
+
+    reparsed = FileHeader(pac_path)
+    assert [(f.file_name, f.id, f.offset, f.file_size) for f in reparsed.files] == \
+        [(f.file_name, f.id, f.offset, f.file_size) for f in header.files]
+    assert reparsed.read(reparsed.files[0]) == files[0][1]
+    assert reparsed.read(reparsed.files[1]) == files[1][1]
+    assert reparsed.read(reparsed.files[2]) == replacement.read_bytes()
+    assert os.path.getsize(pac_path) >= reparsed.file_size
+
+
+def test_cut_short(tmp_path):
+    pac_path = tmp_path / "test.pac"
+    build_pac(pac_path, [("a.xwb", b"x" * 64), ("b.xsb", b"y" * 64)])
+
+    with open(pac_path, "rb+") as f:
+        f.truncate(os.path.getsize(pac_path) - 32)
+
+    with pytest.raises(commands.BadArgument):
+        FileHeader(pac_path)
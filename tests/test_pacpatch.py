@@ -0,0 +1,33 @@
+import shutil
+
+import pytest
+
+from config.utils.pacfile import FileHeader
+from config.utils.pacpatch import PacPatch
+from tools.applypatch import apply_patch
+
+from conftest import build_pac
+
+
+@pytest.mark.parametrize("reuse_index", [True, False])
+@pytest.mark.parametrize("longest", [15, 19, 21, 31])
+def test_patch_applies_to_original(tmp_path, longest, reuse_index):
+    original_path = tmp_path / "original.pac"
+    modified_path = tmp_path / "modified.pac"
+    build_pac(original_path, [("a" * longest, b"unchanged" * 50), ("bgm.xsb", b"xsb"), ("bgm.xwb", b"old" * 9)])
+    shutil.copyfile(original_path, modified_path)
+    replacement = tmp_path / "new.xwb"
+    replacement.write_bytes(b"new bank" * 400)
+
+    header = FileHeader(modified_path)
+    header.replace(header.files[2], replacement)
+    index = header.to_index() if reuse_index else None
+
+    patch_path = tmp_path / "patch.espatch"
+    PacPatch.create(str(original_path), str(modified_path), str(patch_path), index)
+    output_path = tmp_path / "output.pac"
+    apply_patch(str(original_path), str(patch_path), str(output_path))
+
+    assert output_path.read_bytes() == modified_path.read_bytes()
+    # the unchanged member is copied from the original rather than stored
+    assert patch_path.stat().st_size < modified_path.stat().st_size
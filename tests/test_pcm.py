@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from pydub import AudioSegment
+
+from config.utils.pcm import PCMConverter
+
+
+def tone(frequency: float, amplitude: float, seconds: float = 10, rate: int = 48000) -> np.ndarray:
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def segment_of(samples: np.ndarray, rate: int) -> AudioSegment:
+    data = np.round(samples * 32767).astype("<i2")
+    return AudioSegment(data=data.tobytes(), sample_width=2, frame_rate=rate, channels=samples.shape[1])
+
+
+def test_loudness_of_the_reference_tone():
+    # BS.1770's own check, a 0 dBFS 1 kHz sine in one channel is -3.01 LKFS
+    samples = tone(1000, 0.1)
+    assert PCMConverter.loudness(np.stack([samples, np.zeros_like(samples)], axis=1), 48000) == \
+        pytest.approx(-23.01, abs=0.05)
+    assert PCMConverter.loudness(np.stack([samples, samples], axis=1), 48000) == pytest.approx(-20.0, abs=0.05)
+
+
+@pytest.mark.parametrize("frequency, weighting", [(100, -1.85), (10000, 3.32)])
+def test_loudness_follows_k_weighting(frequency, weighting):
+    samples = tone(frequency, 0.1)
+    assert PCMConverter.loudness(np.stack([samples, samples], axis=1), 48000) == \
+        pytest.approx(-20.0 + weighting, abs=0.1)
+
+
+def test_loudness_of_silence():
+    assert PCMConverter.loudness(np.zeros((48000 * 2, 2), dtype=np.float32), 48000) == -np.inf
+    assert PCMConverter.loudness(np.zeros((10, 2), dtype=np.float32), 48000) == -np.inf
+
+
+def test_limiter_keeps_peaks_under_the_ceiling():
+    rng = np.random.default_rng(0)
+    samples = (rng.standard_normal((44100 * 5, 2)) * 0.1).astype(np.float32)
+    samples[44100:44200] *= 20
+    limited = PCMConverter.limit(samples * 3, 44100)
+    assert np.abs(limited).max() <= PCMConverter.LIMIT_CEILING + 1e-6
+
+
+@pytest.mark.parametrize("amplitude", [0.1, 0.3, 0.9])
+def test_normalize_reaches_the_target(amplitude):
+    rng = np.random.default_rng(1)
+    samples = np.clip(rng.standard_normal((48000 * 20, 2)) * amplitude / 3, -1, 0.99).astype(np.float32)
+    normalized = PCMConverter.normalize(segment_of(samples, 48000), -14.0)
+    # the limiter can only make it quieter than the target
+    assert -14.6 < PCMConverter.loudness(PCMConverter.to_array(normalized), 48000) < -13.9
+
+
+def test_normalize_leaves_songs_at_the_target_alone():
+    samples = np.stack([tone(1000, 0.1)] * 2, axis=1)
+    segment = segment_of(samples, 48000)
+    assert PCMConverter.normalize(segment, PCMConverter.loudness(samples, 48000)) is segment
+
+
+def test_convert_normalizes_after_resampling():
+    rng = np.random.default_rng(2)
+    samples = (rng.standard_normal((44100 * 20, 2)) * 0.05).astype(np.float32)
+    converted = PCMConverter.convert(segment_of(samples, 44100), 48000, 2, loudness=-16.0)
+    assert converted.frame_rate == 48000
+    assert PCMConverter.loudness(PCMConverter.to_array(converted), 48000) == pytest.approx(-16.0, abs=0.1)
+
+
+def tone_error(output: np.ndarray, frequency: float, rate: int) -> float:
+    # everything but the tone in dB relative to it (THD+N), the edges where the filter runs in are left out
+    output = output[rate // 4:-rate // 4].astype(np.float64)
+    t = np.arange(len(output)) / rate
+    basis = np.stack([np.sin(2 * np.pi * frequency * t), np.cos(2 * np.pi * frequency * t)], axis=1)
+    fitted = basis @ np.linalg.lstsq(basis, output, rcond=None)[0]
+    return 10 * np.log10(np.mean((output - fitted) ** 2) / np.mean(fitted ** 2))
+
+
+@pytest.mark.parametrize("rate, new_rate", [(44100, 48000), (48000, 44100), (22050, 48000)])
+@pytest.mark.parametrize("frequency", [100, 1000, 9000])
+def test_resampled_tones_stay_clean(rate, new_rate, frequency):
+    samples = tone(frequency, 0.5, seconds=2, rate=rate)[:, None]
+    output = PCMConverter.resample(samples, rate, new_rate)
+
+    assert output.shape == (len(samples) * new_rate // rate, 1)
+    assert tone_error(output[:, 0], frequency, new_rate) < -80
+
+
+def test_resampling_down_removes_what_would_alias():
+    # 15 kHz is above 22050 Hz's nyquist and would fold back to 7050 Hz
+    samples = tone(15000, 0.5, seconds=2)[:, None]
+    output = PCMConverter.resample(samples, 48000, 22050)[22050 // 4:-22050 // 4]
+    assert 20 * np.log10(np.sqrt(np.mean(output ** 2)) / (0.5 / np.sqrt(2))) < -60
+
+
+def test_convert_to_the_output_format():
+    samples = np.stack([tone(1000, 0.5, seconds=1, rate=44100), tone(1000, 0.25, seconds=1, rate=44100)], axis=1)
+    output = PCMConverter.convert(segment_of(samples, 44100), 48000, channels=1)
+
+    assert (output.frame_rate, output.channels, output.sample_width) == (48000, 1, 2)
+    assert output.frame_count() == 48000
+    # a downmix averages the channels, the dither keeps it within a couple of steps of that
+    converted = PCMConverter.to_array(output)[:, 0]
+    expected = PCMConverter.resample(samples.mean(axis=1, keepdims=True), 44100, 48000)[:, 0]
+    assert np.abs(converted - expected).max() < 3 / 32768
+
+
+def test_quantize_dithers_within_a_step():
+    samples = np.linspace(-0.5, 0.5, 100000, dtype=np.float32)[:, None]
+    output = PCMConverter.quantize(samples, seed=0)
+
+    assert output.dtype == np.dtype("<i2")
+    assert np.abs(output / 32768 - samples).max() <= 1.5 / 32768
+    # the dither is spread evenly rather than rounding the same way every time
+    assert abs(np.mean(output / 32768 - samples)) < 0.05 / 32768
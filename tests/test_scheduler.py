@@ -0,0 +1,62 @@
+import queue
+import asyncio
+import threading
+import types
+
+from config.utils.scheduler import JobScheduler, TrackedThreadPoolExecutor
+
+
+def fake_ctx(tmp_path):
+    bot = types.SimpleNamespace(temp_root=str(tmp_path), dead_files=queue.Queue())
+    return types.SimpleNamespace(bot=bot, author=types.SimpleNamespace(id=1), guild=None, command=None)
+
+
+def test_workspace_outlives_work_still_running_for_a_cancelled_job(tmp_path):
+    ctx = fake_ctx(tmp_path)
+    scheduler = JobScheduler(ctx.bot)
+    pool = TrackedThreadPoolExecutor(2)
+    release = threading.Event()
+
+    def write(path):
+        release.wait()
+        with open(path, "wb") as f:
+            f.write(b"still writing")
+
+    async def run_job():
+        async with scheduler.job(ctx) as job:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(loop.run_in_executor(pool, write, job.workspace + "a.wav"),
+                                 loop.run_in_executor(pool, write, job.workspace + "b.wav"))
+
+    async def main():
+        task = asyncio.create_task(run_job())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    try:
+        asyncio.run(main())
+        # the job's gone but both threads are still going, the workspace isn't handed over for deleting yet
+        assert not scheduler.jobs
+        assert ctx.bot.dead_files.empty()
+
+        release.set()
+        workspace = ctx.bot.dead_files.get(timeout=5)
+    finally:
+        release.set()
+        pool.shutdown()
+
+    assert (tmp_path / "1" / "1" / "a.wav").read_bytes() == b"still writing"
+    assert workspace.endswith("/1/1/")
+
+
+def test_workspace_is_released_straight_away_when_nothing_is_running(tmp_path):
+    ctx = fake_ctx(tmp_path)
+    scheduler = JobScheduler(ctx.bot)
+
+    async def main():
+        async with scheduler.job(ctx):
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert not ctx.bot.dead_files.empty()
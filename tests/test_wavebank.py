@@ -0,0 +1,58 @@
+import struct
+
+import numpy as np
+import pytest
+
+from config.utils.wavebank import WaveBank, WaveBankEntry, WaveBankError
+
+
+def mini_format(format_tag: int, channels: int, rate: int, block_align: int, bits16: bool = True) -> int:
+    return format_tag | channels << 2 | rate << 5 | block_align << 23 | int(bits16) << 31
+
+
+def build_bank(entries: list[tuple[int, int, bytes]]) -> bytes:
+    """
+    A non compact bank of (duration, mini format, wave data) entries laid out like XWBTool's
+    """
+    bank_data = struct.pack("<II64sIIII8x", 0, len(entries), b"test", 24, 64, 4, 0)
+    metadata = b""
+    waves = b""
+
+    for duration, mini, data in entries:
+        metadata += struct.pack("<6I", duration << 4, mini, len(waves), len(data), 0, 0)
+        waves += data
+
+    offset = 52
+    segments = []
+
+    for segment in (bank_data, metadata, b"", b"", waves):
+        segments.append((offset, len(segment)))
+        offset += len(segment)
+
+    header = b"WBND" + struct.pack("<II", 46, 44) + b"".join(struct.pack("<II", *segment) for segment in segments)
+    return header + bank_data + metadata + waves
+
+
+def test_pcm_entries_decode():
+    samples = (np.arange(200, dtype=np.int16) * 100).reshape(100, 2)
+    bank = WaveBank(build_bank([(100, mini_format(WaveBankEntry.PCM, 2, 48000, 4), samples.tobytes())] * 2))
+
+    assert len(bank.entries) == 2
+    assert bank.entries[1].sample_rate == 48000
+    assert (bank.decode(bank.entries[0]) == samples).all()
+
+
+def test_entry_count_from_the_start_of_a_bank():
+    data = build_bank([(10, mini_format(WaveBankEntry.PCM, 1, 22050, 2), b"\0" * 20)] * 3)
+    assert WaveBank.entry_count_of(data[:4096]) == 3
+
+
+@pytest.mark.parametrize("mini", [
+    mini_format(WaveBankEntry.PCM, 0, 48000, 0),
+    mini_format(WaveBankEntry.PCM, 2, 0, 4),
+    mini_format(WaveBankEntry.PCM, 2, 48000, 3),
+    mini_format(WaveBankEntry.ADPCM, 0, 48000, 10),
+])
+def test_bad_formats_are_rejected(mini):
+    with pytest.raises(WaveBankError):
+        WaveBank(build_bank([(100, mini, b"\0" * 400)]))
@@ -0,0 +1,148 @@
+"""
+Applies a .espatch made by the bot to your original .pac file
+-------------------------------------------------------------
+python applypatch.py original.pac patch.espatch modified.pac
+"""
+import os
+import sys
+import zlib
+import struct
+import hashlib
+import tempfile
+
+MAGIC = b"ESPATCH1"
+COPY = 0
+DATA = 1
+END = 2
+BUFFER_SIZE = 1048576
+# compressed .pac files, patches are made against the decompressed archive
+COMPRESSED_MAGIC = b"DFASFPAC"
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("The patch or original file is truncated.")
+    return data
+
+
+def unpack(fmt, stream):
+    return struct.unpack(fmt, read_exactly(stream, struct.calcsize(fmt)))
+
+
+def copy_bytes(source, output, size, sha):
+    while size > 0:
+        data = read_exactly(source, min(size, BUFFER_SIZE))
+        output.write(data)
+        sha.update(data)
+        size -= len(data)
+
+
+def write_patched(original, patch, output):
+    if read_exactly(patch, len(MAGIC)) != MAGIC:
+        raise ValueError("This isn't a patch made by the bot.")
+
+    original_size = unpack("<Q", patch)[0]
+    original_hash = read_exactly(patch, 32)
+    modified_size = unpack("<Q", patch)[0]
+    modified_hash = read_exactly(patch, 32)
+
+    original.seek(0, 2)
+    if original.tell() != original_size:
+        raise ValueError("This patch was made for a different .pac file.")
+    original.seek(0)
+
+    sha = hashlib.sha256()
+    for data in iter(lambda: original.read(BUFFER_SIZE), b""):
+        sha.update(data)
+    if sha.digest() != original_hash:
+        raise ValueError("This patch was made for a different .pac file.")
+
+    sha = hashlib.sha256()
+
+    while True:
+        op = unpack("<B", patch)[0]
+
+        if op == END:
+            break
+        elif op == COPY:
+            offset, size = unpack("<QQ", patch)
+            if offset + size > original_size:
+                raise ValueError("The patch is corrupted.")
+            original.seek(offset)
+            copy_bytes(original, output, size, sha)
+        elif op == DATA:
+            size = unpack("<Q", patch)[0]
+            copy_bytes(patch, output, size, sha)
+        else:
+            raise ValueError("The patch is corrupted.")
+
+    if output.tell() != modified_size or sha.digest() != modified_hash:
+        raise ValueError("The patched file doesn't match, the patch is corrupted.")
+
+
+def open_original(original_path):
+    original = open(original_path, "rb")
+
+    if original.read(len(COMPRESSED_MAGIC)) != COMPRESSED_MAGIC:
+        original.seek(0)
+        return original
+
+    with original:
+        size = unpack("<I", original)[0]
+
+        # the zlib stream follows the size or the compressed size
+        for offset in (12, 16):
+            original.seek(offset)
+            header = original.read(2)
+            if len(header) == 2 and header[0] & 0x0F == 8 and int.from_bytes(header, "big") % 31 == 0:
+                original.seek(offset)
+                break
+        else:
+            raise ValueError("The compressed .pac file has an incorrect structure.")
+
+        decompressed = tempfile.TemporaryFile()
+        decompressor = zlib.decompressobj()
+
+        try:
+            for chunk in iter(lambda: original.read(BUFFER_SIZE), b""):
+                decompressed.write(decompressor.decompress(chunk))
+            decompressed.write(decompressor.flush())
+        except zlib.error:
+            raise ValueError("The compressed .pac file is corrupted.")
+
+        if decompressed.tell() != size:
+            raise ValueError("The compressed .pac file is truncated.")
+
+        decompressed.seek(0)
+        return decompressed
+
+
+def apply_patch(original_path, patch_path, output_path):
+    # written next to the output and only renamed over it once it's verified
+    temp_path = output_path + ".tmp"
+
+    try:
+        with open_original(original_path) as original, open(patch_path, "rb") as patch, \
+                open(temp_path, "wb") as output:
+            write_patched(original, patch, output)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    os.replace(temp_path, output_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print(__doc__)
+        sys.exit(1)
+
+    try:
+        apply_patch(*sys.argv[1:])
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    print(f"Wrote {sys.argv[3]}")
@@ -0,0 +1,67 @@
+"""
+Runs the encoding and packing of jobs the bot queued when __job_queue__ is set
+------------------------------------------------------------------------------
+python worker.py [name]
+start as many as you want, on any machine that sees the queue and the bot's temp directory at the same paths
+"""
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import traceback
+
+import psutil
+
+from config import config
+from config.utils.jobqueue import JobQueue
+from config.utils.scheduler import JobScheduler
+from config.utils.xwb import encode_track, pack_music
+
+TASKS = {
+    "encode": encode_track,
+    "pack": pack_music,
+}
+
+
+def keep_alive(queue: JobQueue, job_id: int, name: str, done: threading.Event):
+    while not done.wait(queue.stale_after / 4):
+        if not queue.heartbeat(job_id, name):
+            # cancelled or handed to another worker, whatever the job started is stopped so it fails fast
+            JobScheduler.kill_tree(psutil.Process().children(recursive=True))
+            return
+
+
+def run(queue: JobQueue, name: str):
+    while True:
+        job = queue.claim(name)
+
+        if job is None:
+            time.sleep(queue.poll_interval)
+            continue
+
+        payload = json.loads(job["payload"])
+        done = threading.Event()
+        threading.Thread(target=keep_alive, args=(queue, job["id"], name, done), daemon=True).start()
+
+        try:
+            result = TASKS[job["kind"]](*payload["args"], **payload["kwargs"])
+        except Exception as e:
+            traceback.print_exc()
+            queue.fail(job["id"], name, e)
+        else:
+            queue.complete(job["id"], name, result)
+        finally:
+            done.set()
+
+
+if __name__ == "__main__":
+    worker_name = sys.argv[1] if len(sys.argv) > 1 else f"{socket.gethostname()}-{os.getpid()}"
+    job_queue = JobQueue(config.__job_queue__, max_attempts=getattr(config, "__job_max_attempts__", 3))
+    print(f"{worker_name} is waiting for jobs in {config.__job_queue__}")
+
+    try:
+        run(job_queue, worker_name)
+    except KeyboardInterrupt:
+        pass